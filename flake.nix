@@ -33,6 +33,7 @@
       python = pkgs.python313;
       pythonDevDeps = python.withPackages (ps: [
         ps.beautifulsoup4
+        ps.numpy
         ps.pandas
         ps.pylint
         ps.pytest
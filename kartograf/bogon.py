@@ -1,5 +1,8 @@
+from bisect import bisect_right
 import ipaddress
 
+import numpy as np
+
 # Special-purpose IPv4 ranges
 SPECIAL_IPV4 = [
     # "This network", RFC791, Section 3.2
@@ -121,6 +124,27 @@ SPECIAL_IPV6 = [
 SPECIAL_IPV4_NETWORKS = {ipaddress.ip_network(prefix) for prefix in SPECIAL_IPV4}
 SPECIAL_IPV6_NETWORKS = {ipaddress.ip_network(prefix) for prefix in SPECIAL_IPV6}
 
+# Reserved ASNs
+RESERVED_ASNS = {
+    0,          # Reserved, RFC7607
+    112,        # AS112 project, RFC7534
+    23456,      # AS_TRANS, RFC6793
+    65535,      # Last 16 bit ASN, RFC7300
+    4294967295  # Last 32 bit ASN, RFC7300
+}
+
+# Reserved ASN ranges, both ends included
+RESERVED_ASN_RANGES = {
+    (64496, 64511),           # Documentation/Sample, RFC5398
+    (64512, 65534),           # Private use, RFC6996
+    (65536, 65551),           # Documentation/Sample, RFC5398
+    (65552, 131071),          # IANA reserved, no RFC
+    (4200000000, 4294967294)  # Private use, RFC6996
+}
+
+# ASNs are 32 bit numbers, RFC6793
+MAX_ASN = 4294967295
+
 def is_bogon_pfx(prefix):
     """
     This function is used to determine whether a given IP address (either IPv4
@@ -152,26 +176,10 @@ def is_bogon_asn(asn_raw):
     """
     asn = extract_asn(asn_raw)
 
-    reserved_asns = {
-        0,          # Reserved, RFC7607
-        112,        # AS112 project, RFC7534
-        23456,      # AS_TRANS, RFC6793
-        65535,      # Last 16 bit ASN, RFC7300
-        4294967295  # Last 32 bit ASN, RFC7300
-    }
-
-    if asn in reserved_asns:
+    if asn in RESERVED_ASNS:
         return True
 
-    reserved_asn_ranges = {
-        (64496, 64511),           # Documentation/Sample, RFC5398
-        (64512, 65534),           # Private use, RFC6996
-        (65536, 65551),           # Documentation/Sample, RFC5398
-        (65552, 131071),          # IANA reserved, no RFC
-        (4200000000, 4294967294)  # Private use, RFC6996
-    }
-
-    if any(start <= asn <= end for start, end in reserved_asn_ranges):
+    if any(start <= asn <= end for start, end in RESERVED_ASN_RANGES):
         return True
     return False
 
@@ -191,3 +199,117 @@ def is_out_of_encoding_range(asn_raw, max_asn_encoding=33521664):
         return True
 
     return False
+
+
+class BogonFilter:
+    '''
+    The checks of is_bogon_pfx and is_bogon_asn compiled into sorted tables
+    of integer ranges, so each check is a binary search instead of a scan of
+    all special networks and reserved ASN ranges.
+
+    Prefixes are checked in the normalized form of
+    kartograf.util.normalize_pfx. Only the special networks that are not
+    within another one are kept, those are disjoint, so a prefix is a bogon
+    if it is within the last one starting at or before it. Adjacent special
+    networks are not joined since a prefix covering both is not a subnet of
+    either. The reserved ASNs and ASN ranges are joined into disjoint ranges.
+
+    The batch methods check arrays of prefixes or ASNs at once with NumPy.
+    '''
+    def __init__(self, ipv4=None, ipv6=None, reserved_asns=None, reserved_asn_ranges=None):
+        ipv4 = SPECIAL_IPV4 if ipv4 is None else ipv4
+        ipv6 = SPECIAL_IPV6 if ipv6 is None else ipv6
+        reserved_asns = RESERVED_ASNS if reserved_asns is None else reserved_asns
+        if reserved_asn_ranges is None:
+            reserved_asn_ranges = RESERVED_ASN_RANGES
+
+        self._networks = {}
+        self._bits = {4: 32, 6: 128}
+        for version, prefixes in ((4, ipv4), (6, ipv6)):
+            networks = sorted(ipaddress.ip_network(prefix) for prefix in prefixes)
+            outermost = []
+            for network in networks:
+                if outermost and network.subnet_of(outermost[-1]):
+                    continue
+                outermost.append(network)
+            self._networks[version] = (
+                [int(network.network_address) for network in outermost],
+                [int(network.broadcast_address) for network in outermost],
+                max((network.prefixlen for network in outermost), default=0),
+            )
+
+        asn_ranges = sorted([(asn, asn) for asn in reserved_asns] + list(reserved_asn_ranges))
+        joined = []
+        for start, end in asn_ranges:
+            if joined and start <= joined[-1][1] + 1:
+                joined[-1][1] = max(joined[-1][1], end)
+            else:
+                joined.append([start, end])
+        self._asn_starts = [start for start, _ in joined]
+        self._asn_ends = [end for _, end in joined]
+
+    def is_bogon_network(self, version, network, prefixlen):
+        starts, ends, _ = self._networks[version]
+        last = network | ((1 << (self._bits[version] - prefixlen)) - 1)
+        i = bisect_right(starts, network) - 1
+        return i >= 0 and last <= ends[i]
+
+    def is_bogon_asn(self, asn):
+        '''The ASN may be an int or an "AS" string'''
+        if not isinstance(asn, int):
+            asn = extract_asn(asn)
+        i = bisect_right(self._asn_starts, asn) - 1
+        return i >= 0 and asn <= self._asn_ends[i]
+
+    @staticmethod
+    def _within(starts, ends, first, last):
+        '''For each range of first and last, if it is within one of the ranges'''
+        if not starts:
+            return np.zeros(len(first), dtype=bool)
+        starts = np.array(starts, dtype=np.uint64)
+        ends = np.array(ends, dtype=np.uint64)
+        i = np.searchsorted(starts, first, side="right") - 1
+        return (i >= 0) & (last <= ends[np.maximum(i, 0)])
+
+    def bogon_networks(self, prefixes):
+        '''
+        Check a sequence of normalized prefixes, returns a NumPy array of
+        booleans, True for each bogon prefix.
+
+        IPv6 addresses don't fit into 64 bit integers, but as long as no
+        special IPv6 network is longer than /64 their first 64 bits decide
+        if a prefix is within one, so the upper halves of the IPv6 prefixes
+        are checked instead.
+        '''
+        prefixes = list(prefixes)
+        result = np.zeros(len(prefixes), dtype=bool)
+        for version in (4, 6):
+            indexes = [i for i, prefix in enumerate(prefixes) if prefix[0] == version]
+            starts, ends, max_prefixlen = self._networks[version]
+            if not indexes:
+                continue
+            if version == 6 and max_prefixlen > 64:
+                result[indexes] = [self.is_bogon_network(*prefixes[i]) for i in indexes]
+                continue
+
+            bits = self._bits[version]
+            shift = bits - 64 if version == 6 else 0
+            first = np.fromiter((prefixes[i][1] >> shift for i in indexes),
+                                dtype=np.uint64, count=len(indexes))
+            last = np.fromiter(((prefixes[i][1] | ((1 << (bits - prefixes[i][2])) - 1)) >> shift
+                                for i in indexes), dtype=np.uint64, count=len(indexes))
+            result[indexes] = self._within([start >> shift for start in starts],
+                                           [end >> shift for end in ends], first, last)
+        return result
+
+    def bogon_asns(self, asns):
+        '''
+        Check a sequence or array of integer ASNs, returns a NumPy array of
+        booleans, True for each bogon ASN.
+        '''
+        asns = np.asarray(asns, dtype=np.uint64)
+        return self._within(self._asn_starts, self._asn_ends, asns, asns)
+
+
+# Shared filter for the parsers
+BOGON_FILTER = BogonFilter()
@@ -5,7 +5,6 @@ import os
 import sys
 import time
 import kartograf
-from kartograf.kartograf import Kartograf
 
 
 def create_parser():
@@ -22,6 +21,14 @@ def create_parser():
     # Delete artifacts from data directory after run
     parser_map.add_argument("-wd", "--wipe_data_dir", action="store_true", default=False)
 
+    # Pass results between the parse, merge and sort stages in memory. The
+    # intermediate files are only written in debug mode.
+    parser_map.add_argument("-im", "--in-memory", action="store_true", default=False)
+
+    # Profile each stage and write the profile dumps and a hotspots summary
+    # to the profile folder in the out directory of the run
+    parser_map.add_argument("-p", "--profile", action="store_true", default=False)
+
     parser_map.add_argument("-irr", "--irr", action="store_true", default=False)
     parser_map.add_argument("-rv", "--routeviews", action="store_true", default=False)
 
@@ -32,6 +39,16 @@ def create_parser():
     parser_map.add_argument("-r", "--reproduce", type=str, default=None)
     parser_map.add_argument("-t", "--epoch", type=str, default=None)
 
+    # Resume an interrupted run with the given epoch. Stages that completed
+    # before and whose inputs and outputs have not changed since are skipped.
+    parser_map.add_argument("-rs", "--resume", action="store_true", default=False)
+
+    # Reuse the parsed IRR and Routeviews entries of the run with the given
+    # epoch for all source files that have not changed since. The parsed
+    # entries of the run are stored for the next one, without an epoch they
+    # are only stored.
+    parser_map.add_argument("-inc", "--incremental", type=str, nargs="?", const="", default=None)
+
     # Waits until the provided epoch is reached before starting the map
     parser_map.add_argument("-w", "--wait", type=str, default=None)
 
@@ -44,6 +61,39 @@ def create_parser():
     # folder
     # parser_map.add_argument("-o", "--output", action="store_true", default=os.getcwd())
 
+    # Let rpki-client sync a cache directory that is shared by all runs
+    # instead of downloading all repositories from scratch. The cache of
+    # each run is a snapshot of the shared cache at the time of the run.
+    parser_map.add_argument("-rc", "--rpki-cache", type=str, default=None)
+
+    # Keep the validation results of ROAs in the given file between runs and
+    # only validate ROAs again if they or their certificate chain changed
+    parser_map.add_argument("-vc", "--validation-cache", type=str, default=None)
+
+    # Number of worker processes the stages of a run share, defaults to the
+    # number of CPUs
+    parser_map.add_argument("-mw", "--max-workers", type=int, default=None)
+
+    # Maximum number of rpki-client processes validating ROAs at a time,
+    # defaults to the share of the workers that is not parsing IRR DBs
+    parser_map.add_argument("-rw", "--rpki-workers", type=int, default=None)
+
+    # Maximum number of processes parsing IRR DBs at a time, defaults to half
+    # of the workers but no more than there are IRR DBs
+    parser_map.add_argument("-iw", "--irr-workers", type=int, default=None)
+
+    # Check which extra prefixes are covered by the base in chunks in worker
+    # processes, or all at once with NumPy
+    parser_map.add_argument("-mg", "--merge-engine", choices=["index", "vectorized"],
+                            default="index")
+
+    # Maximum number of files downloaded at the same time across all sources
+    parser_map.add_argument("-md", "--max-downloads", type=int, default=8)
+
+    # Keep the last copy of each downloaded file in the given directory and
+    # only download files again if they changed on the server since
+    parser_map.add_argument("-mi", "--mirror", type=str, default=None)
+
     # Use only a subset of known stable RPKI repositories instead of all sources
     parser_map.add_argument("-s", "--stable-repos", action="store_true", default=False,
                           help="Use only known stable RPKI repositories")
@@ -63,6 +113,8 @@ def create_parser():
     parser_merge.add_argument("-b", "--base", default=f"{os.getcwd()}/base_file.txt")
     parser_merge.add_argument("-e", "--extra", default=f"{os.getcwd()}/extra_file.txt")
     parser_merge.add_argument("-o", "--output", default=f"{os.getcwd()}/out_file.txt")
+    parser_merge.add_argument("-mg", "--merge-engine", choices=["index", "vectorized"],
+                              default="index")
 
     parser_cov = subparsers.add_parser("cov")
 
@@ -96,23 +148,45 @@ def main(args=None):
         sys.exit("Kartograf must be run as a non-root user.")
 
     if args.command == "map":
-        if not args.reproduce and args.epoch:
+        if not (args.reproduce or args.resume) and args.epoch:
             parser.error("--reproduce is required when --epoch is set.")
         elif not args.epoch and args.reproduce:
             parser.error("--epoch is required when --reproduce is set.")
+        elif not args.epoch and args.resume:
+            parser.error("--epoch is required when --resume is set.")
 
         if args.wait and args.reproduce:
             parser.error("--reproduce is not compatible with --wait.")
+        if args.wait and args.resume:
+            parser.error("--resume is not compatible with --wait.")
+
+        if args.max_workers is not None and args.max_workers < 1:
+            parser.error("--max-workers must be at least 1.")
+
+        if args.rpki_workers is not None and args.rpki_workers < 1:
+            parser.error("--rpki-workers must be at least 1.")
+
+        if args.irr_workers is not None and args.irr_workers < 1:
+            parser.error("--irr-workers must be at least 1.")
+
+        if args.max_downloads < 1:
+            parser.error("--max-downloads must be at least 1.")
 
         if args.wait and (int(args.wait) < time.time()):
             parser.error(f"Cannot wait for a timestamp in the past ({args.wait})")
 
+    # Each subcommand only imports the modules it uses, so short invocations
+    # like --version or cov don't pay for loading the whole map pipeline.
+    # pylint: disable=import-outside-toplevel
     if args.command == "map":
+        from kartograf.kartograf import Kartograf
         Kartograf.map(args)
     elif args.command == "cov":
-        Kartograf.cov(args)
+        from kartograf.coverage import coverage
+        coverage(args.map, args.list, args.output_covered, args.output_uncovered)
     elif args.command == "merge":
-        Kartograf.merge(args)
+        from kartograf.merge import general_merge
+        general_merge(args.base, args.extra, None, args.output, engine=args.merge_engine)
     else:
         parser.print_help()
         sys.exit("Please provide a command.")
@@ -1,22 +1,24 @@
 from pathlib import Path
 
 from kartograf.bogon import (
-    is_bogon_pfx,
-    is_bogon_asn,
+    BOGON_FILTER,
+    extract_asn,
     is_out_of_encoding_range,
 )
-from kartograf.timed import timed
-from kartograf.util import parse_pfx
+from kartograf.collectors.routeviews import pfx2as_source_hash
+from kartograf.prefix_map import PrefixMap, store_prefix_map
+from kartograf.timed import record_counts, timed
+from kartograf.util import format_pfx, normalize_pfx
 
 
-@timed
-def parse_routeviews_pfx2as(context):
-    raw_file = Path(context.out_dir_collectors) / "pfx2asn.txt"
-    clean_file = Path(context.out_dir_collectors) / "pfx2asn_clean.txt"
-    context.cleanup_out_files.append(raw_file)
-    written_lines = 0
+def parse_pfx2as_file(raw_file, context):
+    '''
+    Clean up the prefix to ASN entries of a pfx2as file. Returns the entries,
+    as the normalized prefix and the ASN, and the number of lines read.
+    '''
+    entries = []
 
-    with open(raw_file, 'r') as raw, open(clean_file, 'w') as clean:
+    with open(raw_file, 'r') as raw:
         lines = raw.readlines()
         for line in lines:
             # CAIDA PFX2AS files can contain multi-origin routes as well as
@@ -26,20 +28,19 @@ def parse_routeviews_pfx2as(context):
             if ',' not in line and '_' not in line:
                 # Still need to check for bogons
                 prefix, asn = line.split(" ")
-                prefix = parse_pfx(prefix)
-                asn = asn.upper().rstrip('\n')
+                normalized = normalize_pfx(prefix)
+                asn = extract_asn(asn)
 
                 if context.max_encode and is_out_of_encoding_range(asn, context.max_encode):
                     continue
 
-                if not prefix or is_bogon_pfx(prefix) or is_bogon_asn(asn):
+                if not normalized or BOGON_FILTER.is_bogon_network(*normalized) or BOGON_FILTER.is_bogon_asn(asn):
                     if context.debug_log:
                         with open(context.debug_log, 'a') as logs:
                             logs.write(f"Routeviews: parser encountered an invalid IP network: {prefix}")
                     continue
 
-                clean.write(f"{prefix} {asn}\n")
-                written_lines += 1
+                entries.append((normalized, asn))
                 continue
 
             # If the line contains a multi-origin route (signified by the _)
@@ -56,12 +57,12 @@ def parse_routeviews_pfx2as(context):
             # Bogon prefixes and ASNs are excluded since they can not be used
             # for routing.
             prefix, asn = line.split(" ")
-            prefix = parse_pfx(prefix)
-            asn = asn.upper().rstrip('\n')
+            normalized = normalize_pfx(prefix)
+            asn = extract_asn(asn)
 
-            if not prefix:
+            if not normalized:
                 continue
-            if is_bogon_pfx(prefix) or is_bogon_asn(asn):
+            if BOGON_FILTER.is_bogon_network(*normalized) or BOGON_FILTER.is_bogon_asn(asn):
                 if context.debug_log:
                     with open(context.debug_log, 'a') as logs:
                         logs.write(f"Routeviews: parser encountered an invalid IP network: {prefix}")
@@ -70,7 +71,35 @@ def parse_routeviews_pfx2as(context):
             if context.max_encode and is_out_of_encoding_range(asn, context.max_encode):
                 continue
 
-            clean.write(f"{prefix} {asn}\n")
-            written_lines += 1
+            entries.append((normalized, asn))
+
+    return entries, len(lines)
+
+
+@timed
+def parse_routeviews_pfx2as(context):
+    raw_file = Path(context.out_dir_collectors) / "pfx2asn.txt"
+    clean_file = Path(context.out_dir_collectors) / "pfx2asn_clean.txt"
+    context.cleanup_out_files.append(raw_file)
+
+    # In incremental runs the entries are taken from the previous epoch if
+    # neither of the pfx2as files has changed
+    source_hash = pfx2as_source_hash(context)
+    entries = context.parsed_sources.load("collectors", "pfx2asn", source_hash)
+    lines_count = 0
+    if entries is None:
+        entries, lines_count = parse_pfx2as_file(raw_file, context)
+    context.parsed_sources.save("collectors", "pfx2asn", source_hash, entries)
+
+    if context.in_memory:
+        prefix_map = PrefixMap()
+        for prefix, asn in entries:
+            prefix_map.add(*prefix, asn)
+        store_prefix_map(context, clean_file, prefix_map)
+    else:
+        with open(clean_file, 'w') as clean:
+            for prefix, asn in entries:
+                clean.write(f"{format_pfx(*prefix)} AS{asn}\n")
 
-    print("Entries after cleanup:", written_lines)
+    record_counts(records_in=lines_count, records_out=len(entries))
+    print("Entries after cleanup:", len(entries))
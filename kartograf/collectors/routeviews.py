@@ -7,8 +7,8 @@ import sys
 from bs4 import BeautifulSoup
 import requests
 
-from kartograf.timed import timed
-from kartograf.util import calculate_sha256
+from kartograf.timed import record_metrics, timed
+from kartograf.util import directory_manifest_path
 
 # Routeviews Prefix to AS mappings Dataset for IPv4 and IPv6
 # https://www.caida.org/catalog/datasets/routeviews-prefix2as/
@@ -16,14 +16,13 @@ PFX2AS_V4 = "https://publicdata.caida.org/datasets/routing/routeviews-prefix2as/
 PFX2AS_V6 = "https://publicdata.caida.org/datasets/routing/routeviews6-prefix2as/"
 
 
-def latest_link(base):
+def latest_link(base, downloads):
     now = datetime.now()
     ym = year_and_month(now)
     url = base + ym
 
     try:
-        response = requests.get(url, timeout=600)
-        response.raise_for_status()
+        response = downloads.get(url, timeout=600)
     except requests.exceptions.HTTPError:
         print(f"The page at {url} couldn't be fetched. "
               f"Trying the previous month.")
@@ -33,8 +32,7 @@ def latest_link(base):
         url = base + ym
 
         try:
-            response = requests.get(url, timeout=600)
-            response.raise_for_status()
+            response = downloads.get(url, timeout=600)
         except requests.exceptions.HTTPError:
             print(f"The page at {url} couldn't be fetched. "
                   f"Download of Routeviews pfx2as data failed.")
@@ -58,15 +56,6 @@ def year_and_month(now):
     return f'{year}/{month}/'
 
 
-def download(url, file):
-    print(f'Downloading from {url}')
-
-    response = requests.get(url, stream=True, timeout=300)
-    with open(file, 'wb') as gz:
-        for chunk in response.iter_content(chunk_size=8192):
-            gz.write(chunk)
-
-
 def extract(file, context):
     gz_file = Path(context.data_dir_collectors) / (file + ".gz")
     file = Path(context.out_dir_collectors) / file
@@ -92,13 +81,29 @@ def fetch_routeviews_pfx2as(context):
     v4_file_gz = path / "routeviews_pfx2asn_ip4.txt.gz"
     v6_file_gz = path / "routeviews_pfx2asn_ip6.txt.gz"
 
-    download(latest_link(PFX2AS_V4), v4_file_gz)
-    print(f"Downloaded {v4_file_gz.name}, file hash: {calculate_sha256(v4_file_gz)}")
-    download(latest_link(PFX2AS_V6), v6_file_gz)
-    print(f"Downloaded {v6_file_gz.name}, file hash: {calculate_sha256(v6_file_gz)}")
+    downloads = [(latest_link(PFX2AS_V4, context.downloads), v4_file_gz),
+                 (latest_link(PFX2AS_V6, context.downloads), v6_file_gz)]
+    for url, _ in downloads:
+        print(f'Downloading from {url}')
+    # Both files are downloaded at the same time
+    results = context.downloads.download_all(downloads)
+    record_metrics(downloads=results)
+    context.downloads.hash_directory(path, directory_manifest_path(path))
+
+
+def pfx2as_source_hash(context):
+    '''The source hash of the parsed pfx2as entries for incremental runs'''
+    path = Path(context.data_dir_collectors)
+    return context.parsed_sources.source_hash(path / "routeviews_pfx2asn_ip4.txt.gz",
+                                              path / "routeviews_pfx2asn_ip6.txt.gz")
 
 
 def extract_routeviews_pfx2as(context):
+    # The extracted files are not needed if the parsed entries of the
+    # previous epoch are reused
+    if context.parsed_sources.load("collectors", "pfx2asn", pfx2as_source_hash(context)) is not None:
+        return
+
     v4_file_name = 'routeviews_pfx2asn_ip4.txt'
     v6_file_name = 'routeviews_pfx2asn_ip6.txt'
 
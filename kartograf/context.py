@@ -1,8 +1,14 @@
 from datetime import datetime, UTC
+import os
 from pathlib import Path
 import sys
 import time
 
+from kartograf.download import DownloadManager
+from kartograf.incremental import ParsedSources
+from kartograf.irr.fetch import IRR_FILE_ADDRESSES
+from kartograf.timed import RunMetrics
+
 
 class Context:
     '''Keeps the context information of the current run'''
@@ -19,6 +25,9 @@ class Context:
             self.epoch = str(int(time.time()))
 
         self.reproduce = self.args.reproduce is not None
+        # A resumed run continues in the directories of the interrupted run
+        # with the same epoch.
+        self.resume = self.args.resume
         if self.reproduce:
             data_path = Path(self.args.reproduce)
             # in the data path, get the names of directories in the given path
@@ -41,7 +50,7 @@ class Context:
             abs_path = (Path("data") / self.epoch_dir).absolute()
             self.data_dir = str(abs_path)
 
-        if Path(self.data_dir).exists() and not self.reproduce:
+        if Path(self.data_dir).exists() and not (self.reproduce or self.resume):
             print("Not so fast, a folder with that epoch already exists.")
             sys.exit()
 
@@ -55,27 +64,73 @@ class Context:
         self.out_dir_rpki = str(Path(self.out_dir) / "rpki")
         self.out_dir_collectors = str(Path(self.out_dir) / "collectors")
 
+        # Long-lived rpki-client cache shared by all runs, each epoch keeps a
+        # snapshot of it in its data dir
+        self.rpki_shared_cache = None
+        if self.args.rpki_cache and not self.reproduce:
+            self.rpki_shared_cache = str(Path(self.args.rpki_cache).absolute())
+            Path(self.rpki_shared_cache).mkdir(parents=True, exist_ok=True)
+
+        # Validation results of unchanged ROAs are reused from this file
+        self.validation_cache_file = None
+        if self.args.validation_cache:
+            self.validation_cache_file = str(Path(self.args.validation_cache).absolute())
+
+        # Number of worker processes the stages of a run share. Validating
+        # RPKI and parsing IRR run at the same time, so by default they split
+        # the workers instead of both starting one per CPU. The merges run
+        # after both and use all of them.
+        self.max_workers = self.args.max_workers or os.cpu_count()
+        irr_share = min(self.max_workers // 2, len(IRR_FILE_ADDRESSES)) if self.args.irr else 0
+
+        # Maximum number of rpki-client processes validating ROAs at a time
+        self.rpki_workers = self.args.rpki_workers or max(self.max_workers - irr_share, 1)
+
+        # Maximum number of processes parsing IRR DBs at a time
+        self.irr_workers = self.args.irr_workers or max(irr_share, 1)
+
+        # Check the extra prefixes of the merges in worker processes or all
+        # at once with NumPy
+        self.merge_engine = self.args.merge_engine
+
+        # Downloads of all sources share connections and a concurrency limit
+        self.downloads = DownloadManager(max_concurrent=self.args.max_downloads,
+                                         mirror_dir=self.args.mirror)
+
         self.stable_repos = False
         if self.args.stable_repos:
             self.stable_repos = True
 
         self.cleanup_out_files = []
 
+        # In memory mode the parse, merge and sort stages hand their results
+        # to each other as PrefixMaps, keyed by the path of the file they
+        # would otherwise write.
+        self.in_memory = self.args.in_memory
+        self.prefix_maps = {}
+
         # We skip creating the folders if we are reproducing a run.
         if not self.reproduce:
-            Path(self.data_dir_rpki_cache).mkdir(parents=True)
-            Path(self.data_dir_rpki_tals).mkdir(parents=True)
+            Path(self.data_dir_rpki_cache).mkdir(parents=True, exist_ok=self.resume)
+            Path(self.data_dir_rpki_tals).mkdir(parents=True, exist_ok=self.resume)
             if self.args.irr:
-                Path(self.data_dir_irr).mkdir(parents=True)
+                Path(self.data_dir_irr).mkdir(parents=True, exist_ok=self.resume)
             if self.args.routeviews:
-                Path(self.data_dir_collectors).mkdir(parents=True)
-        Path(self.out_dir_rpki).mkdir(parents=True)
+                Path(self.data_dir_collectors).mkdir(parents=True, exist_ok=self.resume)
+        Path(self.out_dir_rpki).mkdir(parents=True, exist_ok=self.resume)
         if self.args.irr:
-            Path(self.out_dir_irr).mkdir(parents=True)
+            Path(self.out_dir_irr).mkdir(parents=True, exist_ok=self.resume)
         if self.args.routeviews:
-            Path(self.out_dir_collectors).mkdir(parents=True)
+            Path(self.out_dir_collectors).mkdir(parents=True, exist_ok=self.resume)
 
         self.final_result_file = str(Path(self.out_dir) / "final_result.txt")
+        # Records the completed stages of the run, see StageManifest
+        self.manifest_file = str(Path(self.out_dir) / "stage_manifest.json")
+        # Performance report of the timed stages of the run
+        self.metrics = RunMetrics()
+        self.metrics_file = str(Path(self.out_dir) / "run_metrics.json")
+        # Per stage profile dumps when profiling is enabled
+        self.profile_dir = str(Path(self.out_dir) / "profile")
 
         self.max_encode = self.args.max_encode
 
@@ -84,6 +139,10 @@ class Context:
         else:
             self.debug_log = ""
 
+        # Parsed entries per source file, reused from the previous epoch in
+        # incremental runs
+        self.parsed_sources = ParsedSources(self)
+
 
     def _set_epoch_dirs(self):
         '''
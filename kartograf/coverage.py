@@ -1,6 +1,4 @@
 import ipaddress
-import numpy as np
-import pandas as pd
 
 
 def coverage(map_file, ip_list_file, output_covered=None, output_uncovered=None):
@@ -23,9 +21,7 @@ def coverage(map_file, ip_list_file, output_covered=None, output_uncovered=None)
         nets.append(netw)
         asns.append(asn)
 
-    net_masks = np.array(masks)
-    network_addresses = np.array(nets)
-    zipped = list(zip(net_masks, network_addresses, asns))
+    zipped = list(zip(masks, nets, asns))
 
     addrs = []
     for line in ip_list_file:
@@ -38,45 +34,43 @@ def coverage(map_file, ip_list_file, output_covered=None, output_uncovered=None)
                   Please remove and re-run.
                   """)
 
-    df = pd.DataFrame({'ADDRS': addrs})
-
     def check_coverage(addr):
         for mask, net_addr, asn in zipped:
             if (addr & mask) == net_addr:
                 return asn
         return 0
 
-    df['COVERED'] = df.ADDRS.apply(check_coverage)
-    df_cov = df[df.COVERED != 0]
+    results = [(addr, check_coverage(addr)) for addr in addrs]
+    covered = [(addr, asn) for addr, asn in results if asn != 0]
 
-    len_covered = len(df_cov)
-    total = len(df)
+    len_covered = len(covered)
+    total = len(results)
     percentage = (len_covered / total) * 100
     print(f"A total of {len_covered} IPs out of {total} are covered by the map. "
           f"That's {percentage:.2f}%")
 
     if output_covered:
         if percentage > 0:
-            write_covered(df_cov, output_covered, len_covered)
+            write_covered(covered, output_covered, len_covered)
         else:
             print(f"No covered IPs, nothing to write to {output_covered}.")
     if output_uncovered:
         if percentage < 100:
-            df_uncov = df[df.COVERED == 0]
-            write_uncovered(df_uncov, output_uncovered, total - len_covered)
+            uncovered = [addr for addr, asn in results if asn == 0]
+            write_uncovered(uncovered, output_uncovered, total - len_covered)
         else:
             print(f"All IPs covered, nothing to write to {output_uncovered}.")
 
-def write_covered(df_cov, output_file, output_len):
+def write_covered(covered, output_file, output_len):
     with open(output_file, 'w+') as f:
-        for addr, asn in zip(df_cov['ADDRS'], df_cov['COVERED']):
+        for addr, asn in covered:
             formatted = str(ipaddress.ip_address(addr))
             f.write(f"{formatted} {asn}\n")
         print(f"Wrote {output_len} IP addresses to {output_file}")
 
-def write_uncovered(df_uncov, output_file, output_len):
+def write_uncovered(uncovered, output_file, output_len):
     with open(output_file, 'w+') as f:
-        for addr in df_uncov['ADDRS']:
+        for addr in uncovered:
             formatted = str(ipaddress.ip_address(addr))
             f.write(f"{formatted}\n")
         print(f"Wrote {output_len} IP addresses to {output_file}")
@@ -0,0 +1,338 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+from threading import BoundedSemaphore, Lock
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from kartograf.util import hash_directory, link_or_copy
+
+# Downloads are written in large chunks, the IRR dumps are hundreds of MB
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Progress of a download is reported whenever another quarter is done
+PROGRESS_STEPS = 4
+
+
+class DownloadError(Exception):
+    '''A download failed in all attempts'''
+
+
+def resume_validator(headers):
+    '''
+    The validator for the If-Range header of a request that continues the
+    download of a response with these headers. Weak ETags can't be used
+    for ranges, so the Last-Modified date is used instead. None if the
+    response has neither.
+    '''
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def content_range_start(value):
+    '''The first byte position of a Content-Range header, None if it has none'''
+    match = re.fullmatch(r"bytes (\d+)-\d+/(\d+|\*)", (value or "").strip())
+    return int(match.group(1)) if match else None
+
+
+class DownloadSink:
+    '''
+    Writes a download to a file and hashes it while it is written, so the
+    file doesn't have to be read again to get its hash.
+
+    A sink can continue a partial download, the bytes already in the file
+    up to the offset are kept and hashed first.
+    '''
+    def __init__(self, path, offset=0):
+        self.path = Path(path)
+        self.offset = offset
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.duration = None
+        self._file = None
+        self._start = None
+
+    def __enter__(self):
+        if self.offset:
+            self._file = open(self.path, "r+b")
+            self._file.truncate(self.offset)
+            for block in iter(partial(self._file.read, DOWNLOAD_CHUNK_SIZE), b""):
+                self.sha256.update(block)
+        else:
+            # The file may be a hardlink into the mirror or another epoch,
+            # those must not be overwritten
+            self.path.unlink(missing_ok=True)
+            self._file = open(self.path, "wb")
+        self.size = self.offset
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        self.duration = time.perf_counter() - self._start
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    def throughput(self):
+        '''Bytes per second transferred by this sink'''
+        if not self.duration:
+            return 0.0
+        return (self.size - self.offset) / self.duration
+
+    def summary(self):
+        return (f"{self.size / 1e6:.1f} MB in {self.duration:.2f}s "
+                f"({self.throughput() / 1e6:.1f} MB/s)")
+
+
+class ContentMirror:
+    '''
+    Keeps the last downloaded copy of each URL together with the ETag and
+    Last-Modified headers the server sent for it. Downloads of a URL ask
+    the server to only send it if it changed since, and files that have not
+    changed are hardlinked from the mirror.
+    '''
+    def __init__(self, mirror_dir):
+        self.mirror_dir = Path(mirror_dir)
+        self.mirror_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()[:16]
+        file = self.mirror_dir / f"{key}_{url.rsplit('/', maxsplit=1)[-1]}"
+        return file, file.with_name(file.name + ".json")
+
+    def metadata(self, url):
+        file, meta = self._paths(url)
+        if not (file.exists() and meta.exists()):
+            return None
+        with open(meta, "r") as f:
+            return json.load(f)
+
+    def conditional_headers(self, url):
+        metadata = self.metadata(url)
+        headers = {}
+        if metadata and metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata and metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+        return headers
+
+    def restore(self, url, path):
+        '''Put the mirrored copy of the URL at path, returns its metadata.'''
+        file, _ = self._paths(url)
+        link_or_copy(file, path)
+        return self.metadata(url)
+
+    def update(self, url, path, headers, sha256):
+        '''Make the downloaded file at path the mirrored copy of the URL.'''
+        file, meta = self._paths(url)
+        tmp_file = file.with_name(file.name + ".tmp")
+        link_or_copy(path, tmp_file)
+        os.replace(tmp_file, file)
+
+        tmp_meta = meta.with_name(meta.name + ".tmp")
+        with open(tmp_meta, "w") as f:
+            json.dump({
+                "url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "sha256": sha256,
+                "size": file.stat().st_size,
+            }, f)
+        os.replace(tmp_meta, meta)
+
+
+class DownloadManager:
+    '''
+    Downloads the files of all sources of a run over one HTTP session.
+
+    Connections to a host are kept alive and reused by the downloads from
+    it, at most max_concurrent downloads run at the same time across all
+    sources, and a download that fails part way through is continued with
+    a Range request where the server supports it. The metrics of every
+    finished download are collected for the run metrics. With a mirror,
+    files that have not changed on the server are not downloaded again.
+    '''
+    def __init__(self, max_concurrent=8, max_retries=5, retry_delay=2, timeout=(15, 120),
+                 mirror_dir=None):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_concurrent)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.mirror = ContentMirror(mirror_dir) if mirror_dir else None
+        self._slots = BoundedSemaphore(max_concurrent)
+        self._lock = Lock()
+        self.downloads = []
+        self._file_hashes = {}
+
+    def get(self, url, **kwargs):
+        '''Fetch a small resource, like an index page, over the shared session.'''
+        kwargs.setdefault("timeout", self.timeout)
+        with self._slots:
+            response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _transfer(self, url, path, offset, validator):
+        '''
+        Download the URL to path from the offset on. Returns the sink and the
+        response headers, or None if the mirrored copy is still current.
+
+        A partial download is only continued if the server still has the
+        version it was started from, the validator of that version is kept
+        in the validator dict between the attempts of a download.
+        '''
+        while True:
+            if offset and validator.get("if_range"):
+                headers = {"Range": f"bytes={offset}-", "If-Range": validator["if_range"]}
+            elif self.mirror:
+                offset = 0
+                headers = self.mirror.conditional_headers(url)
+            else:
+                offset = 0
+                headers = {}
+            with self._slots, self.session.get(url, stream=True, timeout=self.timeout,
+                                               headers=headers) as response:
+                if response.status_code == 304:
+                    return None
+                if offset and response.status_code == 416:
+                    # The partial file can't be continued, start over
+                    offset = 0
+                    continue
+                response.raise_for_status()
+                if response.status_code == 206:
+                    if content_range_start(response.headers.get("Content-Range")) != offset:
+                        # The range doesn't continue the partial file
+                        offset = 0
+                        continue
+                else:
+                    # The full file was sent, because it changed since the
+                    # partial download or the server ignores ranges
+                    offset = 0
+                    validator["if_range"] = resume_validator(response.headers)
+                return self._write(response, path, offset), response.headers
+
+    def _write(self, response, path, offset):
+        total = response.headers.get("Content-Length")
+        total = int(total) + offset if total else None
+        next_step = 1
+        with DownloadSink(path, offset) as sink:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                sink.write(chunk)
+                if total and sink.size * PROGRESS_STEPS >= total * next_step:
+                    if next_step < PROGRESS_STEPS:
+                        print(f"{path.name}: {next_step * 100 // PROGRESS_STEPS}% of {total / 1e6:.1f} MB")
+                    while sink.size * PROGRESS_STEPS >= total * next_step:
+                        next_step += 1
+        return sink
+
+    def download(self, url, path):
+        '''
+        Download a URL to a file with retries, returns the metrics of the
+        download. Raises DownloadError if all attempts failed.
+        '''
+        path = Path(path)
+        start = time.perf_counter()
+        attempt = 1
+        offset = 0
+        validator = {}
+        while True:
+            try:
+                transfer = self._transfer(url, path, offset, validator)
+                break
+            except (requests.RequestException, ConnectionError) as e:
+                print(f"Connection issue while downloading {path.name}: {e}. Retrying... (Attempt {attempt}/{self.max_retries})")
+                if attempt == self.max_retries:
+                    raise DownloadError(f"Failed to download {path.name} after {self.max_retries} attempts.") from e
+                attempt += 1
+                time.sleep(self.retry_delay)
+                # The next attempt continues after the bytes received so far
+                offset = path.stat().st_size if path.exists() else 0
+
+        if transfer is None:
+            metadata = self.mirror.restore(url, path)
+            result = {
+                "url": url,
+                "file": path.name,
+                "sha256": metadata["sha256"],
+                "bytes": 0,
+                "resumed_bytes": 0,
+                "attempts": attempt,
+                "duration": time.perf_counter() - start,
+                "throughput": 0.0,
+                "not_modified": True,
+            }
+            print(f"{path.name} has not changed, linked from the mirror, file hash: {result['sha256']}")
+        else:
+            sink, headers = transfer
+            if self.mirror:
+                self.mirror.update(url, path, headers, sink.hexdigest())
+            duration = time.perf_counter() - start
+            result = {
+                "url": url,
+                "file": path.name,
+                "sha256": sink.hexdigest(),
+                "bytes": sink.size,
+                "resumed_bytes": sink.offset,
+                "attempts": attempt,
+                "duration": duration,
+                "throughput": sink.size / duration if duration else 0.0,
+                "not_modified": False,
+            }
+            print(f"Downloaded {path.name}, file hash: {result['sha256']}, {sink.summary()}")
+
+        with self._lock:
+            self.downloads.append(result)
+            self._file_hashes[os.path.abspath(path)] = result["sha256"]
+        return result
+
+    def file_hash(self, path):
+        '''
+        The sha256 of a file that was downloaded in this run, computed while
+        it was written. None if the file was not downloaded.
+        '''
+        with self._lock:
+            return self._file_hashes.get(os.path.abspath(path))
+
+    def hash_directory(self, directory, manifest_path):
+        '''
+        Write the hash_directory manifest of a directory of downloads and
+        return its digest. The files downloaded in this run are not read
+        again, their hashes were computed while they were written.
+        '''
+        with self._lock:
+            known_hashes = dict(self._file_hashes)
+        digest, _ = hash_directory(directory, manifest_path, known_hashes=known_hashes)
+        return digest
+
+    def download_all(self, downloads):
+        '''
+        Download a list of (url, path) pairs concurrently, within the limit of
+        concurrent downloads. Returns their metrics in the order given.
+        '''
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            futures = [executor.submit(self.download, url, path) for url, path in downloads]
+            return [future.result() for future in futures]
+
+    def metrics(self):
+        with self._lock:
+            return list(self.downloads)
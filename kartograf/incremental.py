@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+
+from kartograf import __version__
+from kartograf.util import calculate_sha256
+
+# Version of the form of the stored entries, entries stored in another form
+# are not reused
+ENTRIES_FORMAT = 3
+
+
+class ParsedSources:
+    '''
+    Stores the parsed entries of each source file of a run, together with
+    the sha256 of the source file they were parsed from.
+
+    In an incremental run the parsed entries of a previous epoch are reused
+    for every source file that has not changed since, so only the changed
+    sources have to be parsed again. The entries are only reused if they were
+    parsed by the same kartograf version with the same settings. Entries are
+    only stored in incremental runs, including the first run of a chain that
+    has no previous epoch.
+    '''
+    def __init__(self, context):
+        self.parsed_dir = Path(context.out_dir) / "parsed"
+        self.enabled = context.args.incremental is not None
+        self.downloads = context.downloads
+        self.previous_dir = None
+        self._loaded = {}
+        if context.args.incremental:
+            out_root = Path(context.out_dir).parent
+            self.previous_dir = out_root / context.args.incremental / "parsed"
+        self.settings = {
+            "version": __version__,
+            "max_encode": context.max_encode,
+            "entries_format": ENTRIES_FORMAT,
+        }
+
+    def source_hash(self, *source_files):
+        '''
+        Hash of the source files, None if parsed entries are not stored in
+        this run or any of the files is missing, which means their parsed
+        entries can not be reused or stored. The hashes of files downloaded
+        in this run are taken from the download, other files are read.
+        '''
+        if not self.enabled or not all(Path(f).is_file() for f in source_files):
+            return None
+        return ":".join(self.downloads.file_hash(f) or calculate_sha256(f)
+                        for f in source_files)
+
+    def load(self, kind, name, source_hash):
+        if self.previous_dir is None or source_hash is None:
+            return None
+        # The entries may be asked for again before they are used
+        key = (kind, name, source_hash)
+        if key not in self._loaded:
+            self._loaded[key] = self._load(kind, name, source_hash)
+        return self._loaded[key]
+
+    def _load(self, kind, name, source_hash):
+
+        path = self.previous_dir / kind / f"{name}.json"
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            parsed = json.load(f)
+
+        if parsed["source_sha256"] != source_hash or parsed["settings"] != self.settings:
+            return None
+        print(f"Reusing parsed {name} from {self.previous_dir.parent.name}, source unchanged")
+        return parsed["entries"]
+
+    def save(self, kind, name, source_hash, entries):
+        if not self.enabled or source_hash is None:
+            return
+
+        path = self.parsed_dir / kind / f"{name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({
+                "source_sha256": source_hash,
+                "settings": self.settings,
+                "entries": entries,
+            }, f)
@@ -1,117 +1,177 @@
-import codecs
-from datetime import datetime, timezone
-import os
+import gzip
 from pathlib import Path
 from typing import Dict
 
 from kartograf.bogon import (
-    is_bogon_pfx,
-    is_bogon_asn,
+    BOGON_FILTER,
+    extract_asn,
     is_out_of_encoding_range,
 )
-from kartograf.timed import timed
-from kartograf.util import parse_pfx, rir_from_str
+from kartograf.irr.rpsl import iter_rpsl_objects
+from kartograf.prefix_map import PrefixMap, store_prefix_map
+from kartograf.timed import record_counts, record_metrics, timed
+from kartograf.util import format_pfx, normalize_pfx, parse_iso8601_timestamp, process_pool, rir_from_str
+
+
+def update_best_entry(output_cache, route, origin, last_modified):
+    '''
+    There are duplicates and multiple entries for some prefixes in the IRR
+    DBs, so we need to deal with them here. The origin is the ASN as int.
+    '''
+    if output_cache.get(route):
+        [old_origin, old_last_modified] = output_cache[route]
+
+        # If there are two entries for the same prefix, we prefer the one with
+        # the newer last-modified date.
+        if int(last_modified) > int(old_last_modified):
+            output_cache[route] = [origin, last_modified]
+
+        # If the last-modified date is the same, we use the lower ASN as a
+        # deterministic tie-breaker.
+        if int(last_modified) == int(old_last_modified):
+            if origin < old_origin:
+                output_cache[route] = [origin, last_modified]
+
+    else:
+        output_cache[route] = [origin, last_modified]
+
+
+def parse_irr_file(file, max_encode=None, debug_log=None):
+    '''
+    Parse the route objects of a single gzipped IRR DB and keep the best
+    entry for each prefix. Returns the entries and the number of RPSL objects
+    found.
+    '''
+    # We need to know the RIR of the file to check if it is equal to the
+    # source later
+    rir = rir_from_str(Path(file).name)
+    # Entries are keyed on the normalized prefix, it is only formatted when
+    # the result is written
+    output_cache: Dict[tuple, list] = {}
+
+    objects_count = 0
+
+    # The RPSL objects are scanned one at a time while the DB is decompressed
+    # and decoded, so the DB is never extracted to disk or held in memory as
+    # a whole. Only the attributes that are used here are kept per object.
+    with gzip.open(file, 'rt', encoding='ISO-8859-1') as f:
+        for entry in iter_rpsl_objects(f):
+            objects_count += 1
+
+            is_complete = "origin" in entry and "source" in entry
+            route = entry.get("route") or entry.get("route6")
+            # Some RIRs mirror some other RIRs in their DBs, ignore the
+            # mirrored entries
+            if not (is_complete and route) or entry["source"] != rir:
+                continue
+
+            normalized = normalize_pfx(route)
+            if not normalized:
+                if debug_log:
+                    with open(debug_log, 'a') as logs:
+                        logs.write(f"Could not parse prefix from line: {route}")
+                continue
+
+            # Sometimes there are comments in the origin field, remove
+            # these
+            try:
+                origin = extract_asn(entry["origin"].split(" #", 1)[0])
+            except ValueError:
+                if debug_log:
+                    with open(debug_log, 'a') as logs:
+                        logs.write(f"IRR: parser encountered an invalid origin: {entry['origin']} for route {format_pfx(*normalized)}\n")
+                continue
+
+            # AFRINIC and LACNIC appear to not use last modified anymore
+            last_modified = parse_iso8601_timestamp(entry.get("last-modified", "2009-01-03T19:15:05Z"))
+
+            # Bogon prefixes and ASNs are excluded since they can not
+            # be used for routing.
+            if BOGON_FILTER.is_bogon_network(*normalized) or BOGON_FILTER.is_bogon_asn(origin):
+                if debug_log:
+                    with open(debug_log, 'a') as logs:
+                        logs.write(f"IRR: parser encountered an invalid route: {format_pfx(*normalized)}\n")
+                continue
+
+            if max_encode and is_out_of_encoding_range(origin, max_encode):
+                continue
+
+            update_best_entry(output_cache, normalized, origin, last_modified)
+
+    return output_cache, objects_count
+
+
+def parse_irr_worker(file, max_encode, debug_log):
+    '''
+    Parse an IRR DB in a worker process. Returns the best entries of the DB
+    as a list of [route, origin, last_modified] in the order they were found,
+    with the route in its normalized form, and the number of RPSL objects
+    found.
+    '''
+    file_cache, objects_count = parse_irr_file(file, max_encode, debug_log)
+    entries = [[list(route), origin, last_modified]
+               for route, [origin, last_modified] in file_cache.items()]
+    return entries, objects_count
 
 
 @timed
 def parse_irr(context):
     irr_res = Path(context.out_dir_irr) / "irr_final.txt"
 
-    irr_files = [path for path in Path(context.out_dir_irr).rglob('*')
-                 if os.path.isfile(path)
-                 and (os.path.splitext(path)[1] != ".gz")]
-
-    context.cleanup_out_files += irr_files
-    output_cache: Dict[str, str] = {}
+    # The IRR DBs are read directly from the downloaded gzip files
+    irr_files = sorted(Path(context.data_dir_irr).glob('*.gz'))
+
+    # In incremental runs the entries of unchanged IRR DBs are taken from
+    # the previous epoch
+    source_hashes = {file: context.parsed_sources.source_hash(file) for file in irr_files}
+    reused = {file: context.parsed_sources.load("irr", file.stem, source_hashes[file])
+              for file in irr_files}
+    to_parse = [file for file in irr_files if reused[file] is None]
+
+    # The IRR DBs are independent of each other until their entries are
+    # combined, so they are parsed in parallel, one worker process per DB.
+    # The largest DBs are started first since they take the longest.
+    workers = min(context.irr_workers, len(to_parse)) or 1
+    to_parse.sort(key=lambda file: file.stat().st_size, reverse=True)
+    args = (context.max_encode, context.debug_log)
+    if workers > 1:
+        with process_pool(max_workers=workers) as executor:
+            futures = {file: executor.submit(parse_irr_worker, file, *args) for file in to_parse}
+            parsed = {file: future.result() for file, future in futures.items()}
+    else:
+        parsed = {file: parse_irr_worker(file, *args) for file in to_parse}
+    record_metrics(irr_workers=workers)
+
+    output_cache: Dict[tuple, list] = {}
+    objects_count = 0
 
     for file in irr_files:
-        # We need to know the RIR of the file to check if it is equal to the
-        # source later
-        rir = rir_from_str(str(file))
-
-        with codecs.open(file, 'r', encoding='ISO-8859-1') as f:
-            lines = f.readlines()
-
-        entry_list = []
-        current_entry = {}
+        name = file.stem
+        entries = reused[file]
+        if entries is None:
+            entries, file_objects = parsed[file]
+            objects_count += file_objects
+        context.parsed_sources.save("irr", name, source_hashes[file], entries)
+
+        # Entries of different IRR DBs are combined with the same rules as
+        # within a single DB, always in the order of the files regardless of
+        # the order the workers finished in, so the result is deterministic
         prev_count = len(output_cache)
+        for route, origin, last_modified in entries:
+            update_best_entry(output_cache, tuple(route), origin, last_modified)
 
-        # Parse the RPSL objects in the IRR DB into Python Dicts
-        for line in lines:
-            if line == '\n':
-                entry_list.append(current_entry)
-                current_entry = {}
-            else:
-                if ":" in line:
-                    k, v = line.strip().split(':', 1)
-                    current_entry[k.strip()] = v.strip()
-
-        for entry in entry_list:
-            is_complete = all(k in entry for k in ("origin", "source"))
-            has_route = any(k in entry for k in ("route", "route6"))
-            if is_complete and has_route:
-                # Some RIRs mirror some other RIRs in their DBs, ignore the
-                # mirrored entries
-                if entry["source"] == rir:
-                    # Sometimes there are comments in the origin field, remove
-                    # these
-                    origin = entry["origin"].split(" #", 1)[0].upper()
-                    if "route" in entry:
-                        route = entry["route"]
-                    elif "route6" in entry:
-                        route = entry["route6"]
-                    else:
-                        continue
-
-                    parsed_route = parse_pfx(route)
-                    if not parsed_route:
-                        if context.debug_log:
-                            with open(context.debug_log, 'a') as logs:
-                                logs.write(f"Could not parse prefix from line: {route}")
-                        continue
-
-                    # AFRINIC and LACNIC appear to not use last modified anymore
-                    last_modified = entry.get("last-modified", "2009-01-03T19:15:05Z")
-                    last_modified = datetime.strptime(last_modified, '%Y-%m-%dT%H:%M:%SZ')
-                    last_modified = last_modified.replace(tzinfo=timezone.utc)
-                    last_modified = last_modified.timestamp()
-
-                    # Bogon prefixes and ASNs are excluded since they can not
-                    # be used for routing.
-                    if is_bogon_pfx(parsed_route) or is_bogon_asn(origin):
-                        if context.debug_log:
-                            with open(context.debug_log, 'a') as logs:
-                                logs.write(f"IRR: parser encountered an invalid route: {parsed_route}\n")
-                        continue
-
-                    if context.max_encode and is_out_of_encoding_range(origin, context.max_encode):
-                        continue
-
-                    # There are duplicates and multiple entries for some
-                    # prefixes in the IRR DBs, so we need to deal with them
-                    # here.
-                    if output_cache.get(parsed_route):
-                        [old_origin, old_last_modified] = output_cache[parsed_route]
-
-                        # If there are two entries for the same prefix, we
-                        # prefer the one with the newer last-modified date.
-                        if int(last_modified) > int(old_last_modified):
-                            output_cache[parsed_route] = [origin, last_modified]
-
-                        # If the last-modified date is the same, we use the
-                        # lower ASN as a deterministic tie-breaker.
-                        if int(last_modified) == int(old_last_modified):
-                            if int(origin[2:]) < int(old_origin[2:]):
-                                output_cache[parsed_route] = [origin, last_modified]
-
-                    else:
-                        output_cache[parsed_route] = [origin, last_modified]
-
-        print(f"Parsed {file.name}, found: {len(output_cache) - prev_count}")
+        print(f"Parsed {name}, found: {len(output_cache) - prev_count}")
 
     print("Found valid, unique entries:", len(output_cache))
+    record_counts(records_in=objects_count, records_out=len(output_cache))
 
-    with open(irr_res, "a+") as irr:
+    if context.in_memory:
+        prefix_map = PrefixMap()
         for route, [origin, _] in output_cache.items():
-            line_out = f"{route} {origin}\n"
-            irr.write(line_out)
+            prefix_map.add(*route, origin)
+        store_prefix_map(context, irr_res, prefix_map)
+    else:
+        with open(irr_res, "w") as irr:
+            for route, [origin, _] in output_cache.items():
+                line_out = f"{format_pfx(*route)} AS{origin}\n"
+                irr.write(line_out)
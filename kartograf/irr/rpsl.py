@@ -0,0 +1,55 @@
+'''
+Scanner for the RPSL objects of the IRR DBs.
+'''
+
+# The only attributes of the route objects that kartograf uses
+ROUTE_ATTRIBUTES = frozenset(("route", "route6", "origin", "source", "last-modified"))
+
+# An attribute value can be continued on the next line if it starts with
+# one of these characters, see RFC 2622 section 2
+CONTINUATION_CHARS = " \t+"
+
+COMMENT_CHARS = "%#"
+
+
+def iter_rpsl_objects(lines, attributes=ROUTE_ATTRIBUTES):
+    '''
+    Scan the RPSL objects from an iterable of lines and yield one dict per
+    object, as soon as the object is complete. Each dict holds only the
+    given attributes that are present in the object, all other attributes
+    are skipped without being split or stripped. Continuation lines are
+    joined with the value of their attribute by a single space.
+
+    If an attribute appears more than once in an object the last value is
+    kept. Objects are separated by empty lines, the last object of the input
+    doesn't need to be followed by one.
+    '''
+    record = {}
+    key = None
+    in_object = False
+
+    for line in lines:
+        first = line[:1]
+        if first and first in CONTINUATION_CHARS and not line.isspace():
+            value = line[1:].strip()
+            if key is not None and value:
+                record[key] = f"{record[key]} {value}" if record[key] else value
+        elif first and first in COMMENT_CHARS:
+            continue
+        elif not first or first.isspace():
+            if in_object:
+                yield record
+                record = {}
+                key = None
+                in_object = False
+        else:
+            in_object = True
+            sep = line.find(":")
+            key = line[:sep] if sep > 0 else None
+            if key in attributes:
+                record[key] = line[sep + 1:].strip()
+            else:
+                key = None
+
+    if in_object:
+        yield record
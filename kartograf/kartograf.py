@@ -1,29 +1,116 @@
 import datetime
 from datetime import timezone
+from pathlib import Path
 import shutil
 import time
 
 from kartograf.cleanup import cleanup_out_files
 
 from kartograf.context import Context
-from kartograf.coverage import coverage
 from kartograf.collectors.routeviews import extract_routeviews_pfx2as, fetch_routeviews_pfx2as
 from kartograf.collectors.parse import parse_routeviews_pfx2as
-from kartograf.irr.fetch import extract_irr, fetch_irr
+from kartograf.irr.fetch import fetch_irr
 from kartograf.irr.parse import parse_irr
-from kartograf.merge import merge_irr, merge_pfx2as, general_merge
-from kartograf.rpki.fetch import fetch_rpki_db, validate_rpki_db
+from kartograf.merge import merge_irr, merge_pfx2as
+from kartograf.pipeline import Pipeline, Stage, StageManifest
+from kartograf.profiling import StageProfiler
+from kartograf.rpki.fetch import cache_manifest_path, fetch_rpki_db, validate_rpki_db
 from kartograf.rpki.parse import parse_rpki
 from kartograf.sort import sort_result_by_pfx
 from kartograf.util import (
     calculate_sha256,
     check_compatibility,
+    directory_manifest_path,
     print_section_header,
     wait_for_launch
 )
 
 from . import __version__
 
+
+def map_stages(context):
+    '''
+    Declare the stages of a map run with the artifacts they read and write.
+    Fetching and parsing of the different sources is independent of each
+    other, only the merges have to wait for their base and extra data.
+    '''
+    rpki_raw = Path(context.out_dir_rpki) / "rpki_raw.ndjson"
+    rpki_final = Path(context.out_dir_rpki) / "rpki_final.txt"
+    irr_final = Path(context.out_dir_irr) / "irr_final.txt"
+    rv_clean = Path(context.out_dir_collectors) / "pfx2asn_clean.txt"
+    rpki_data = [context.data_dir_rpki_cache, context.data_dir_rpki_tals]
+
+    stages = []
+    # Nothing needs to be fetched if we are reproducing a previous run, the
+    # data directories are the inputs of the parsers then.
+    if not context.reproduce:
+        stages.append(Stage("fetch_rpki", fetch_rpki_db,
+                            outputs=rpki_data,
+                            title="Fetching RPKI",
+                            manifests={context.data_dir_rpki_cache: cache_manifest_path(context)}))
+        if context.args.irr:
+            stages.append(Stage("fetch_irr", fetch_irr,
+                                outputs=[context.data_dir_irr],
+                                title="Fetching IRR",
+                                manifests={context.data_dir_irr:
+                                           directory_manifest_path(context.data_dir_irr)}))
+        if context.args.routeviews:
+            stages.append(Stage("fetch_routeviews", fetch_routeviews_pfx2as,
+                                outputs=[context.data_dir_collectors],
+                                title="Fetching Routeviews pfx2as",
+                                manifests={context.data_dir_collectors:
+                                           directory_manifest_path(context.data_dir_collectors)}))
+
+    stages += [
+        Stage("validate_rpki", validate_rpki_db,
+              inputs=rpki_data,
+              outputs=[rpki_raw],
+              title="Validating RPKI"),
+        Stage("parse_rpki", parse_rpki,
+              inputs=[rpki_raw],
+              outputs=[rpki_final],
+              title="Parsing RPKI"),
+    ]
+    base_file = rpki_final
+
+    if context.args.irr:
+        merged_irr = Path(context.out_dir) / "merged_file_rpki_irr.txt"
+        stages += [
+            Stage("parse_irr", parse_irr,
+                  inputs=[context.data_dir_irr],
+                  outputs=[irr_final],
+                  title="Parsing IRR"),
+            Stage("merge_irr", merge_irr,
+                  inputs=[base_file, irr_final],
+                  outputs=[merged_irr],
+                  title="Merging RPKI and IRR data"),
+        ]
+        base_file = merged_irr
+
+    if context.args.routeviews:
+        if context.args.irr:
+            merged_rv = Path(context.out_dir) / "merged_file_rpki_irr_rv.txt"
+        else:
+            merged_rv = Path(context.out_dir) / "merged_file_rpki_rv.txt"
+        stages += [
+            Stage("parse_routeviews", (extract_routeviews_pfx2as, parse_routeviews_pfx2as),
+                  inputs=[context.data_dir_collectors],
+                  outputs=[rv_clean],
+                  title="Parsing Routeviews pfx2as"),
+            Stage("merge_routeviews", merge_pfx2as,
+                  inputs=[base_file, rv_clean],
+                  outputs=[merged_rv],
+                  title="Merging Routeviews and base data"),
+        ]
+        base_file = merged_rv
+
+    stages.append(Stage("sort", sort_result_by_pfx,
+                        inputs=[base_file],
+                        outputs=[context.final_result_file],
+                        title="Sorting results"))
+
+    return stages
+
 class Kartograf:
     ''' Top level project class. '''
 
@@ -57,43 +144,18 @@ class Kartograf:
             print(f"This is a reproduction run based on the data in "
                   f"{repro_path}")
 
-        # Fetch everthing that we need to fetch first
-        if not context.reproduce:
-            print_section_header("Fetching RPKI")
-            fetch_rpki_db(context)
+        if context.resume:
+            print(f"Resuming the run from the stage manifest in {context.out_dir}")
 
-            if context.args.irr:
-                print_section_header("Fetching IRR")
-                fetch_irr(context)
+        # Stages that don't depend on each other, like fetching and parsing
+        # of the different sources, are run at the same time.
+        manifest = StageManifest(context.manifest_file)
+        profiler = StageProfiler(context.profile_dir) if context.args.profile else None
+        Pipeline(map_stages(context), manifest, profiler).run(context, resume=context.resume)
 
-            if context.args.routeviews:
-                print_section_header("Fetching Routeviews pfx2as")
-                fetch_routeviews_pfx2as(context)
-
-        print_section_header("Validating RPKI")
-        validate_rpki_db(context)
-
-        print_section_header("Parsing RPKI")
-        parse_rpki(context)
-
-        if context.args.irr:
-            print_section_header("Parsing IRR")
-            extract_irr(context)
-            parse_irr(context)
-
-            print_section_header("Merging RPKI and IRR data")
-            merge_irr(context)
-
-        if context.args.routeviews:
-            print_section_header("Parsing Routeviews pfx2as")
-            extract_routeviews_pfx2as(context)
-            parse_routeviews_pfx2as(context)
-
-            print_section_header("Merging Routeviews and base data")
-            merge_pfx2as(context)
-
-        print_section_header("Sorting results")
-        sort_result_by_pfx(context)
+        if profiler:
+            print(f"Stage profiles written to {context.profile_dir}, "
+                  f"hotspots summary: {profiler.write_summary()}")
 
         if not context.args.debug:
             cleanup_out_files(context)
@@ -111,10 +173,8 @@ class Kartograf:
         total_time = end_time - start_time
         print("Total runtime:", str(datetime.timedelta(seconds=total_time)))
 
-    @staticmethod
-    def cov(args):
-        coverage(args.map, args.list, args.output_covered, args.output_uncovered)
-
-    @staticmethod
-    def merge(args):
-        general_merge(args.base, args.extra, None, args.output)
+        context.metrics.write(context.metrics_file,
+                              version=__version__,
+                              epoch=context.epoch,
+                              total_wall_time=total_time)
+        print(f"Performance report written to {context.metrics_file}")
@@ -1,81 +1,145 @@
-from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
 from pathlib import Path
-import ipaddress
 import math
 import os
 import shutil
-from types import SimpleNamespace
+import numpy as np
 import pandas as pd
 
-from kartograf.timed import timed
-from kartograf.util import get_root_network
+from kartograf.bogon import MAX_ASN, extract_asn
+from kartograf.prefix_map import PrefixMap, load_prefix_map, store_prefix_map
+from kartograf.timed import record_counts, timed
+from kartograf.util import normalize_pfx, process_pool
 
 
 class BaseNetworkIndex:
     '''
-    A class whose _dict represents a mapping of the network number and
-    IP networks within that network for a given AS file.
-
-    To check inclusion of a given IP network in the base AS file,
-    we can compare (see check_inclusion) the networks under the root network number
-    instead of all the networks in the base file.
+    Answers whether the network address of an extra prefix is within any of
+    the prefixes of a base file.
+
+    The base prefixes are kept as a sorted table of disjoint integer ranges
+    per IP version. Prefixes within another base prefix are dropped when the
+    table is built, so a lookup is a binary search for the last range that
+    starts at or before the address. Prefixes added after a lookup are
+    merged into the table on the next lookup.
+
+    A base prefix shorter than /8 for IPv4 or /16 for IPv6 only covers the
+    first /8 or /16 in it, like in the index grouped by the first octet or
+    hextet that this replaces, so the merge results are the same.
     '''
-
+    BITS = {4: 32, 6: 128}
+    ROOT_BITS = {4: 8, 6: 16}
 
     def __init__(self):
-        self._dict = {4: {}, 6: {}}
-        self._v4_keys = self._dict[4].keys()
-        self._v6_keys = self._dict[6].keys()
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+        self._pending = {4: [], 6: []}
 
     def update(self, pfx):
-        try:
-            ipn = ipaddress.ip_network(pfx)
-        except ValueError:
+        normalized = normalize_pfx(pfx)
+        if normalized is None:
             print(f"Invalid prefix provided: {pfx}")
             return
+        self.add_network(*normalized)
+
+    def add_network(self, version, netw, prefixlen):
+        """Add an integer-encoded network."""
+        host_bits = self.BITS[version] - max(prefixlen, self.ROOT_BITS[version])
+        self._pending[version].append((netw, netw | ((1 << host_bits) - 1)))
+
+    def _build(self, version):
+        ranges = sorted(list(zip(self._starts[version], self._ends[version]))
+                        + self._pending[version], key=lambda r: (r[0], -r[1]))
+        starts, ends = [], []
+        for start, end in ranges:
+            # Prefixes are either nested or disjoint, a range starting
+            # within the previous one is within it
+            if ends and start <= ends[-1]:
+                continue
+            starts.append(start)
+            ends.append(end)
+        self._starts[version], self._ends[version] = starts, ends
+        self._pending[version] = []
+
+    def ranges(self, version):
+        """The sorted disjoint (starts, ends) of the base prefixes of a version."""
+        if self._pending[version]:
+            self._build(version)
+        return self._starts[version], self._ends[version]
+
+    def contains_network(self, version, netw):
+        if self._pending[version]:
+            self._build(version)
+        i = bisect_right(self._starts[version], netw) - 1
+        if i >= 0 and netw <= self._ends[version][i]:
+            return 1
+        return 0
 
-        netw = int(ipn.network_address)
-        mask = int(ipn.netmask)
-        v = ipn.version
-        root_net = get_root_network(pfx)
+    def __len__(self):
+        for version in (4, 6):
+            if self._pending[version]:
+                self._build(version)
+        return len(self._starts[4]) + len(self._starts[6])
 
-        if (root_net in self._v4_keys) or (root_net in self._v6_keys):
-            current = self._dict[v][root_net]
-            self._dict[v][root_net] = current + [(netw, mask)]
-        else:
-            self._dict[v].update({root_net: [(netw, mask)]})
-
-    def check_inclusion(self, row, root_net, version):
-        """
-        A network is a subnet of another if the bitwise AND of its IP and the base network's netmask
-        is equal to the base network IP.
-        """
-        for net, mask in self._dict[version][root_net]:
-            if row.INETS & mask == net:
-                return 1
-        return 0
+    def __getstate__(self):
+        # The table is built once before the index is sent to the worker
+        # processes, not in each of them
+        len(self)
+        return self.__dict__.copy()
 
-    def contains_row(self, row):
-        root_net = row.PFXS_LEADING
-        version = ipaddress.ip_network(row.PFXS).version
-        if version == 4 and (root_net in self._v4_keys):
-            return self.check_inclusion(row, root_net, version)
-        if version == 6 and (root_net in self._v6_keys):
-            return self.check_inclusion(row, root_net, version)
-        return 0
 
-    def get_serializable_dict(self):
-        """Return the internal dict for serialization to worker processes."""
-        return self._dict
+# Addresses are split into two 64 bit halves for NumPy, compared field by
+# field they sort in the same order as the addresses. IPv4 addresses only
+# use the lower half.
+IPV6_HALVES = np.dtype([("hi", np.uint64), ("lo", np.uint64)])
+LOW_64 = (1 << 64) - 1
+
+
+def network_halves(networks):
+    """The integer network addresses as an array of IPV6_HALVES."""
+    halves = np.empty(len(networks), dtype=IPV6_HALVES)
+    halves["hi"] = np.fromiter((netw >> 64 for netw in networks), np.uint64, len(networks))
+    halves["lo"] = np.fromiter((netw & LOW_64 for netw in networks), np.uint64, len(networks))
+    return halves
+
+
+def contains_networks(index, versions, halves):
+    """
+    For each network address, given as IPV6_HALVES, if it is within any of
+    the base prefixes in the index, with the same results as
+    BaseNetworkIndex.contains_network. Returns a NumPy array of booleans.
+
+    The addresses are looked up in the sorted disjoint ranges of the base
+    with searchsorted, all at once per IP version. Each address is covered
+    if it is not after the end of the last range starting at or before it.
+    """
+    versions = np.asarray(versions)
+    covered = np.zeros(len(halves), dtype=bool)
+    for version in (4, 6):
+        selected = versions == version
+        starts, ends = index.ranges(version)
+        if not starts or not selected.any():
+            continue
+
+        if version == 4:
+            addresses = halves["lo"][selected]
+            starts = np.array(starts, dtype=np.uint64)
+            ends = np.array(ends, dtype=np.uint64)
+        else:
+            addresses = halves[selected]
+            starts = network_halves(starts)
+            ends = network_halves(ends)
+
+        i = np.searchsorted(starts, addresses, side="right") - 1
+        last = ends[np.maximum(i, 0)]
+        if version == 4:
+            within = addresses <= last
+        else:
+            within = ((addresses["hi"] < last["hi"])
+                      | ((addresses["hi"] == last["hi"]) & (addresses["lo"] <= last["lo"])))
+        covered[selected] = (i >= 0) & within
+    return covered
 
-    @classmethod
-    def from_dict(cls, data_dict):
-        """Reconstruct a BaseNetworkIndex from a serialized dict."""
-        instance = cls()
-        instance._dict = data_dict
-        instance._v4_keys = instance._dict[4].keys()
-        instance._v6_keys = instance._dict[6].keys()
-        return instance
 
 @timed
 def merge_irr(context):
@@ -85,11 +149,17 @@ def merge_irr(context):
     out_file = Path(context.out_dir) / "merged_file_rpki_irr.txt"
     context.cleanup_out_files += [irr_filtered_file, out_file]
 
+    if context.in_memory:
+        in_memory_merge(context, rpki_file, irr_file, irr_filtered_file, out_file)
+        return
+
     general_merge(
         rpki_file,
         irr_file,
         irr_filtered_file,
-        out_file
+        out_file,
+        engine=context.merge_engine,
+        workers=context.max_workers
     )
     shutil.copy2(out_file, context.final_result_file)
 
@@ -109,56 +179,130 @@ def merge_pfx2as(context):
     rv_filtered_file = Path(context.out_dir_collectors) / "pfx2asn_filtered.txt"
     context.cleanup_out_files += [rv_filtered_file, out_file]
 
+    if context.in_memory:
+        in_memory_merge(context, base_file, rv_file, rv_filtered_file, out_file)
+        return
+
     general_merge(
         base_file,
         rv_file,
         rv_filtered_file,
-        out_file
+        out_file,
+        engine=context.merge_engine,
+        workers=context.max_workers
     )
     shutil.copy2(out_file, context.final_result_file)
 
 
+def in_memory_merge(context, base_file, extra_file, extra_filtered_file, out_file):
+    """
+    Merge the in-memory results of earlier stages, the files are only
+    written in debug mode.
+    """
+    base = load_prefix_map(context, base_file)
+    extra = load_prefix_map(context, extra_file)
+    merged, filtered = merge_prefix_maps(base, extra, engine=context.merge_engine,
+                                         workers=context.max_workers)
+    if context.args.debug:
+        filtered.write(extra_filtered_file)
+    store_prefix_map(context, out_file, merged)
+
+
+def contains_chunk_worker(chunk, base):
+    return [base.contains_network(version, netw) for version, netw in chunk]
+
+
+def check_in_chunks(networks, base_network_index, workers=None):
+    """
+    Check the (version, network address) pairs in chunks in worker
+    processes, returns for each of them if it is covered by the base.
+    """
+    chunk_size = pick_chunk_size(len(networks), workers)
+    chunks = [networks[i:i + chunk_size] for i in range(0, len(networks), chunk_size)]
+
+    covered = []
+    with process_pool(max_workers=workers) as executor:
+        futures = [executor.submit(contains_chunk_worker, chunk, base_network_index)
+                   for chunk in chunks]
+
+        # Results are collected in submission order to keep the order of the
+        # networks
+        for future in futures:
+            covered.extend(future.result())
+    return covered
+
+
+def merge_prefix_maps(base, extra, engine="index", workers=None):
+    """
+    Merge the entries of extra that are not covered by the base into the
+    base. Returns the merged map and the extra entries that were added.
+    """
+    print("Merging extra prefixes that were not included in the base.")
+    base_network_index = BaseNetworkIndex()
+    for version, netw, prefixlen, _ in base:
+        base_network_index.add_network(version, netw, prefixlen)
+
+    entries = list(extra)
+    if engine == "vectorized":
+        covered = contains_networks(base_network_index,
+                                    [entry[0] for entry in entries],
+                                    network_halves([entry[1] for entry in entries]))
+    else:
+        covered = check_in_chunks([(entry[0], entry[1]) for entry in entries],
+                                  base_network_index, workers)
+
+    filtered = PrefixMap([entry for entry, is_covered in zip(entries, covered)
+                          if not is_covered])
+    merged = PrefixMap(base.entries + filtered.entries)
+    record_counts(records_in=len(base) + len(extra), records_out=len(merged))
+    return merged, filtered
+
+
 def extra_file_to_df(extra_file_path):
+    extra_versions = []
     extra_nets_int = []
+    extra_nets_hi = []
+    extra_nets_lo = []
     extra_asns = []
     extra_pfxs = []
-    extra_pfxs_leading = []
     with open(extra_file_path, "r") as file:
         for line in file:
             pfx, asn = line.split(" ")
+            normalized = normalize_pfx(pfx)
+            if normalized is None:
+                print(f"Invalid IP network: {pfx}, skipping")
+                continue
             try:
-                ipn = ipaddress.ip_network(pfx)
+                asn_int = extract_asn(asn)
             except ValueError:
-                print(f"Invalid IP network: {pfx}, skipping")
+                asn_int = None
+            # The ASNs are kept in a uint32 column
+            if asn_int is None or not 0 <= asn_int <= MAX_ASN:
+                print(f"Invalid ASN: {asn.strip()}, skipping")
                 continue
-            netw_int = int(ipn.network_address)
-            extra_nets_int.append(netw_int)
-            extra_asns.append(asn.strip())
+            version, netw, _ = normalized
+            extra_versions.append(version)
+            extra_nets_int.append(netw)
+            # The halves of the address are split once here for the
+            # vectorized engine
+            extra_nets_hi.append(netw >> 64)
+            extra_nets_lo.append(netw & LOW_64)
+            extra_asns.append(asn_int)
             extra_pfxs.append(pfx)
-            root_net = get_root_network(pfx)
-            extra_pfxs_leading.append(root_net)
 
+    # The dtypes are explicit so an extra file without valid rows still
+    # gives the expected columns
     df_extra = pd.DataFrame({
-        "INETS": extra_nets_int,
-        "ASNS": extra_asns,
-        "PFXS": extra_pfxs,
-        "PFXS_LEADING": extra_pfxs_leading
+        "VERSIONS": pd.array(extra_versions, dtype="uint8"),
+        "INETS": pd.Series(extra_nets_int, dtype=object),
+        "INETS_HI": pd.array(extra_nets_hi, dtype="uint64"),
+        "INETS_LO": pd.array(extra_nets_lo, dtype="uint64"),
+        "ASNS": pd.array(extra_asns, dtype="uint32"),
+        "PFXS": pd.Series(extra_pfxs, dtype=object),
         })
 
     return df_extra
 
-def process_chunk_worker(chunk_data, base_dict):
-    base = BaseNetworkIndex.from_dict(base_dict)
-
-    results = []
-    for original_idx, (net_int, pfx, pfx_leading) in chunk_data:
-        row = SimpleNamespace(PFXS=pfx, PFXS_LEADING=pfx_leading, INETS=net_int)
-
-        result = base.contains_row(row)
-        results.append((original_idx, result))
-    return results
-
-
 def pick_chunk_size(n_rows: int, workers: int | None = None,
                     min_chunk: int = 5,
                     max_chunk: int = 200_000) -> int:
@@ -169,10 +313,12 @@ def pick_chunk_size(n_rows: int, workers: int | None = None,
 
 
 def general_merge(
-    base_file, extra_file, extra_filtered_file, out_file
+    base_file, extra_file, extra_filtered_file, out_file, engine="index", workers=None
 ):
     """
-    Merge lists of IP networks into a base file.
+    Merge lists of IP networks into a base file. The "index" engine checks
+    the extra networks in chunks in worker processes, the "vectorized"
+    engine checks all of them at once with NumPy.
     """
     print("Merging extra prefixes that were not included in the base file.")
     base_network_index = BaseNetworkIndex()
@@ -184,48 +330,32 @@ def general_merge(
     df_extra = extra_file_to_df(extra_file)
 
     len_df_extra = len(df_extra)
-    chunk_size = pick_chunk_size(len_df_extra)
-    chunks = []
-    chunk_data = []
-    for i, row in df_extra.iterrows():
-        chunk_data.append((i, (row.INETS, row.PFXS, row.PFXS_LEADING)))
-        if (i + 1) % chunk_size == 0 or i == len_df_extra - 1:
-            chunks.append(chunk_data)
-            chunk_data = []
-
-    all_results = []
-    with ProcessPoolExecutor() as executor:
-        base_dict = base_network_index.get_serializable_dict()
-        futures = [executor.submit(process_chunk_worker, chunk, base_dict) for chunk in chunks]
-
-        for future in futures:
-            all_results.extend(future.result())
-
-    # Sort by original index
-    all_results.sort(key=lambda x: x[0])
-
-    df_extra["INCLUDED"] = [result for _, result in all_results]
+    if engine == "vectorized":
+        halves = np.empty(len_df_extra, dtype=IPV6_HALVES)
+        halves["hi"] = df_extra.INETS_HI.to_numpy(dtype=np.uint64)
+        halves["lo"] = df_extra.INETS_LO.to_numpy(dtype=np.uint64)
+        df_extra["INCLUDED"] = contains_networks(base_network_index,
+                                                 df_extra.VERSIONS.to_numpy(),
+                                                 halves).astype(int)
+    else:
+        networks = list(zip(df_extra.VERSIONS.tolist(), df_extra.INETS.tolist()))
+        df_extra["INCLUDED"] = check_in_chunks(networks, base_network_index, workers)
 
     df_filtered = df_extra[df_extra.INCLUDED == 0]
 
+    # The ASNs are kept as integers and only formatted for the output
+    extra_contents = "".join(f"{pfx} AS{asn}\n"
+                             for pfx, asn in zip(df_filtered.PFXS, df_filtered.ASNS))
     if extra_filtered_file:
-        df_filtered.to_csv(
-            extra_filtered_file,
-            sep=" ",
-            index=False,
-            columns=["PFXS", "ASNS"],
-            header=False,
-        )
-
-        with open(extra_filtered_file, "r") as extra:
-            extra_contents = extra.read()
-    else:
-        extra_contents = df_filtered.to_csv(
-            None, sep=" ", index=False, columns=["PFXS", "ASNS"], header=False
-        )
+        with open(extra_filtered_file, "w") as extra:
+            extra.write(extra_contents)
 
     with open(base_file, "r") as base:
         base_contents = base.read()
 
+    base_count = base_contents.count("\n")
+    record_counts(records_in=base_count + len_df_extra,
+                  records_out=base_count + len(df_filtered))
+
     with open(out_file, "w") as merge_file:
         merge_file.write(base_contents + extra_contents)
@@ -0,0 +1,269 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import Lock, get_ident
+
+from kartograf.util import (
+    calculate_sha256_directory,
+    print_section_header,
+)
+
+
+class Stage:
+    '''
+    A single step of the map pipeline.
+
+    A stage declares the artifacts (files or directories) it reads and the
+    artifacts it produces. If the stage hashes an output directory itself,
+    the manifest it writes can be declared so the directory doesn't have to
+    be hashed again for the stage manifest. The functions of a stage are
+    called in order with the context of the run.
+    '''
+    def __init__(self, name, funcs, inputs=(), outputs=(), title=None, manifests=None):
+        self.name = name
+        self.funcs = funcs if isinstance(funcs, (list, tuple)) else (funcs,)
+        self.inputs = tuple(str(path) for path in inputs)
+        self.outputs = tuple(str(path) for path in outputs)
+        self.title = title or name
+        # Manifests of hash_directory that the stage writes for its output
+        # directories, keyed by the directory
+        self.manifests = {str(k): str(v) for k, v in (manifests or {}).items()}
+
+    def run(self, context):
+        print_section_header(self.title)
+        for func in self.funcs:
+            func(context)
+
+
+class CleanupFiles(list):
+    '''
+    The intermediate files of a run that are removed at its end. The files
+    are also kept per thread, so the files added by a stage can be told
+    apart from those of the stages running at the same time.
+    '''
+    def __init__(self, files=()):
+        super().__init__(files)
+        self._by_thread = {}
+        self._lock = Lock()
+
+    def _track(self, files):
+        with self._lock:
+            self._by_thread.setdefault(get_ident(), []).extend(files)
+
+    def append(self, file):
+        super().append(file)
+        self._track([file])
+
+    def extend(self, files):
+        files = list(files)
+        super().extend(files)
+        self._track(files)
+
+    def __iadd__(self, files):
+        self.extend(files)
+        return self
+
+    def take_thread_files(self):
+        '''The files added by the current thread since the last call'''
+        with self._lock:
+            return self._by_thread.pop(get_ident(), [])
+
+
+class StageManifest:
+    '''
+    Keeps track of the completed stages of a run together with the hashes of
+    their inputs and outputs. This allows to resume an interrupted run
+    without repeating the stages that have already completed.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.stages = {}
+        self._hashes = {}
+        self._lock = Lock()
+
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.stages = json.load(f)
+
+    def artifact_hash(self, artifact, cached=True, directory_manifest=None):
+        '''
+        Hash a file or directory, missing artifacts have no hash. Inputs are
+        usually outputs of an earlier stage so their hash is reused unless it
+        is explicitly requested to hash again. Files are identified by their
+        size and mtime, like the unchanged files of hash_directory, so the
+        intermediate files of a run are not read again to record them.
+        '''
+        if cached and artifact in self._hashes:
+            return self._hashes[artifact]
+
+        path = Path(artifact)
+        if path.is_dir():
+            # The file hashes of directories are kept, so only changed files
+            # are hashed again when the run is resumed
+            file_hashes = self.path.parent / "file_hashes" / f"{hashlib.sha256(artifact.encode()).hexdigest()[:16]}.json"
+            file_hashes.parent.mkdir(parents=True, exist_ok=True)
+            digest = calculate_sha256_directory(path, file_hashes, directory_manifest)
+        elif path.is_file():
+            stat = path.stat()
+            digest = f"{stat.st_size}:{stat.st_mtime_ns}"
+        else:
+            digest = None
+        self._hashes[artifact] = digest
+        return digest
+
+    def is_complete(self, stage):
+        '''
+        A stage is complete if it was recorded before and neither its inputs
+        nor its outputs have changed since.
+        '''
+        entry = self.stages.get(stage.name)
+        if entry is None:
+            return False
+        if (set(entry["inputs"]) != set(stage.inputs)
+                or set(entry["outputs"]) != set(stage.outputs)):
+            return False
+
+        for artifact in stage.outputs:
+            digest = self.artifact_hash(artifact, cached=False,
+                                        directory_manifest=stage.manifests.get(artifact))
+            if digest is None or digest != entry["outputs"][artifact]:
+                return False
+        return all(self.artifact_hash(artifact) == entry["inputs"][artifact]
+                   for artifact in stage.inputs)
+
+    def cleanup_files(self, stage):
+        return [Path(path) for path in self.stages[stage.name]["cleanup"]]
+
+    def output_hash(self, stage, artifact):
+        '''
+        Hash an output of a stage that just ran. The digest of a directory
+        the stage hashed itself is taken from its manifest.
+        '''
+        manifest = stage.manifests.get(artifact)
+        if manifest and Path(manifest).exists():
+            with open(manifest, "r") as f:
+                digest = json.load(f)["digest"]
+            self._hashes[artifact] = digest
+            return digest
+        return self.artifact_hash(artifact, cached=False)
+
+    def record(self, stage, cleanup):
+        '''Record a completed stage with the intermediate files it created.'''
+        entry = {
+            "inputs": {a: self.artifact_hash(a) for a in stage.inputs},
+            "outputs": {a: self.output_hash(stage, a) for a in stage.outputs},
+            # Intermediate files need to be known when the stage is skipped
+            # on resume so they are still cleaned up at the end of the run.
+            "cleanup": sorted({str(path) for path in cleanup}),
+        }
+
+        with self._lock:
+            self.stages[stage.name] = entry
+            # Write to a temporary file first so an interrupted write never
+            # leaves a broken manifest behind.
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.stages, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class Pipeline:
+    '''
+    Runs a set of stages as a dependency graph.
+
+    A stage depends on every stage that produces one of its inputs. Inputs
+    that are not produced by any stage (like the data of a reproduction run)
+    are expected to be present already. Stages that don't depend on each
+    other are run at the same time.
+
+    If a manifest is given, every completed stage is recorded in it and
+    stages that are still complete can be skipped when resuming a run. If a
+    profiler is given, every stage is run through it and the stages are run
+    one at a time, since only one profiler can be active at once.
+    '''
+    def __init__(self, stages, manifest=None, profiler=None, max_workers=None):
+        self.stages = list(stages)
+        self.manifest = manifest
+        self.profiler = profiler
+        if profiler:
+            max_workers = 1
+        self.max_workers = max_workers or max(len(self.stages), 1)
+        self.dependencies = self._resolve_dependencies()
+
+    def _resolve_dependencies(self):
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise ValueError(f"Artifact {output} is produced by both "
+                                     f"{producers[output]} and {stage.name}")
+                producers[output] = stage.name
+
+        dependencies = {}
+        for stage in self.stages:
+            dependencies[stage.name] = {producers[i] for i in stage.inputs
+                                        if i in producers and producers[i] != stage.name}
+
+        # Make sure the graph can be fully resolved, otherwise we would wait
+        # forever on a cycle.
+        done = set()
+        while len(done) < len(dependencies):
+            ready = [name for name, deps in dependencies.items()
+                     if name not in done and deps <= done]
+            if not ready:
+                raise ValueError("Stage dependencies contain a cycle")
+            done.update(ready)
+
+        return dependencies
+
+    def _run_stage(self, stage, context, resume):
+        if resume and self.manifest.is_complete(stage):
+            print_section_header(stage.title)
+            print("Completed in a previous run, skipping.")
+            context.cleanup_out_files += self.manifest.cleanup_files(stage)
+            return
+
+        if self.manifest:
+            # Only the files added while the stage runs belong to it, not
+            # those of skipped stages that ran in this thread before
+            context.cleanup_out_files.take_thread_files()
+        if self.profiler:
+            self.profiler.run(stage, context)
+        else:
+            stage.run(context)
+        if self.manifest:
+            self.manifest.record(stage, context.cleanup_out_files.take_thread_files())
+
+    def run(self, context, resume=False):
+        if resume and not self.manifest:
+            raise ValueError("Resuming a run requires a stage manifest")
+        if self.manifest and not isinstance(context.cleanup_out_files, CleanupFiles):
+            context.cleanup_out_files = CleanupFiles(context.cleanup_out_files)
+
+        done = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Stages are submitted in declaration order as soon as all of
+            # their dependencies have finished.
+            while len(done) < len(self.stages):
+                for stage in self.stages:
+                    if (stage.name not in done
+                            and stage.name not in running.values()
+                            and self.dependencies[stage.name] <= done):
+                        future = executor.submit(self._run_stage, stage, context, resume)
+                        running[future] = stage.name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # Don't start anything new but let stages that are
+                        # already running finish before failing.
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    done.add(name)
@@ -0,0 +1,81 @@
+from kartograf.bogon import extract_asn
+from kartograf.util import format_network, normalize_pfx
+
+
+class PrefixMap:
+    '''
+    An integer-encoded collection of prefix to ASN mappings.
+
+    Each entry is a tuple of (IP version, network address as int, prefix
+    length, ASN as int). This allows stages to hand their results to each
+    other without formatting and parsing the prefixes as text in between.
+    '''
+    __slots__ = ('entries',)
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def add(self, version, network, prefixlen, asn):
+        self.entries.append((version, network, prefixlen, asn))
+
+    def add_pfx(self, pfx, asn):
+        '''
+        Add a prefix in text form, the ASN may be an int or an "AS" string.
+        Raises ValueError if the prefix is invalid.
+        '''
+        normalized = normalize_pfx(pfx)
+        if normalized is None:
+            raise ValueError(f"{pfx!r} does not appear to be an IPv4 or IPv6 network")
+        self.entries.append((*normalized, extract_asn(asn)))
+
+    def sort(self):
+        '''
+        Sort IPv4 before IPv6, then by network address and more specific
+        prefixes first, the same order as sort_result_by_pfx.
+        '''
+        self.entries.sort(key=lambda e: (e[0] == 6, e[1], -e[2], e[3]))
+
+    def lines(self):
+        for version, network, prefixlen, asn in self.entries:
+            yield f"{format_network(version, network)}/{prefixlen} AS{asn}\n"
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.writelines(self.lines())
+
+    @classmethod
+    def read(cls, path):
+        prefix_map = cls()
+        with open(path, "r") as f:
+            for line in f:
+                pfx, asn = line.split(" ")
+                prefix_map.add_pfx(pfx, asn.strip())
+        return prefix_map
+
+
+def store_prefix_map(context, path, prefix_map):
+    '''
+    Keep the result of a stage in memory for the following stages. The text
+    file is only written as an artifact for debugging.
+    '''
+    context.prefix_maps[str(path)] = prefix_map
+    if context.args.debug:
+        prefix_map.write(path)
+
+
+def load_prefix_map(context, path):
+    '''
+    Get the in-memory result of an earlier stage. If the stage did not run in
+    this process, like when it was skipped on resume, the text file it left
+    behind is read instead.
+    '''
+    prefix_map = context.prefix_maps.get(str(path))
+    if prefix_map is None:
+        prefix_map = PrefixMap.read(path)
+    return prefix_map
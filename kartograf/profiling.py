@@ -0,0 +1,55 @@
+import cProfile
+from pathlib import Path
+import pstats
+from threading import Lock
+
+
+class StageProfiler:
+    '''
+    Profiles each stage of a run and writes one profile dump per stage.
+
+    Only one profiler can be active per process on Python 3.12 and later,
+    so the pipeline runs its stages one at a time when they are profiled.
+    Work done in child processes, like rpki-client or the merge workers, is
+    not included.
+    '''
+    def __init__(self, profile_dir, top=30):
+        self.profile_dir = Path(profile_dir)
+        self.top = top
+        self.dumps = {}
+        self._lock = Lock()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+
+    def run(self, stage, context):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            stage.run(context)
+        finally:
+            profile.disable()
+            dump = self.profile_dir / f"{stage.name}.prof"
+            profile.dump_stats(dump)
+            with self._lock:
+                self.dumps[stage.name] = dump
+
+    def write_summary(self):
+        '''
+        Write the top hotspots over all profiled stages, ranked by the time
+        spent in the functions themselves.
+        '''
+        summary = self.profile_dir / "hotspots.txt"
+        with self._lock:
+            dumps = dict(self.dumps)
+
+        with open(summary, "w") as f:
+            f.write("Profiled stages:\n")
+            for name, dump in sorted(dumps.items()):
+                stats = pstats.Stats(str(dump))
+                f.write(f"  {name}: {stats.total_tt:.3f}s ({dump.name})\n")
+            f.write("\n")
+
+            if dumps:
+                stats = pstats.Stats(*[str(d) for d in dumps.values()], stream=f)
+                stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+
+        return summary
@@ -0,0 +1,60 @@
+import math
+import os
+from itertools import groupby
+from pathlib import Path
+
+# Size of the batch that measures the cost of validating ROAs, after a
+# batch of a single file has measured the startup cost of rpki-client
+PROBE_BATCH_SIZE = 64
+
+# Batches are made large enough that the startup of rpki-client takes at
+# most this share of their run time
+MAX_STARTUP_SHARE = 0.1
+
+MIN_BATCH_SIZE = 50
+# Keeps the command line of rpki-client well below the argument limits
+MAX_BATCH_SIZE = 2000
+
+
+def group_by_repository(files, cache_dir):
+    '''
+    Order the ROA files by their publication point in the cache, so each
+    rpki-client process works on as few repositories as possible.
+    '''
+    def repository(path):
+        return os.path.relpath(Path(path).parent, cache_dir)
+
+    ordered = sorted(files, key=lambda f: (repository(f), str(f)))
+    return [list(group) for _, group in groupby(ordered, key=repository)]
+
+
+def estimate_costs(single_time, probe_time, probe_size):
+    '''
+    Estimate the startup cost of an rpki-client process and its cost per
+    ROA from the run times of a single file batch and a probe batch.
+    '''
+    per_roa = max(probe_time - single_time, 0.0) / max(probe_size - 1, 1)
+    startup = max(single_time - per_roa, 0.0)
+    return startup, per_roa
+
+
+def adaptive_batch_size(startup, per_roa, remaining, workers):
+    '''
+    The smallest batch size for which the startup of rpki-client takes no
+    more than MAX_STARTUP_SHARE of a batch, but small enough that all
+    workers get a batch.
+    '''
+    if per_roa > 0:
+        size = math.ceil(startup * (1 - MAX_STARTUP_SHARE) / (MAX_STARTUP_SHARE * per_roa))
+    else:
+        size = MAX_BATCH_SIZE
+    size = min(size, math.ceil(remaining / max(workers, 1)))
+    return max(MIN_BATCH_SIZE, min(size, MAX_BATCH_SIZE))
+
+
+def make_batches(files, batch_size):
+    '''
+    Split the files into batches in their order, so the files of a
+    repository end up in the same or in consecutive batches.
+    '''
+    return [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
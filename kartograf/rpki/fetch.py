@@ -2,16 +2,36 @@ import subprocess
 import sys
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import json
 from threading import Lock
 from pathlib import Path
-import requests
+import shutil
+import tempfile
+import time
 from tqdm import tqdm
 
-from kartograf.timed import timed
+from kartograf.download import DownloadError
+from kartograf.rpki.batching import (
+    MIN_BATCH_SIZE,
+    PROBE_BATCH_SIZE,
+    adaptive_batch_size,
+    estimate_costs,
+    group_by_repository,
+    make_batches,
+)
+from kartograf.rpki.stream import (
+    iter_json_objects,
+    merge_ndjson,
+    read_chunks,
+    write_ndjson,
+)
+from kartograf.rpki.validation_cache import ValidationCache
+
+from kartograf.timed import record_counts, record_metrics, timed
 from kartograf.util import (
     calculate_sha256,
     calculate_sha256_directory,
+    directory_manifest_path,
+    snapshot_directory,
 )
 
 TAL_URLS = {
@@ -39,23 +59,13 @@ STABLE_REPO_URLS = [
 ]
 
 def download_rir_tals(context):
-    tals = []
-
-    for rir, url in TAL_URLS.items():
-        try:
-            response = requests.get(url, timeout=600)
-            response.raise_for_status()
-
-            tal_path = Path(context.data_dir_rpki_tals) / f"{rir}.tal"
-            with open(tal_path, 'wb') as file:
-                file.write(response.content)
-
-            print(f"Downloaded TAL for {rir.upper()} to {tal_path.name}, file hash: {calculate_sha256(tal_path)}")
-            tals.append(tal_path)
-
-        except requests.RequestException as e:
-            print(f"Error downloading TAL for {rir.upper()}: {e}")
-            sys.exit(1)
+    downloads = [(url, Path(context.data_dir_rpki_tals) / f"{rir}.tal")
+                 for rir, url in TAL_URLS.items()]
+    try:
+        context.downloads.download_all(downloads)
+    except DownloadError as e:
+        print(f"Error downloading TALs: {e}")
+        sys.exit(1)
 
 
 def data_tals(context):
@@ -68,12 +78,20 @@ def data_tals(context):
     sys.exit(1)
 
 
+def cache_manifest_path(context):
+    '''The hash_directory manifest of the RPKI cache, kept next to the cache'''
+    return Path(context.data_dir_rpki_cache).parent / "cache_manifest.json"
+
+
 @timed
 def fetch_rpki_db(context):
     # Download TALs and presist them in the RPKI data folder
     download_rir_tals(context)
     tal_options = [item for path in data_tals(context) for item in ('-t', path)]
-    run_args = ["rpki-client", "-d", context.data_dir_rpki_cache] + tal_options
+    # With a shared cache rpki-client only has to sync the changes since the
+    # last run, the cache of the epoch is a snapshot of it.
+    cache_dir = context.rpki_shared_cache or context.data_dir_rpki_cache
+    run_args = ["rpki-client", "-d", cache_dir] + tal_options
     print("Downloading RPKI Data, this may take a while.")
 
     if context.stable_repos:
@@ -94,7 +112,22 @@ def fetch_rpki_db(context):
                        capture_output=True,
                        check=False)
 
-    print(f"Downloaded RPKI Data, hash sum: {calculate_sha256_directory(context.data_dir_rpki_cache)}")
+    if context.rpki_shared_cache:
+        methods = snapshot_directory(context.rpki_shared_cache, context.data_dir_rpki_cache)
+        summary = ", ".join(f"{count} {method}" for method, count in sorted(methods.items()))
+        print(f"Snapshot of shared RPKI cache {context.rpki_shared_cache} taken: {summary or 'no files'}")
+
+    # The hashes of all files of the cache are kept next to it, with a shared
+    # cache the hashes of its unchanged files are reused
+    manifest = cache_manifest_path(context)
+    shared_manifest = None
+    if context.rpki_shared_cache:
+        shared_manifest = directory_manifest_path(context.rpki_shared_cache)
+    digest = calculate_sha256_directory(context.data_dir_rpki_cache, manifest, shared_manifest)
+    if shared_manifest:
+        shutil.copy2(manifest, shared_manifest)
+
+    print(f"Downloaded RPKI Data, hash sum: {digest}")
 
 
 @timed
@@ -104,57 +137,150 @@ def validate_rpki_db(context):
                                     or (path.name == ".roa"))]
 
     print(f"{len(files)} raw RKPI ROA files found.")
-    rpki_raw_file = 'rpki_raw.json'
+    rpki_raw_file = 'rpki_raw.ndjson'
     result_path = Path(context.out_dir_rpki) / rpki_raw_file
 
-    tal_options = [item for path in data_tals(context) for item in ('-t', path)]
-
-    debug_file_lock = Lock()
+    tals = data_tals(context)
 
     if context.debug_log:
         with open(context.debug_log, 'a') as logs:
             logs.write("\n\n=== RPKI Validation ===\n")
 
-    def process_files_batch(batch):
-        result = subprocess.run(["rpki-client",
-                                 "-j",
-                                 "-n",
-                                 "-d",
-                                 context.data_dir_rpki_cache,
-                                 "-P",
-                                 context.epoch,
-                                 ] + tal_options +
-                                 ["-f"] + batch,  # -f has to be last
-                                 capture_output=True,
-                                 check=False)
-
-        if result.stderr and context.debug_log:
-            stderr_output = result.stderr.decode()
-            with debug_file_lock:
-                with open(context.debug_log, 'a') as logs:
-                    logs.write(stderr_output)
-        return result.stdout
-
-    total = len(files)
-    batch_size = 250
-    batches = []
-    for i in range(0, total, batch_size):
-        batch = [str(f) for f in files[i:i + batch_size]]
-        batches.append(batch)
+    roas_count = validate_batched(context, files, tals, result_path)
+
+    record_counts(records_in=len(files), records_out=roas_count)
+    print(f"{roas_count} RKPI ROAs validated\nSaved to: {result_path.name}\nFile hash: {calculate_sha256(result_path)}")
+
+
+def log_rpki_client_stderr(context, stderr, lock):
+    '''Append the stderr output of rpki-client in a temporary file to the debug log'''
+    if not context.debug_log:
+        return
+    stderr.seek(0)
+    stderr_output = stderr.read().decode()
+    if stderr_output:
+        with lock:
+            with open(context.debug_log, 'a') as logs:
+                logs.write(stderr_output)
+
+
+def validate_batched(context, files, tals, result_path):
+    '''
+    Validate the ROA files in batches of rpki-client -f runs, which report
+    the full details of each ROA.
+    '''
+    tal_options = [item for path in tals for item in ('-t', path)]
+
+    # ROAs with the same hash_id are ordered by their position in the cache,
+    # so the result does not depend on which of them were validated again
+    file_index = {str(f): i for i, f in enumerate(files)}
+
+    def result_order(roa):
+        return (roa["hash_id"], file_index.get(roa.get("file"), len(files)))
+
+    batch_paths = []
+    validation_cache = None
+    if context.validation_cache_file:
+        validation_cache = ValidationCache(context.validation_cache_file,
+                                           context.data_dir_rpki_cache,
+                                           tals, context.epoch)
+        unchanged = []
+        changed = []
+        for f in files:
+            roa = validation_cache.lookup(f)
+            if roa is None:
+                changed.append(f)
+            else:
+                unchanged.append(roa)
+        files_to_validate = changed
+
+        cached_path = Path(context.out_dir_rpki) / f"{result_path.name}.cached"
+        write_ndjson(sorted(unchanged, key=result_order), cached_path)
+        batch_paths.append(cached_path)
+        print(f"{len(unchanged)} ROAs are unchanged since their validation in a previous run.")
+    else:
+        files_to_validate = files
+
+    debug_file_lock = Lock()
+
+    def process_files_batch(batch_index, batch):
+        # stderr goes to a temporary file, reading it from a pipe while
+        # streaming stdout could dead lock
+        with tempfile.TemporaryFile() as stderr:
+            with subprocess.Popen(["rpki-client",
+                                   "-j",
+                                   "-n",
+                                   "-d",
+                                   context.data_dir_rpki_cache,
+                                   "-P",
+                                   context.epoch,
+                                   ] + tal_options +
+                                   ["-f"] + batch,  # -f has to be last
+                                  stdout=subprocess.PIPE,
+                                  stderr=stderr) as process:
+                # The objects of a batch are few enough to be sorted in memory,
+                # the sorted batches are merged into the result file later
+                roas = sorted(iter_json_objects(read_chunks(process.stdout)),
+                              key=result_order)
+
+            log_rpki_client_stderr(context, stderr, debug_file_lock)
+
+        if validation_cache:
+            for roa in roas:
+                validation_cache.store(roa["file"], roa)
+
+        batch_path = Path(context.out_dir_rpki) / f"{result_path.name}.{batch_index}"
+        write_ndjson(roas, batch_path)
+        return batch_path
+
+    # The files of a repository are validated together, and small probe
+    # batches measure the startup cost of rpki-client and its cost per ROA
+    # to choose a batch size for the rest.
+    repositories = group_by_repository(files_to_validate, context.data_dir_rpki_cache)
+    ordered_files = [str(f) for repository in repositories for f in repository]
+    workers = context.rpki_workers
+    validation_start = time.perf_counter()
+    batch_times = []
+
+    single, probe = ordered_files[:1], ordered_files[1:1 + PROBE_BATCH_SIZE]
+    probes = [batch for batch in (single, probe) if batch]
+    for i, batch in enumerate(probes):
+        start = time.perf_counter()
+        batch_paths.append(process_files_batch(i, batch))
+        batch_times.append(time.perf_counter() - start)
+
+    remaining = ordered_files[1 + PROBE_BATCH_SIZE:]
+    batch_size = MIN_BATCH_SIZE
+    if len(batch_times) == 2:
+        startup, per_roa = estimate_costs(batch_times[0], batch_times[1], len(probe))
+        batch_size = adaptive_batch_size(startup, per_roa, len(remaining), workers)
+        print(f"rpki-client startup: {startup:.3f}s, per ROA: {per_roa * 1000:.2f}ms, "
+              f"batch size: {batch_size}, workers: {workers}")
+    batches = make_batches(remaining, batch_size)
 
     total_batches = len(batches)
-    results = []
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_files_batch, batch) for batch in batches]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_files_batch, len(probes) + i, batch)
+                   for i, batch in enumerate(batches)]
         for future in tqdm(as_completed(futures), total=total_batches):
-            result = future.result()
-            if result:
-                normalized = result.replace(b"\n}\n{\n\t", b"\n},\n{\n").decode('utf-8').strip()
-                results.append(normalized)
-        results_json = json.loads("[" + ",".join(results) + "]")
-        s = sorted(results_json, key=lambda result: result["hash_id"])
+            future.result()
+        batch_paths += [future.result() for future in futures]
+
+    validation_time = time.perf_counter() - validation_start
+    roas_per_second = len(ordered_files) / validation_time if ordered_files else 0.0
+    record_metrics(rpki_workers=workers,
+                   rpki_client_processes=len(probes) + total_batches,
+                   batch_size=batch_size,
+                   roas_validated=len(ordered_files),
+                   roas_per_second=roas_per_second)
+    print(f"Validated {len(ordered_files)} ROAs in {len(probes) + total_batches} "
+          f"rpki-client processes, {roas_per_second:.1f} ROAs/s")
+
+    roas_count = merge_ndjson(batch_paths, result_path, key=result_order)
+    for batch_path in batch_paths:
+        batch_path.unlink()
 
-        with open(result_path, 'w') as f:
-            json.dump(s, f)
+    if validation_cache:
+        validation_cache.save()
 
-    print(f"{len(results_json)} RKPI ROAs validated\nSaved to: {result_path.name}\nFile hash: {calculate_sha256(result_path)}")
+    return roas_count
@@ -0,0 +1,89 @@
+import codecs
+import heapq
+import json
+from pathlib import Path
+
+# Size of the chunks read from the output of rpki-client
+CHUNK_SIZE = 64 * 1024
+
+JSON_WHITESPACE = " \t\n\r"
+
+
+def iter_json_objects(chunks):
+    '''
+    Decode a stream of concatenated JSON objects, as written by rpki-client
+    for multiple files, from an iterable of byte chunks. Objects are yielded
+    as soon as they are complete, so only the current object has to be kept
+    in memory.
+    '''
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+
+    def next_objects(final):
+        nonlocal buffer
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            if pos == len(buffer):
+                break
+            try:
+                obj, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The object is not complete yet
+                if final:
+                    raise
+                break
+            yield obj
+        buffer = buffer[pos:]
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        yield from next_objects(final=False)
+
+    buffer += utf8.decode(b"", final=True)
+    yield from next_objects(final=True)
+
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    return iter(lambda: stream.read(chunk_size), b"")
+
+
+def write_ndjson(objects, path):
+    '''Write the objects to a file as newline delimited JSON.'''
+    count = 0
+    with open(path, "w") as f:
+        for obj in objects:
+            f.write(json.dumps(obj, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+
+def read_ndjson(path):
+    '''Read the objects of a newline delimited JSON file one by one.'''
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def merge_ndjson(paths, out_path, key):
+    '''
+    Merge newline delimited JSON files that are each sorted by key into a
+    single sorted file without loading them into memory. Objects with the
+    same key keep the order of the files they come from.
+    '''
+    def keyed_lines(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield key(json.loads(line)), line
+
+    count = 0
+    with open(out_path, "w") as out:
+        for _, line in heapq.merge(*[keyed_lines(Path(p)) for p in paths],
+                                   key=lambda keyed: keyed[0]):
+            out.write(line)
+            count += 1
+    return count
@@ -0,0 +1,201 @@
+import json
+import os
+from pathlib import Path
+from threading import Lock
+
+from kartograf.util import calculate_sha256
+
+# Results of ROAs that expire within this many seconds after the epoch of the
+# run are not reused, they are validated again.
+NEAR_EXPIRY = 24 * 3600
+
+# Objects of a publication point that the validity of its ROAs depends on
+CHAIN_SUFFIXES = (".crl", ".mft")
+
+# DER encoding of the id-ad-caIssuers OID of an authority information access
+# extension, followed by the tag of the URI of the issuing certificate
+CA_ISSUERS = bytes.fromhex("06082b06010505073002") + b"\x86"
+
+# Longest certificate chain that is followed towards the trust anchor
+MAX_CHAIN_DEPTH = 32
+
+
+def certificate_issuer(cert_path):
+    '''
+    The rsync URI of the issuing certificate from the authority information
+    access extension of a DER encoded certificate, None for self-signed
+    trust anchor certificates that don't have one.
+    '''
+    with open(cert_path, "rb") as f:
+        der = f.read()
+    start = der.find(CA_ISSUERS)
+    if start < 0:
+        return None
+    pos = start + len(CA_ISSUERS)
+    length = der[pos] if pos < len(der) else 0
+    pos += 1
+    # Long form of the length, the number of length bytes follows the
+    # high bit
+    if length & 0x80:
+        length_bytes = length & 0x7f
+        length = int.from_bytes(der[pos:pos + length_bytes], "big")
+        pos += length_bytes
+    uri = der[pos:pos + length].decode("ascii", errors="replace")
+    return uri if uri.startswith("rsync://") else None
+
+
+class ValidationCache:
+    '''
+    Keeps the rpki-client validation results of ROAs between runs, so only
+    new and changed ROAs have to be validated again.
+
+    A result is reused if the ROA file, the objects of its chain and the TALs
+    are byte-identical to when it was validated, and the epoch of the run
+    is within the validity window of the result and not close to its end.
+    The chain of a ROA covers the CRL and manifest of its publication point
+    and every CA certificate up to the trust anchor, together with the CRL
+    and manifest of the publication point of each certificate, where its
+    revocation would show up. Only valid results are kept, everything else
+    is validated again.
+    '''
+    def __init__(self, path, cache_dir, tals, epoch):
+        self.path = Path(path)
+        self.cache_dir = Path(cache_dir)
+        self.epoch = int(epoch)
+        self.tals_sha256 = ":".join(calculate_sha256(t) for t in sorted(map(str, tals)))
+        self.entries = {}
+        self.hits = 0
+        self._seen = {}
+        self._hashes = {}
+        self._publication_points = {}
+        self._cert_chains = {}
+        self._lock = Lock()
+
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def _sha256(self, path):
+        path = str(path)
+        if path not in self._hashes:
+            self._hashes[path] = calculate_sha256(path)
+        return self._hashes[path]
+
+    def _publication_point(self, directory):
+        # Many ROAs share a publication point, so its directory is only
+        # listed once per run
+        directory = str(directory)
+        if directory not in self._publication_points:
+            self._publication_points[directory] = sorted(
+                p for p in Path(directory).iterdir()
+                if p.is_file() and p.suffix in CHAIN_SUFFIXES)
+        return self._publication_points[directory]
+
+    def _cert_path(self, uri):
+        if not uri.startswith("rsync://"):
+            return None
+        path = self.cache_dir / uri.removeprefix("rsync://")
+        return path if path.is_file() else None
+
+    def _cert_chain(self, cert, depth=0):
+        '''
+        The certificates from the given one up to the trust anchor with the
+        objects of their publication points, None if a certificate of the
+        chain can not be found in the cache.
+        '''
+        key = str(cert)
+        if key in self._cert_chains:
+            return self._cert_chains[key]
+
+        files = [cert] + self._publication_point(cert.parent)
+        issuer_uri = certificate_issuer(cert)
+        if issuer_uri is not None:
+            issuer = self._cert_path(issuer_uri)
+            parent_chain = None
+            if issuer is not None and issuer != cert and depth < MAX_CHAIN_DEPTH:
+                parent_chain = self._cert_chain(issuer, depth + 1)
+            files = None if parent_chain is None else files + parent_chain
+
+        self._cert_chains[key] = files
+        return files
+
+    def chain_files(self, roa_path, record):
+        '''
+        The files of the cache the validation result of the ROA depends on,
+        None if a certificate of its chain can not be found in the cache.
+        '''
+        issuer = self._cert_path(record.get("aia", ""))
+        if issuer is None:
+            return None
+        cert_chain = self._cert_chain(issuer)
+        if cert_chain is None:
+            return None
+
+        files = self._publication_point(Path(roa_path).parent) + cert_chain
+        return sorted({os.path.relpath(f, self.cache_dir) for f in files})
+
+    def chain_sha256(self, chain):
+        hashes = []
+        for f in chain:
+            path = self.cache_dir / f
+            if not path.is_file():
+                return None
+            hashes.append(f"{f}={self._sha256(path)}")
+        return ":".join(hashes)
+
+    def _in_window(self, entry):
+        valid_since, valid_until = entry["window"]
+        return valid_since <= self.epoch and self.epoch + NEAR_EXPIRY < valid_until
+
+    def lookup(self, roa_path):
+        '''Return the cached validation result of the ROA file if it can be reused.'''
+        roa_sha256 = self._sha256(roa_path)
+        entry = self.entries.get(roa_sha256)
+        if (entry is None
+                or entry["tals_sha256"] != self.tals_sha256
+                or not self._in_window(entry)
+                or entry["chain_sha256"] != self.chain_sha256(entry["chain"])):
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self._seen[roa_sha256] = entry
+        # The file name in the result is the path of the ROA in this run
+        return dict(entry["record"], file=str(roa_path))
+
+    def store(self, roa_path, record):
+        '''Remember a validation result of this run.'''
+        if record.get("validation") != "OK":
+            return
+
+        chain = self.chain_files(roa_path, record)
+        if chain is None:
+            return
+        chain_sha256 = self.chain_sha256(chain)
+        if chain_sha256 is None:
+            return
+
+        valid_until = int(record["valid_until"])
+        if "expires" in record:
+            valid_until = min(valid_until, int(record["expires"]))
+        entry = {
+            "tals_sha256": self.tals_sha256,
+            "chain": chain,
+            "chain_sha256": chain_sha256,
+            "window": [int(record["valid_since"]), valid_until],
+            "record": record,
+        }
+        with self._lock:
+            self._seen[self._sha256(roa_path)] = entry
+
+    def save(self):
+        '''
+        Write the results used or validated in this run, results of ROAs
+        that have disappeared from the cache are dropped.
+        '''
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._lock:
+            with open(tmp_path, "w") as f:
+                json.dump(self._seen, f)
+        os.replace(tmp_path, self.path)
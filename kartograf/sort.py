@@ -1,7 +1,9 @@
 import ipaddress
 from pathlib import Path
 
-from kartograf.timed import timed
+from kartograf.bogon import extract_asn
+from kartograf.prefix_map import load_prefix_map
+from kartograf.timed import record_counts, timed
 
 
 @timed
@@ -15,6 +17,13 @@ def sort_result_by_pfx(context):
     else:
         out_file = Path(context.out_dir_rpki) / "rpki_final.txt"
 
+    if context.in_memory:
+        prefix_map = load_prefix_map(context, out_file)
+        prefix_map.sort()
+        record_counts(records_in=len(prefix_map), records_out=len(prefix_map))
+        prefix_map.write(context.final_result_file)
+        return
+
     with open(out_file, 'r') as file:
         prefixes = file.read().splitlines()
 
@@ -27,13 +36,14 @@ def sort_result_by_pfx(context):
         is_ipv6 = int(net.version == 6)
         # Create a tuple containing whether it's IPv6, the IP network as an
         # integer, the prefix length (negated for descending order), and the
-        # ASN
+        # ASN as integer
         sortable_prefixes.append((is_ipv6,
                                   int(net.network_address),
                                   -net.prefixlen,
-                                  asn))
+                                  extract_asn(asn)))
 
     sortable_prefixes.sort()
+    record_counts(records_in=len(prefixes), records_out=len(sortable_prefixes))
 
     sorted_out_file = Path(context.out_dir) / "merged_file_sorted.txt"
     with open(sorted_out_file, "w") as file:
@@ -45,6 +55,6 @@ def sort_result_by_pfx(context):
             else:
                 net_address = ipaddress.IPv4Address(net_int)
                 net = ipaddress.IPv4Network((net_address, prefixlen))
-            file.write(f'{str(net)} {asn}\n')
+            file.write(f'{str(net)} AS{asn}\n')
 
     sorted_out_file.rename(Path(context.final_result_file))
@@ -1,15 +1,116 @@
+import json
+import resource
+import threading
 import time
 from functools import wraps
 from datetime import timedelta
 
+# The metrics of the timed function currently running in this thread, so
+# the function can report its record counts without passing them around.
+_current = threading.local()
+
+
+class RunMetrics:
+    '''
+    Collects the metrics of all timed functions of a run.
+
+    Stages can run concurrently in different threads, so CPU time and bytes
+    read/written are measured for the thread of the function only. The CPU
+    time of child processes (rpki-client, merge workers) and the peak RSS
+    can only be measured for the whole process.
+    '''
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        with self._lock:
+            self.stages.append(entry)
+
+    def write(self, path, **extra):
+        with self._lock:
+            report = dict(extra, stages=list(self.stages))
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def record_counts(records_in=None, records_out=None):
+    '''
+    Report how many records the running timed function has consumed and
+    produced. Does nothing when called outside of a timed function.
+    '''
+    entry = getattr(_current, "entry", None)
+    if entry is None:
+        return
+    if records_in is not None:
+        entry["records_in"] = records_in
+    if records_out is not None:
+        entry["records_out"] = records_out
+
+
+def record_metrics(**metrics):
+    '''
+    Report additional metrics of the running timed function, like its
+    throughput. Does nothing when called outside of a timed function.
+    '''
+    entry = getattr(_current, "entry", None)
+    if entry is not None:
+        entry.update(metrics)
+
+
+def _thread_io():
+    '''Bytes read and written by the current thread, if the OS tells us.'''
+    try:
+        with open(f"/proc/self/task/{threading.get_native_id()}/io", "r") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
 
 def timed(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
+        # Timed functions get the context of the run as their first argument
+        metrics = getattr(args[0], "metrics", None) if args else None
+
+        entry = {
+            "name": func.__name__,
+            "records_in": None,
+            "records_out": None,
+        }
+        outer_entry = getattr(_current, "entry", None)
+        _current.entry = entry
+
+        read_start, written_start = _thread_io()
+        children_cpu_start = _children_cpu_time()
+        cpu_start = time.thread_time()
         start_time = time.perf_counter()
-        result = func(*args, **kwargs)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _current.entry = outer_entry
         end_time = time.perf_counter()
         run_time = end_time - start_time
-        print(f"...finished in {str(timedelta(seconds=run_time))}")
+        print(f"...{func.__name__} finished in {str(timedelta(seconds=run_time))}")
+
+        if metrics is not None:
+            read_end, written_end = _thread_io()
+            entry.update({
+                "wall_time": run_time,
+                "cpu_time": time.thread_time() - cpu_start,
+                "children_cpu_time": _children_cpu_time() - children_cpu_start,
+                # ru_maxrss is in KiB on Linux and the high water mark of the
+                # process up to the end of the function
+                "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "bytes_read": None if read_start is None else read_end - read_start,
+                "bytes_written": None if written_start is None else written_end - written_start,
+            })
+            metrics.add(entry)
         return result
     return wrapper
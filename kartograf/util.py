@@ -1,36 +1,189 @@
-from functools import partial
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache, partial
 import hashlib
 import ipaddress
+import json
+import multiprocessing
 import os
+from pathlib import Path
 import re
+import shutil
 import subprocess
+from threading import Lock
 import time
 
 RPKI_VERSION = 9.6
 
+# ioctl request to clone a file on Linux filesystems supporting reflinks
+FICLONE = 0x40049409
+
+
+# Large reads keep the number of system calls low for big files, small files
+# are read in one go either way.
+HASH_CHUNK_SIZE = 1024 * 1024
+
 
 def calculate_sha256(file_path):
     sha256_hash = hashlib.sha256()
 
     with open(file_path, "rb") as file:
-        for byte_block in iter(lambda: file.read(4096), b""):
+        for byte_block in iter(partial(file.read, HASH_CHUNK_SIZE), b""):
             sha256_hash.update(byte_block)
 
     return sha256_hash.hexdigest()
 
 
-def calculate_sha256_directory(directory_path):
+# File hashes computed by hash_directory in this process, keyed on the
+# absolute path, so directories hashed more than once in a run, like the RPKI
+# cache, only have their changed files hashed again.
+_known_file_hashes = {}
+_known_file_hashes_lock = Lock()
+
+
+def _scan_files(directory_path, relative=""):
+    '''Yield the relative path and stat result of every file in the tree.'''
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            rel_path = f"{relative}{entry.name}"
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path, rel_path + "/")
+            elif entry.is_file():
+                yield rel_path, entry.stat()
+
+
+def hash_directory(directory_path, manifest_path=None, previous_manifest=None, workers=None,
+                   known_hashes=None):
+    '''
+    Hash every file of a directory tree with a thread pool and return the
+    combined digest and the per-file manifest.
+
+    The manifest maps the relative path of each file to its sha256, size and
+    mtime. It is written to manifest_path if given. Files whose size and
+    mtime match the previous manifest, by default the one at manifest_path,
+    are not hashed again, neither are files in known_hashes, which maps the
+    absolute path of a file to its sha256, like the hashes of downloads. The
+    combined digest is the sha256 of the sorted paths and file hashes, so it
+    does not depend on the order of the scan.
+    '''
+    known_hashes = known_hashes or {}
+    previous_manifest = previous_manifest or manifest_path
+    previous = {}
+    if previous_manifest and Path(previous_manifest).exists():
+        with open(previous_manifest, "r") as f:
+            previous = json.load(f)["files"]
+
+    root = os.path.abspath(directory_path)
+    files = {}
+    to_hash = []
+    for rel_path, stat in _scan_files(root):
+        path = os.path.join(root, rel_path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        with _known_file_hashes_lock:
+            known = [previous.get(rel_path), _known_file_hashes.get(path)]
+        unchanged = [k for k in known
+                     if k and k["size"] == entry["size"] and k["mtime_ns"] == entry["mtime_ns"]]
+        if path in known_hashes:
+            entry["sha256"] = known_hashes[path]
+        elif unchanged:
+            entry["sha256"] = unchanged[0]["sha256"]
+        else:
+            to_hash.append(rel_path)
+        files[rel_path] = entry
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = executor.map(lambda rel_path: calculate_sha256(os.path.join(root, rel_path)), to_hash)
+        for rel_path, file_hash in zip(to_hash, hashes):
+            files[rel_path]["sha256"] = file_hash
+
+    with _known_file_hashes_lock:
+        for rel_path, entry in files.items():
+            _known_file_hashes[os.path.join(root, rel_path)] = entry
+
     sha256_hash = hashlib.sha256()
+    for rel_path in sorted(files):
+        sha256_hash.update(f"{files[rel_path]['sha256']}  {rel_path}\n".encode())
+    digest = sha256_hash.hexdigest()
+
+    manifest = {"digest": digest, "files": dict(sorted(files.items()))}
+    if manifest_path:
+        tmp_path = Path(f"{manifest_path}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    return digest, manifest
+
+
+def directory_manifest_path(directory_path):
+    '''The hash_directory manifest of a directory, kept next to the directory'''
+    directory_path = Path(directory_path)
+    return directory_path.parent / f"{directory_path.name}_manifest.json"
+
+
+def calculate_sha256_directory(directory_path, manifest_path=None, previous_manifest=None):
+    digest, _ = hash_directory(directory_path, manifest_path, previous_manifest)
+    return digest
+
+
+def _reflink(src, dst):
+    import fcntl  # pylint: disable=import-outside-toplevel
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def snapshot_directory(src_dir, dst_dir):
+    '''
+    Create a snapshot of a directory tree without copying the file contents
+    where possible. Files are hardlinked, if that is not possible they are
+    cloned as reflinks and only if that fails too they are copied. Returns how
+    many files were snapshotted with each method.
+
+    Hardlinks share the file with the source directory, so the snapshot
+    only stays intact as long as files in the source are replaced instead of
+    modified in place, which is what rpki-client does.
+    '''
+    methods = Counter()
+    for root, _dirs, files in os.walk(src_dir):
+        target_root = Path(dst_dir) / os.path.relpath(root, src_dir)
+        target_root.mkdir(parents=True, exist_ok=True)
+        for file in files:
+            methods[link_or_copy(os.path.join(root, file), target_root / file)] += 1
+
+    return methods
+
+
+def link_or_copy(src, dst):
+    '''
+    Make dst a hardlink of src, a reflink if that is not possible or a copy
+    as the last resort. An existing dst is replaced. Returns the method used.
+    '''
+    dst = Path(dst)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+        return "hardlinked"
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        shutil.copystat(src, dst)
+        return "reflinked"
+    except (OSError, ImportError):
+        shutil.copy2(src, dst)
+        return "copied"
 
-    for root, _dirs, files in os.walk(directory_path):
-        for file in sorted(files):
-            file_path = os.path.join(root, file)
-            with open(file_path, "rb") as f:
-                read_block = partial(f.read, 4096)
-                for byte_block in iter(read_block, b""):
-                    sha256_hash.update(byte_block)
 
-    return sha256_hash.hexdigest()
+def process_pool(max_workers=None):
+    '''
+    A pool of worker processes for the stages. The stages run in threads of
+    the pipeline, so the workers are started from a fork server instead of
+    forking the process with the locks held by the other threads.
+    '''
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context("forkserver"))
 
 
 def print_section_header(name):
@@ -131,45 +284,102 @@ def wait_for_launch(wait):
         time.sleep(1)
 
 
-def parse_pfx(pfx):
+ISO8601_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+ISO8601_PATTERN = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)Z", re.ASCII)
+
+
+@lru_cache(maxsize=65536)
+def parse_iso8601_timestamp(value):
     """
-    Attempt to format an IP network or address.
-    If invalid, return None.
+    Convert a UTC timestamp like 2024-07-30T07:55:18Z to a Unix timestamp,
+    with the same result as parsing it with strptime and ISO8601_FORMAT.
+    Raises ValueError if the timestamp is invalid.
+
+    The fields are taken from a single match of the fixed format instead of
+    going through strptime, and since millions of IRR objects share a much
+    smaller number of distinct timestamps the results are cached. Anything
+    that doesn't match the fixed format is left to strptime.
     """
-    if is_valid_pfx(pfx):
-        if "/" in pfx:
-            formatted_pfx = str(ipaddress.ip_network(pfx))
-            return f"{formatted_pfx}"
-        return str(ipaddress.ip_address(pfx))
-    return None
+    match = ISO8601_PATTERN.fullmatch(value)
+    if match:
+        try:
+            return datetime(*map(int, match.groups()), tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+
+    parsed = datetime.strptime(value, ISO8601_FORMAT)
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
 
 
-def is_valid_pfx(pfx):
+def _ipv4_to_int(address):
     """
-    Check whether the IP network or address provided is valid.
+    Parse a dotted IPv4 address with the same rules as ipaddress, returns
+    None if it is not a plain valid address.
     """
+    octets = address.split(".")
+    if len(octets) != 4:
+        return None
+    value = 0
+    for octet in octets:
+        if not (0 < len(octet) <= 3 and octet.isascii() and octet.isdigit()):
+            return None
+        # Leading zeros are ambiguous and rejected by ipaddress as well
+        if octet[0] == "0" and octet != "0":
+            return None
+        octet = int(octet)
+        if octet > 255:
+            return None
+        value = (value << 8) | octet
+    return value
+
+
+def normalize_pfx(pfx):
+    """
+    Parse an IP network or address once into the integer form
+    (IP version, network address as int, prefix length). Addresses are
+    treated as networks of a single address. Returns None if it is invalid,
+    including networks with host bits set.
+
+    The common case of an IPv4 network with a prefix length is parsed
+    without creating ipaddress objects, everything else is left to
+    ipaddress so the same inputs are accepted as by ipaddress.ip_network.
+    """
+    address, sep, length = pfx.partition("/")
+    if sep and length.isascii() and length.isdigit():
+        network = _ipv4_to_int(address)
+        prefixlen = int(length)
+        if network is not None and prefixlen <= 32:
+            if network & ((1 << (32 - prefixlen)) - 1):
+                return None
+            return (4, network, prefixlen)
+
     try:
-        if "/" in pfx:
-            ipaddress.ip_network(pfx)
-            return True
-        ipaddress.ip_address(pfx)
-        return True
+        network = ipaddress.ip_network(pfx)
     except ValueError:
-        return False
+        return None
+    return (network.version, int(network.network_address), network.prefixlen)
+
+
+def format_network(version, network):
+    """Format an integer-encoded network address in its canonical form."""
+    if version == 4:
+        return f"{network >> 24}.{network >> 16 & 255}.{network >> 8 & 255}.{network & 255}"
+    return str(ipaddress.IPv6Address(network))
 
 
-def get_root_network(pfx):
+def format_pfx(version, network, prefixlen):
+    """Format a normalized prefix in its canonical form, like 192.0.2.0/24."""
+    return f"{format_network(version, network)}/{prefixlen}"
+
+
+def parse_pfx(pfx):
     """
-    Extract the top-level network from an IPv4 or IPv6 address.
-    Returns the value as an integer.
+    Attempt to format an IP network or address.
+    If invalid, return None.
     """
-    network = parse_pfx(pfx)
-    if network:
-        v = ipaddress.ip_network(network).version
-        if v == 4:
-            return int(network.split(".", maxsplit=1)[0])
-
-        root_net = network.split(":", maxsplit=1)[0]
-        if root_net:
-            return int(root_net, 16)
-    return None
+    normalized = normalize_pfx(pfx)
+    if normalized is None:
+        return None
+    if "/" in pfx:
+        return format_pfx(*normalized)
+    return format_network(normalized[0], normalized[1])
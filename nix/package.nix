@@ -2,6 +2,7 @@
 let
       pythonBuildDeps = pkgs.python311.withPackages (ps: [
         ps.beautifulsoup4
+        ps.numpy
         ps.pandas
         ps.requests
         ps.tqdm
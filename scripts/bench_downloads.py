@@ -0,0 +1,72 @@
+"""
+Compare downloads with a separate request per attempt, which restart from
+the first byte after a broken connection, to the shared download manager on
+a local stand-in server with a limited bandwidth and a flaky connection.
+Run from the root of the project directory:
+
+    python -m scripts.bench_downloads
+"""
+
+from argparse import ArgumentParser
+import contextlib
+import io
+from pathlib import Path
+import tempfile
+import time
+
+import requests
+
+from kartograf.download import DOWNLOAD_CHUNK_SIZE, DownloadManager, DownloadSink
+from tests.util.http_server import StandInServer
+
+
+def download_with_restarts(url, path, max_retries=5):
+    for _ in range(max_retries):
+        try:
+            response = requests.get(url, stream=True, timeout=(15, 120))
+            response.raise_for_status()
+            with DownloadSink(path) as sink:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    sink.write(chunk)
+            return
+        except requests.RequestException:
+            continue
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the download manager.')
+    parser.add_argument('-n', '--files', type=int, default=7, help='Number of files')
+    parser.add_argument('--size', type=float, default=8, help='Size of each file in MB')
+    parser.add_argument('--bandwidth', type=float, default=40,
+                        help='Bandwidth of the server per response in MB/s')
+    parser.add_argument('--failures', type=int, default=2,
+                        help='Broken off responses per file before one succeeds')
+    args = parser.parse_args()
+
+    size = int(args.size * 1e6)
+    files = {f"/db{i}.gz": bytes([i]) * size for i in range(args.files)}
+    server_args = {"failures": args.failures, "fail_after": size * 3 // 4,
+                   "bandwidth": int(args.bandwidth * 1e6)}
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        with StandInServer(files, **server_args) as server:
+            start = time.perf_counter()
+            for path in files:
+                download_with_restarts(server.url + path, Path(tmp) / path[1:])
+            timings["restart per attempt"] = (time.perf_counter() - start, len(server.requests))
+
+        with StandInServer(files, **server_args) as server:
+            manager = DownloadManager(retry_delay=0)
+            start = time.perf_counter()
+            manager.download_all([(server.url + path, Path(tmp) / path[1:]) for path in files])
+            timings["download manager"] = (time.perf_counter() - start, len(server.requests))
+
+    print(f"{'Method':<22} {'Time (s)':>10} {'Requests':>10}")
+    print("-" * 44)
+    for name, (run_time, request_count) in timings.items():
+        print(f"{name:<22} {run_time:>10.2f} {request_count:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the merge engines on synthetic base and extra maps with IPv4 and
+IPv6 prefixes, a part of the extra prefixes is covered by the base.
+Run from the root of the project directory:
+
+    python -m scripts.bench_merge_engines
+"""
+
+from argparse import ArgumentParser
+import contextlib
+import io
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from kartograf.merge import general_merge
+from kartograf.prefix_map import PrefixMap
+
+ENGINES = ("index", "vectorized")
+
+
+def synthetic_map(count, rng):
+    prefix_map = PrefixMap()
+    for _ in range(count):
+        if rng.random() < 0.7:
+            prefixlen = rng.randrange(16, 25)
+            network = (rng.randrange(1, 224) << 24) | rng.getrandbits(24)
+            network &= ~((1 << (32 - prefixlen)) - 1)
+            prefix_map.add(4, network, prefixlen, rng.randrange(1, 400000))
+        else:
+            prefixlen = rng.randrange(29, 49)
+            network = (0x2 << 124) | rng.getrandbits(124) >> rng.randrange(4)
+            network &= ~((1 << (128 - prefixlen)) - 1)
+            prefix_map.add(6, network, prefixlen, rng.randrange(1, 400000))
+    return prefix_map
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the merge engines.')
+    parser.add_argument('--base', type=int, default=200000, help='Prefixes in the base map')
+    parser.add_argument('--extra', type=int, default=200000, help='Prefixes in the extra map')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_path = Path(tmp) / "base.txt"
+        extra_path = Path(tmp) / "extra.txt"
+        synthetic_map(args.base, rng).write(base_path)
+        synthetic_map(args.extra, rng).write(extra_path)
+
+        for engine in ENGINES:
+            out_path = Path(tmp) / f"out_{engine}.txt"
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                general_merge(base_path, extra_path, None, out_path, engine=engine)
+                run_time = time.perf_counter() - start
+            timings[engine] = (run_time, out_path.read_text())
+
+    print(f"{'Engine':<12} {'Time (s)':>10} {'Entries':>10}")
+    print("-" * 34)
+    for engine, (run_time, result) in timings.items():
+        print(f"{engine:<12} {run_time:>10.2f} {result.count(chr(10)):>10}")
+
+    same = timings["index"][1] == timings["vectorized"][1]
+    print(f"\nResults equal: {'yes' if same else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Compare the batched RPKI validation of kartograf with an experimental
+validation of the whole cache in a single rpki-client run, on a synthetic
+RPKI cache, using the stand-in rpki-client of the tests. The stand-in
+simulates the startup cost of rpki-client and a cost per ROA.
+
+The single run only reports the resulting VRPs, not the details of each
+ROA, so its result is not equivalent and it is not used for maps.
+Run from the root of the project directory:
+
+    python -m scripts.bench_rpki_engines
+"""
+
+from argparse import ArgumentParser
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import random
+import subprocess
+import tempfile
+import time
+
+from kartograf.rpki.fetch import data_tals, validate_rpki_db
+from kartograf.rpki.parse import parse_rpki
+from kartograf.rpki.stream import write_ndjson
+from tests.context import create_test_context
+from tests.util.rpki_client import create_fake_rpki_cache, fake_roa, install_fake_rpki_client
+
+EPOCH = 1730000000
+
+
+def synthetic_roas(count, seed):
+    '''
+    ROAs with random validity periods, about a tenth of them for a prefix
+    that is also covered by another ROA. The chains of about a tenth of the
+    ROAs expire before the ROAs themselves.
+    '''
+    rng = random.Random(seed)
+    roas = []
+    for i in range(count):
+        n = rng.randrange(count * 9 // 10 or 1)
+        valid_until = EPOCH + rng.randrange(86400 * 365)
+        chain_expires = None
+        if rng.random() < 0.1:
+            chain_expires = rng.randrange(EPOCH, valid_until + 1)
+        roas.append(fake_roa(f"{i:08x}", f"45.{n // 256 % 256}.{n % 256}.0/24",
+                             3000 + rng.randrange(1000),
+                             valid_until=valid_until,
+                             valid_since=EPOCH - rng.randrange(86400 * 365),
+                             chain_expires=chain_expires))
+    return roas
+
+
+def validate_single_pass(context):
+    '''
+    Validate the whole cache in a single rpki-client run and write a record
+    for each VRP it outputs, in the format of the records of validate_rpki_db.
+
+    rpki-client only reports the VRPs with the earliest expiry of their
+    certificate chain, so the records carry that as valid_until and have no
+    valid_since, aki and ski. Where ROAs of the same prefix compete, this
+    can make parse_rpki choose a different origin.
+    '''
+    tal_options = [item for path in data_tals(context) for item in ('-t', path)]
+    with tempfile.TemporaryDirectory(dir=context.out_dir_rpki) as output_dir:
+        subprocess.run(["rpki-client", "-j", "-n", "-d", context.data_dir_rpki_cache,
+                        "-P", context.epoch] + tal_options + [output_dir],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        with open(Path(output_dir) / "json", "r") as f:
+            vrps = json.load(f).get("roas", [])
+
+    records = sorted(({
+        "type": "roa",
+        "validation": "OK",
+        "hash_id": f"{vrp['ta']}:{vrp['prefix']}:{vrp['maxLength']}:{vrp['asn']}",
+        "aki": "",
+        "ski": "",
+        "valid_since": 0,
+        "valid_until": vrp["expires"],
+        "vrps": [{"prefix": vrp["prefix"], "asid": vrp["asn"], "maxlen": vrp["maxLength"]}],
+    } for vrp in vrps), key=lambda record: record["hash_id"])
+    write_ndjson(records, Path(context.out_dir_rpki) / "rpki_raw.ndjson")
+
+
+ENGINES = {"batched": validate_rpki_db, "single-pass": validate_single_pass}
+
+
+def run_engine(context, engine):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        ENGINES[engine](context)
+        run_time = time.perf_counter() - start
+        parse_rpki(context)
+
+    final_result = Path(context.out_dir_rpki) / "rpki_final.txt"
+    return run_time, sorted(final_result.read_text().splitlines())
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the RPKI validation engines.')
+    parser.add_argument('-n', '--roas', type=int, default=5000, help='ROAs in the synthetic cache')
+    parser.add_argument('--startup', type=float, default=0.3,
+                        help='Simulated startup time of rpki-client in seconds')
+    parser.add_argument('--per-roa', type=float, default=0.0005,
+                        help='Simulated validation time per ROA in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["FAKE_RPKI_CLIENT_STARTUP"] = str(args.startup)
+    os.environ["FAKE_RPKI_CLIENT_PER_ROA"] = str(args.per_roa)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        install_fake_rpki_client(Path(tmp) / "bin")
+        context = create_test_context(Path(tmp), str(EPOCH))
+        create_fake_rpki_cache(context, synthetic_roas(args.roas, args.seed), repos=50)
+
+        results = {engine: run_engine(context, engine) for engine in ENGINES}
+
+    print(f"{'Engine':<15} {'Time (s)':>10} {'Map entries':>12}")
+    print("-" * 39)
+    for engine, (run_time, entries) in results.items():
+        print(f"{engine:<15} {run_time:>10.2f} {len(entries):>12}")
+
+    # The single run can choose different origins for prefixes with
+    # multiple ROAs, but it validates the same prefixes
+    batched = dict(entry.split() for entry in results["batched"][1])
+    single_pass = dict(entry.split() for entry in results["single-pass"][1])
+    other_origin = sum(1 for pfx, asn in batched.items() if single_pass.get(pfx, asn) != asn)
+    print(f"\nSame prefixes mapped: {'yes' if batched.keys() == single_pass.keys() else 'no'}")
+    print(f"Prefixes mapped to a different origin: {other_origin}")
+
+
+if __name__ == "__main__":
+    main()
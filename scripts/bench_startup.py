@@ -0,0 +1,46 @@
+"""
+Measure the startup time of short kartograf CLI invocations.
+Run from the root of the project directory:
+
+    python -m scripts.bench_startup
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+
+FIXTURES = Path("tests") / "data"
+
+INVOCATIONS = {
+    "python (baseline)": ["-c", "pass"],
+    "--version": ["-m", "kartograf.cli", "--version"],
+    "cov": ["-m", "kartograf.cli", "cov", str(FIXTURES / "map_file.txt"),
+            str(FIXTURES / "ip_list.txt")],
+    "import map pipeline": ["-c", "import kartograf.kartograf"],
+}
+
+
+def measure(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, capture_output=True, check=False)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the startup time of the kartograf CLI.')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Runs per invocation')
+    args = parser.parse_args()
+
+    print(f"{'Invocation':<25} {'Median (ms)':>12}")
+    print("-" * 38)
+    for name, invocation in INVOCATIONS.items():
+        print(f"{name:<25} {measure(invocation, args.runs) * 1000:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,19 @@
-from kartograf.bogon import is_bogon_pfx, is_bogon_asn, extract_asn, is_out_of_encoding_range
-from kartograf.util import parse_pfx
+import ipaddress
+import random
+
+from kartograf.bogon import (
+    BOGON_FILTER,
+    BogonFilter,
+    SPECIAL_IPV4,
+    SPECIAL_IPV6,
+    RESERVED_ASNS,
+    RESERVED_ASN_RANGES,
+    is_bogon_pfx,
+    is_bogon_asn,
+    extract_asn,
+    is_out_of_encoding_range,
+)
+from kartograf.util import format_pfx, normalize_pfx, parse_pfx
 
 def test_special_asns():
     special_cases = [0, 112, 23456, 65535, 4294967295]
@@ -79,3 +93,70 @@ def test_valid_ipv6_prefixes():
     for prefix in valid_prefixes:
         network = parse_pfx(prefix)
         assert is_bogon_pfx(network) is False
+
+def random_prefixes(rng, count):
+    """
+    Random prefixes around the edges of the special networks, and random
+    prefixes of any length.
+    """
+    prefixes = []
+    for special in SPECIAL_IPV4 + SPECIAL_IPV6:
+        network = ipaddress.ip_network(special)
+        bits = network.max_prefixlen
+        for address in (int(network.network_address), int(network.broadcast_address),
+                        int(network.network_address) - 1, int(network.broadcast_address) + 1):
+            address %= 1 << bits
+            for prefixlen in (0, 1, network.prefixlen - 1, network.prefixlen,
+                              network.prefixlen + 1, bits):
+                prefixlen = min(max(prefixlen, 0), bits)
+                host_mask = (1 << (bits - prefixlen)) - 1
+                prefixes.append((network.version, address & ~host_mask, prefixlen))
+    for _ in range(count):
+        version = rng.choice((4, 6))
+        bits = 32 if version == 4 else 128
+        prefixlen = rng.randrange(bits + 1)
+        host_mask = (1 << (bits - prefixlen)) - 1
+        prefixes.append((version, rng.getrandbits(bits) & ~host_mask, prefixlen))
+    return prefixes
+
+
+def test_bogon_filter_matches_bogon_pfx():
+    prefixes = random_prefixes(random.Random(0), 3000)
+    expected = [is_bogon_pfx(format_pfx(*prefix)) for prefix in prefixes]
+
+    assert [BOGON_FILTER.is_bogon_network(*prefix) for prefix in prefixes] == expected
+    assert BOGON_FILTER.bogon_networks(prefixes).tolist() == expected
+    assert normalize_pfx("224.0.0.0/3") == (4, 224 << 24, 3)
+    assert BOGON_FILTER.is_bogon_network(4, 224 << 24, 3) is False
+
+
+def test_bogon_filter_with_long_ipv6_networks():
+    """
+    The batch check of IPv6 prefixes falls back to the full addresses for
+    special networks longer than /64.
+    """
+    special = ["2001:1::1/128", "64:ff9b::/96", "2001:db8::/32"]
+    bogon_filter = BogonFilter(ipv6=special)
+    prefixes = [normalize_pfx(p) for p in
+                ("2001:1::1/128", "2001:1::2/128", "64:ff9b::/96", "64:ff9b::/95",
+                 "64:ff9b::1:0/112", "2001:db8:1::/48", "2001:db8::/31")]
+    expected = [any(ipaddress.ip_network(format_pfx(*p)).subnet_of(ipaddress.ip_network(s))
+                    for s in special) for p in prefixes]
+    assert bogon_filter.bogon_networks(prefixes).tolist() == expected
+    assert [bogon_filter.is_bogon_network(*p) for p in prefixes] == expected
+    assert expected == [True, False, True, False, True, True, False]
+
+
+def test_bogon_filter_matches_bogon_asn():
+    rng = random.Random(0)
+    asns = [asn + delta for asn in RESERVED_ASNS for delta in (-1, 0, 1)]
+    asns += [asn + delta for start, end in RESERVED_ASN_RANGES
+             for asn in (start, end) for delta in (-1, 0, 1)]
+    asns += [rng.randrange(1 << 32) for _ in range(3000)]
+    asns = [asn for asn in asns if 0 <= asn < 1 << 32]
+    expected = [is_bogon_asn(asn) for asn in asns]
+
+    assert [BOGON_FILTER.is_bogon_asn(asn) for asn in asns] == expected
+    assert BOGON_FILTER.bogon_asns(asns).tolist() == expected
+    assert BOGON_FILTER.is_bogon_asn("AS64512") is True
+    assert BOGON_FILTER.is_bogon_asn("AS13335") is False
@@ -1,19 +1,32 @@
 import csv
-import json
+import gzip
 import os
 import shutil
 from pathlib import Path
 from types import SimpleNamespace
 from kartograf.context import Context
+from kartograf.rpki.stream import write_ndjson
 
 TEST_ARGS = SimpleNamespace(**{
     "wait": None,
     "reproduce": None,
+    "resume": False,
+    "incremental": None,
     "irr": False,
     "routeviews": False,
     "max_encode": 33521664,
     "debug": False,
+    "profile": False,
+    "in_memory": False,
     "stable_repos": False,
+    "rpki_cache": None,
+    "validation_cache": None,
+    "max_workers": None,
+    "rpki_workers": None,
+    "irr_workers": None,
+    "merge_engine": "index",
+    "max_downloads": 8,
+    "mirror": None,
     "wipe_data_dir": False,
     "cleanup_out_files": [],
     "epoch": None
@@ -25,7 +38,7 @@ def irr_fixtures():
 
 def load_rpki_csv_to_json(context, fixtures_path):
     '''
-    Loads a fixtures CSV file into a rpki_raw.json file in the "tests/out/" directory.
+    Loads a fixtures CSV file into a rpki_raw.ndjson file in the "tests/out/" directory.
     '''
     csv_path = fixtures_path / "rpki_raw.csv"
     rpki_data = []
@@ -39,13 +52,18 @@ def load_rpki_csv_to_json(context, fixtures_path):
             row["vrps"] = vrps
             rpki_data.append(row)
 
-    output_path = Path(context.out_dir_rpki) / 'rpki_raw.json'
-    with open(output_path, 'w') as jsonfile:
-        json.dump(rpki_data, jsonfile, indent=2)
+    output_path = Path(context.out_dir_rpki) / 'rpki_raw.ndjson'
+    write_ndjson(rpki_data, output_path)
 
 def load_irr_fixtures(context, fixtures_path):
+    '''
+    Compresses the IRR fixtures into the "data/irr" directory, like the
+    downloaded IRR DBs.
+    '''
     for file in irr_fixtures():
-        shutil.copy2(Path(fixtures_path) / file, context.out_dir_irr)
+        with open(Path(fixtures_path) / file, 'rb') as r:
+            with gzip.open(Path(context.data_dir_irr) / f"{file}.gz", 'wb') as w:
+                shutil.copyfileobj(r, w)
 
 def setup_test_data(context):
     fixtures_path = Path(__file__).parent / "data"
@@ -34,6 +34,19 @@ def test_reproduce_args_failure(capsys):
     captured = capsys.readouterr()
     assert "--reproduce is required when --epoch is set." in captured.err
 
+def test_resume_args(parser, capsys):
+    args = parser.parse_args(['map'])
+    assert args.resume is False
+
+    args = parser.parse_args(['map', '--resume', '-t', '123'])
+    assert args.resume is True
+    assert args.epoch == '123'
+
+    with pytest.raises(SystemExit):
+        main(['map', '--resume'])
+    captured = capsys.readouterr()
+    assert "--epoch is required when --resume is set." in captured.err
+
 def test_map_with_options(parser):
     args = parser.parse_args(['map', '-wd', '-irr', '-rv', '-r', '/path', '-t', '123'])
     assert args.wipe_data_dir is True
@@ -42,6 +55,12 @@ def test_map_with_options(parser):
     assert args.reproduce == '/path'
     assert args.epoch == '123'
 
+def test_incremental_flag(parser):
+    assert parser.parse_args(['map']).incremental is None
+    # Without an epoch the run only stores its parsed entries
+    assert parser.parse_args(['map', '-inc']).incremental == ''
+    assert parser.parse_args(['map', '--incremental', '123']).incremental == '123'
+
 def test_stable_repos_flag(parser):
     args = parser.parse_args(['map'])
     assert args.stable_repos is False
@@ -65,6 +84,9 @@ def test_merge_command(parser):
     assert args.base.endswith('base_file.txt')
     assert args.extra.endswith('extra_file.txt')
     assert args.output.endswith('out_file.txt')
+    assert args.merge_engine == 'index'
+    args = parser.parse_args(['merge', '--merge-engine', 'vectorized'])
+    assert args.merge_engine == 'vectorized'
 
 def test_cov_command_error(parser, capsys):
     with pytest.raises(SystemExit):
@@ -1,7 +1,11 @@
+import gzip
 from pathlib import Path
 import shutil
+from types import SimpleNamespace
 
 from kartograf.collectors.parse import parse_routeviews_pfx2as
+from kartograf.collectors.routeviews import extract_routeviews_pfx2as
+from kartograf.incremental import ParsedSources
 from .context import create_test_context
 
 def build_test_context(tmp_path):
@@ -34,3 +38,24 @@ def test_parse(tmp_path):
     assert "2ab1:db8::/32 AS33521665" not in results
 
     assert results == ["1.0.0.0/24 AS13335", "1.0.4.0/24 AS38803", "1.0.16.0/24 AS2519"]
+
+
+def test_reused_entries_are_not_extracted(tmp_path):
+    def run(epoch, incremental):
+        context = create_test_context(tmp_path, epoch)
+        context.args = SimpleNamespace(**{**vars(context.args), "incremental": incremental})
+        context.parsed_sources = ParsedSources(context)
+        for version, line in ((4, "1.0.0.0\t24\t13335\n"), (6, "2a04:100::\t32\t3008\n")):
+            with gzip.open(Path(context.data_dir_collectors) / f"routeviews_pfx2asn_ip{version}.txt.gz", "wt") as f:
+                f.write(line)
+        extract_routeviews_pfx2as(context)
+        parse_routeviews_pfx2as(context)
+        extracted = (Path(context.out_dir_collectors) / "pfx2asn.txt").exists()
+        return (Path(context.out_dir_collectors) / "pfx2asn_clean.txt").read_text(), extracted
+
+    first, extracted = run("111111120", "")
+    assert first == "1.0.0.0/24 AS13335\n2a04:100::/32 AS3008\n"
+    assert extracted
+
+    # The sources did not change, so they don't need to be extracted again
+    assert run("111111121", "111111120") == (first, False)
@@ -101,3 +101,31 @@ def test_directory_creation(parser, tmp_path):
     assert isinstance(out_dir_collectors, str)
     assert Path(out_dir_collectors).exists()
     assert Path(out_dir_collectors).name == "collectors"
+
+def test_map_context_with_resume(parser, tmp_path):
+    os.chdir(tmp_path)
+    args = parser.parse_args(['map', '-irr', '-t', '1225411200'])
+    Context(args)
+
+    # The directories of the interrupted run are reused
+    args = parser.parse_args(['map', '-irr', '--resume', '-t', '1225411200'])
+    context = Context(args)
+    assert context.resume is True
+    assert context.epoch_dir == '1225411200'
+    assert Path(context.out_dir_irr).exists()
+    assert Path(context.manifest_file).parent == Path(context.out_dir)
+
+def test_map_context_shares_workers(parser, tmp_path):
+    os.chdir(tmp_path)
+    context = Context(parser.parse_args(['map', '-mw', '8', '-t', '1225411200']))
+    assert (context.rpki_workers, context.irr_workers) == (8, 1)
+
+    # Validating RPKI and parsing IRR run at the same time
+    context = Context(parser.parse_args(['map', '-irr', '-mw', '8', '-t', '1225411201']))
+    assert (context.rpki_workers, context.irr_workers) == (4, 4)
+
+    context = Context(parser.parse_args(['map', '-irr', '-mw', '32', '-t', '1225411202']))
+    assert (context.rpki_workers, context.irr_workers) == (25, 7)
+
+    context = Context(parser.parse_args(['map', '-irr', '-mw', '8', '-iw', '2', '-t', '1225411203']))
+    assert (context.rpki_workers, context.irr_workers) == (4, 2)
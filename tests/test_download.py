@@ -0,0 +1,191 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from kartograf.download import (
+    DOWNLOAD_CHUNK_SIZE,
+    DownloadError,
+    DownloadManager,
+    DownloadSink,
+)
+from kartograf.util import calculate_sha256, calculate_sha256_directory
+from .util.http_server import StandInServer
+
+
+def test_download_sink_hashes_while_writing(tmp_path):
+    body = bytes(range(256)) * (DOWNLOAD_CHUNK_SIZE // 100)
+    path = tmp_path / "ripe.db.route.gz"
+
+    with DownloadSink(path) as sink:
+        for i in range(0, len(body), DOWNLOAD_CHUNK_SIZE):
+            sink.write(body[i:i + DOWNLOAD_CHUNK_SIZE])
+
+    assert path.read_bytes() == body
+    assert sink.hexdigest() == hashlib.sha256(body).hexdigest() == calculate_sha256(path)
+    assert sink.size == len(body)
+    assert sink.throughput() > 0
+    assert "MB/s" in sink.summary()
+
+
+def test_download_sink_empty(tmp_path):
+    with DownloadSink(tmp_path / "empty") as sink:
+        pass
+    assert sink.hexdigest() == hashlib.sha256(b"").hexdigest()
+    assert sink.size == 0
+
+
+FILES = {f"/irr/db{i}.gz": bytes([i]) * (50000 + i) for i in range(4)}
+
+
+def test_download_manager_pools_connections(tmp_path):
+    manager = DownloadManager(max_concurrent=2)
+    with StandInServer(FILES) as server:
+        for path in FILES:
+            manager.download(server.url + path, tmp_path / Path(path).name)
+        # Sequential downloads from a host reuse the same connection
+        assert server.connections() == 1
+
+    for path, content in FILES.items():
+        assert (tmp_path / Path(path).name).read_bytes() == content
+    metrics = manager.metrics()
+    assert [m["file"] for m in metrics] == [Path(p).name for p in FILES]
+    assert all(m["attempts"] == 1 and m["resumed_bytes"] == 0 for m in metrics)
+    assert metrics[0]["sha256"] == hashlib.sha256(FILES["/irr/db0.gz"]).hexdigest()
+
+
+def test_download_manager_hashes_directory_of_downloads(tmp_path, monkeypatch):
+    data_dir = tmp_path / "irr"
+    data_dir.mkdir()
+    manager = DownloadManager()
+    with StandInServer(FILES) as server:
+        manager.download_all([(server.url + path, data_dir / Path(path).name) for path in FILES])
+    expected = hashlib.sha256("".join(f"{hashlib.sha256(content).hexdigest()}  {Path(path).name}\n"
+                                      for path, content in sorted(FILES.items())).encode()).hexdigest()
+
+    def fail(path):
+        raise AssertionError(f"{path} hashed again")
+
+    monkeypatch.setattr("kartograf.util.calculate_sha256", fail)
+    manifest = tmp_path / "irr_manifest.json"
+    assert manager.hash_directory(data_dir, manifest) == expected
+    assert manifest.exists()
+    monkeypatch.undo()
+    assert calculate_sha256_directory(data_dir) == expected
+
+
+def test_download_manager_limits_concurrency(tmp_path):
+    manager = DownloadManager(max_concurrent=2)
+    with StandInServer(FILES, bandwidth=500000) as server:
+        results = manager.download_all([(server.url + path, tmp_path / Path(path).name)
+                                        for path in FILES])
+        assert server.max_active == 2
+    assert [r["bytes"] for r in results] == [len(c) for c in FILES.values()]
+
+
+def test_download_manager_resumes_partial_downloads(tmp_path):
+    # Only complete chunks of a broken off response end up in the file
+    content = bytes(range(256)) * (3 * DOWNLOAD_CHUNK_SIZE // 256)
+    manager = DownloadManager(retry_delay=0)
+    with StandInServer({"/ripe.db.gz": content}, failures=2,
+                       fail_after=DOWNLOAD_CHUNK_SIZE * 3 // 2) as server:
+        result = manager.download(server.url + "/ripe.db.gz", tmp_path / "ripe.db.gz")
+        ranges = [r["headers"].get("Range") for r in server.requests]
+
+        if_ranges = {r["headers"].get("If-Range") for r in server.requests[1:]}
+
+    assert ranges == [None, f"bytes={DOWNLOAD_CHUNK_SIZE}-", f"bytes={2 * DOWNLOAD_CHUNK_SIZE}-"]
+    # The continued ranges are only sent for the version of the first response
+    assert if_ranges == {f'"{hashlib.sha256(content).hexdigest()[:16]}"'}
+    assert (tmp_path / "ripe.db.gz").read_bytes() == content
+    assert result["attempts"] == 3
+    assert result["resumed_bytes"] == 2 * DOWNLOAD_CHUNK_SIZE
+    assert result["sha256"] == hashlib.sha256(content).hexdigest()
+    assert manager.file_hash(tmp_path / "ripe.db.gz") == result["sha256"]
+    assert manager.file_hash(tmp_path / "other.db.gz") is None
+
+
+def test_download_manager_restarts_if_the_file_changed(tmp_path, monkeypatch):
+    content = bytes(range(256)) * (3 * DOWNLOAD_CHUNK_SIZE // 256)
+    changed = content[::-1]
+    files = {"/ripe.db.gz": content}
+    manager = DownloadManager(retry_delay=0)
+
+    with StandInServer(files, failures=1, fail_after=DOWNLOAD_CHUNK_SIZE * 3 // 2) as server:
+        def change_file(_delay):
+            files["/ripe.db.gz"] = changed
+            server.last_modified["/ripe.db.gz"] = "Sun, 04 Jan 2009 18:15:05 GMT"
+
+        # The file changes on the server while the client waits to retry
+        monkeypatch.setattr("kartograf.download.time.sleep", change_file)
+        result = manager.download(server.url + "/ripe.db.gz", tmp_path / "ripe.db.gz")
+        ranges = [r["headers"].get("Range") for r in server.requests]
+
+    assert ranges == [None, f"bytes={DOWNLOAD_CHUNK_SIZE}-"]
+    assert (tmp_path / "ripe.db.gz").read_bytes() == changed
+    assert result["resumed_bytes"] == 0
+    assert result["sha256"] == hashlib.sha256(changed).hexdigest()
+
+
+def test_download_manager_restarts_on_mismatched_range(tmp_path):
+    content = bytes(range(256)) * (3 * DOWNLOAD_CHUNK_SIZE // 256)
+    manager = DownloadManager(retry_delay=0)
+    with StandInServer({"/ripe.db.gz": content}, failures=1,
+                       fail_after=DOWNLOAD_CHUNK_SIZE * 3 // 2, range_shift=-10) as server:
+        result = manager.download(server.url + "/ripe.db.gz", tmp_path / "ripe.db.gz")
+        ranges = [r["headers"].get("Range") for r in server.requests]
+
+    # The range that doesn't start at the offset is dropped and the download
+    # starts over
+    assert ranges == [None, f"bytes={DOWNLOAD_CHUNK_SIZE}-", None]
+    assert (tmp_path / "ripe.db.gz").read_bytes() == content
+    assert result["resumed_bytes"] == 0
+
+
+def test_download_manager_restarts_without_range_support(tmp_path):
+    content = FILES["/irr/db2.gz"]
+    manager = DownloadManager(retry_delay=0)
+    with StandInServer(FILES, failures=1, fail_after=1000, supports_range=False) as server:
+        result = manager.download(server.url + "/irr/db2.gz", tmp_path / "db2.gz")
+    assert (tmp_path / "db2.gz").read_bytes() == content
+    assert result["resumed_bytes"] == 0
+    assert result["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_download_manager_gives_up(tmp_path):
+    manager = DownloadManager(max_retries=2, retry_delay=0)
+    with StandInServer(FILES, failures=5, fail_after=10) as server:
+        with pytest.raises(DownloadError):
+            manager.download(server.url + "/irr/db3.gz", tmp_path / "db3.gz")
+        assert len(server.requests) == 2
+
+
+def test_download_manager_mirror(tmp_path):
+    files = dict(FILES)
+    first_epoch = tmp_path / "1" / "irr"
+    second_epoch = tmp_path / "2" / "irr"
+    third_epoch = tmp_path / "3" / "irr"
+    for epoch in (first_epoch, second_epoch, third_epoch):
+        epoch.mkdir(parents=True)
+
+    with StandInServer(files) as server:
+        url = server.url + "/irr/db0.gz"
+        first = DownloadManager(mirror_dir=tmp_path / "mirror").download(url, first_epoch / "db0.gz")
+        second = DownloadManager(mirror_dir=tmp_path / "mirror").download(url, second_epoch / "db0.gz")
+        assert server.requests[1]["headers"]["If-None-Match"]
+
+        files["/irr/db0.gz"] = b"changed"
+        third = DownloadManager(mirror_dir=tmp_path / "mirror").download(url, third_epoch / "db0.gz")
+
+    assert not first["not_modified"]
+    # Unchanged files are linked from the mirror instead of transferred
+    assert second["not_modified"]
+    assert second["bytes"] == 0
+    assert second["sha256"] == first["sha256"]
+    assert (second_epoch / "db0.gz").read_bytes() == FILES["/irr/db0.gz"]
+    assert (second_epoch / "db0.gz").stat().st_ino == (first_epoch / "db0.gz").stat().st_ino
+
+    # A changed file is downloaded again without touching earlier epochs
+    assert not third["not_modified"]
+    assert (third_epoch / "db0.gz").read_bytes() == b"changed"
+    assert (first_epoch / "db0.gz").read_bytes() == FILES["/irr/db0.gz"]
@@ -1,6 +1,11 @@
+import gzip
+import json
 from pathlib import Path
+from types import SimpleNamespace
 
+from kartograf.incremental import ParsedSources
 from kartograf.irr.parse import parse_irr
+from kartograf.util import normalize_pfx
 from .context import create_test_context, setup_test_data
 
 
@@ -44,3 +49,156 @@ def test_parse_validation_cases(tmp_path):
 
     # Test expected set
     assert content == ["193.254.30.0/24 AS12726", "212.166.64.0/19 AS12321", "212.80.191.0/24 AS12541", "212.16.0.0/24 AS12346", "212.17.0.0/24 AS12347", "2345:2ca::/32 AS12345" ]
+
+
+def test_incremental_reuses_unchanged_sources(tmp_path, capsys):
+    """
+    Parsed entries of an unchanged IRR DB are reused from the previous epoch,
+    a changed DB is parsed again.
+    """
+    def run(epoch, incremental, source):
+        context = create_test_context(tmp_path, epoch)
+        setup_test_data(context)
+        context.args = SimpleNamespace(**{**vars(context.args), "incremental": incremental})
+        context.parsed_sources = ParsedSources(context)
+        with gzip.open(Path(context.data_dir_irr) / "irr_ripe.txt.gz", "wb") as f:
+            f.write(source)
+        parse_irr(context)
+        with open(Path(context.out_dir_irr) / "irr_final.txt", "r") as f:
+            return f.read()
+
+    source = (Path(__file__).parent / "data" / "irr_ripe.txt").read_bytes()
+    # Parsed entries are only stored in incremental runs
+    run("111111119", None, source)
+    assert not (tmp_path / "out" / "111111119" / "parsed").exists()
+
+    full = run("111111120", "", source)
+    capsys.readouterr()
+
+    assert run("111111121", "111111120", source) == full
+    assert "Reusing parsed irr_ripe.txt" in capsys.readouterr().out
+
+    assert run("111111122", "111111121", source + b"\n") == full
+    assert "Reusing parsed" not in capsys.readouterr().out
+
+
+def test_parse_reads_gzipped_dbs_directly(tmp_path):
+    """
+    The IRR DBs are parsed from the downloaded gzip files without extracting
+    them into the out directory.
+    """
+    context = build_test_context(tmp_path)
+    parse_irr(context)
+
+    out_files = sorted(p.name for p in Path(context.out_dir_irr).iterdir())
+    assert out_files == ["irr_final.txt"]
+
+
+def write_irr_db(context, name, objects):
+    with gzip.open(Path(context.data_dir_irr) / name, "wt", encoding="ISO-8859-1") as f:
+        for route, origin, source, last_modified in objects:
+            attribute = "route6" if ":" in route else "route"
+            f.write(f"{attribute}: {route}\norigin: {origin}\n"
+                    f"last-modified: {last_modified}\nsource: {source}\n\n")
+
+
+def test_parallel_parse_matches_sequential(tmp_path):
+    """
+    Parsing the IRR DBs in worker processes gives the same result, in the
+    same order, as parsing them one after another. Prefixes that are found
+    in multiple DBs are resolved with the same rules as within a DB.
+    """
+    def run(epoch, workers):
+        context = create_test_context(tmp_path, epoch)
+        setup_test_data(context)
+        context.irr_workers = workers
+        write_irr_db(context, "arin.db.gz", [
+            ("45.10.0.0/24", "AS3001", "ARIN", "2020-01-01T00:00:00Z"),
+            ("45.11.0.0/24", "AS3002", "ARIN", "2021-01-01T00:00:00Z"),
+            ("45.12.0.0/24", "AS3004", "ARIN", "2022-01-01T00:00:00Z"),
+        ])
+        write_irr_db(context, "apnic.db.route.gz", [
+            ("45.10.0.0/24", "AS3005", "APNIC", "2023-01-01T00:00:00Z"),
+            ("45.11.0.0/24", "AS3006", "APNIC", "2020-01-01T00:00:00Z"),
+            ("45.12.0.0/24", "AS3003", "APNIC", "2022-01-01T00:00:00Z"),
+            ("45.13.0.0/24", "AS3007", "RIPE", "2022-01-01T00:00:00Z"),
+        ])
+        write_irr_db(context, "apnic.db.route6.gz", [
+            ("2a04:100::/32", "AS3008", "APNIC", "2022-01-01T00:00:00Z"),
+        ])
+        parse_irr(context)
+        with open(Path(context.out_dir_irr) / "irr_final.txt", "r") as f:
+            return f.read().splitlines()
+
+    sequential = run("111111130", 1)
+    parallel = run("111111131", 4)
+
+    assert parallel == sequential
+    assert "45.10.0.0/24 AS3005" in parallel
+    assert "45.11.0.0/24 AS3002" in parallel
+    assert "45.12.0.0/24 AS3003" in parallel
+    assert "45.13.0.0/24 AS3007" not in parallel
+    assert "2a04:100::/32 AS3008" in parallel
+    assert "212.16.0.0/24 AS12346" in parallel
+
+
+def test_origins_are_parsed_as_integers(tmp_path):
+    """
+    Origins are carried as integer ASNs and only formatted as AS strings in
+    the result file.
+    """
+    context = build_test_context(tmp_path)
+    write_irr_db(context, "arin.db.gz", [
+        ("45.10.0.0/24", "as3010", "ARIN", "2020-01-01T00:00:00Z"),
+        ("45.10.0.0/24", "AS900", "ARIN", "2020-01-01T00:00:00Z"),
+        ("45.11.0.0/24", "AS3002 # moved", "ARIN", "2021-01-01T00:00:00Z"),
+    ])
+    context.args = SimpleNamespace(**{**vars(context.args), "incremental": ""})
+    context.parsed_sources = ParsedSources(context)
+    parse_irr(context)
+
+    with open(Path(context.out_dir_irr) / "irr_final.txt", "r") as f:
+        content = f.read().splitlines()
+    assert "45.10.0.0/24 AS900" in content
+    assert "45.11.0.0/24 AS3002" in content
+
+    with open(Path(context.out_dir) / "parsed" / "irr" / "arin.db.json", "r") as f:
+        entries = json.load(f)["entries"]
+    # The routes are stored in their normalized form
+    assert [entry[:2] for entry in entries] == [[[4, normalize_pfx("45.10.0.0/24")[1], 24], 900],
+                                                [[4, normalize_pfx("45.11.0.0/24")[1], 24], 3002]]
+
+
+def test_malformed_routes_and_origins_are_skipped(tmp_path):
+    context = build_test_context(tmp_path)
+    context.debug_log = tmp_path / "debug.log"
+    write_irr_db(context, "arin.db.gz", [
+        ("999.1.2.0/24", "ASXYZ", "ARIN", "2020-01-01T00:00:00Z"),
+        ("45.12.0.0/24", "ASXYZ", "ARIN", "2020-01-01T00:00:00Z"),
+        ("45.13.0.0/24", "AS3013", "ARIN", "2020-01-01T00:00:00Z"),
+    ])
+    parse_irr(context)
+
+    with open(Path(context.out_dir_irr) / "irr_final.txt", "r") as f:
+        content = f.read().splitlines()
+    assert "45.13.0.0/24 AS3013" in content
+    assert not any(line.startswith("45.12.0.0/24") for line in content)
+    assert "invalid origin: ASXYZ for route 45.12.0.0/24" in context.debug_log.read_text()
+
+
+def test_sources_are_only_hashed_in_incremental_runs(tmp_path, monkeypatch):
+    def hash_file(_):
+        raise AssertionError("source file read again to hash it")
+
+    monkeypatch.setattr("kartograf.incremental.calculate_sha256", hash_file)
+    context = build_test_context(tmp_path)
+    parse_irr(context)
+    assert not (Path(context.out_dir) / "parsed").exists()
+
+    # The hashes computed while downloading are reused
+    context.args = SimpleNamespace(**{**vars(context.args), "incremental": ""})
+    context.parsed_sources = ParsedSources(context)
+    monkeypatch.setattr(context.downloads, "file_hash", lambda path: f"sha256 of {Path(path).name}")
+    parse_irr(context)
+    with open(Path(context.out_dir) / "parsed" / "irr" / "irr_ripe.txt.json", "r") as f:
+        assert json.load(f)["source_sha256"] == "sha256 of irr_ripe.txt.gz"
@@ -0,0 +1,81 @@
+from kartograf.irr.rpsl import iter_rpsl_objects
+
+
+def scan(text, **kwargs):
+    return list(iter_rpsl_objects(text.splitlines(keepends=True), **kwargs))
+
+
+def test_only_route_attributes_are_kept():
+    text = (
+        "route:          193.254.30.0/24\n"
+        "descr:          Lufthansa Airplus Servicekarten GmbH\n"
+        "origin:         AS12726\n"
+        "mnt-by:         AS12312-MNT\n"
+        "last-modified:  2024-07-30T07:55:18Z\n"
+        "source:         RIPE\n"
+        "\n"
+        "route6:         2345:2ca::/32\n"
+        "origin:         AS12345\n"
+        "source:         RIPE\n"
+        "\n"
+    )
+    assert scan(text) == [
+        {"route": "193.254.30.0/24", "origin": "AS12726",
+         "last-modified": "2024-07-30T07:55:18Z", "source": "RIPE"},
+        {"route6": "2345:2ca::/32", "origin": "AS12345", "source": "RIPE"},
+    ]
+
+
+def test_continuation_lines():
+    """
+    Lines starting with a space, a tab or a plus continue the value of the
+    previous attribute, also values that contain a colon.
+    """
+    text = (
+        "route:          212.16.0.0/24\n"
+        "origin:         AS12345\n"
+        "                # moved: see ticket\n"
+        "descr:          first line\n"
+        "+               second: line\n"
+        "\tthird line\n"
+        "source:\n"
+        "+\n"
+        "\tRIPE\n"
+    )
+    assert scan(text) == [
+        {"route": "212.16.0.0/24", "origin": "AS12345 # moved: see ticket", "source": "RIPE"},
+    ]
+
+
+def test_object_boundaries_and_comments():
+    """
+    Comments, repeated empty lines and lines with only whitespace don't
+    create objects, the last object doesn't need a trailing empty line.
+    """
+    text = (
+        "% This is the RIPE Database query service.\n"
+        "# comment\n"
+        "\n"
+        "\n"
+        "route:          212.16.0.0/24\n"
+        "% comment: inside an object\n"
+        "origin:         AS12345\n"
+        "origin:         AS12346\n"
+        "   \n"
+        "mntner:         EXAMPLE-MNT\n"
+        "\n"
+        "route:          212.17.0.0/24\n"
+        "source:         RIPE"
+    )
+    assert scan(text) == [
+        {"route": "212.16.0.0/24", "origin": "AS12346"},
+        {},
+        {"route": "212.17.0.0/24", "source": "RIPE"},
+    ]
+
+
+def test_custom_attributes():
+    text = "mntner: EXAMPLE-MNT\nauth: SSO\nsource: RIPE\n"
+    assert scan(text, attributes={"mntner", "auth"}) == [
+        {"mntner": "EXAMPLE-MNT", "auth": "SSO"},
+    ]
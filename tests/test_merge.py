@@ -1,9 +1,20 @@
 '''
 Test merging multiple sets of networks, as if they were independent AS files.
 '''
+import random
 from pathlib import Path
 
-from kartograf.merge import general_merge, pick_chunk_size
+import pytest
+
+from kartograf.merge import (
+    BaseNetworkIndex,
+    contains_networks,
+    general_merge,
+    merge_prefix_maps,
+    network_halves,
+    pick_chunk_size,
+)
+from kartograf.prefix_map import PrefixMap
 
 from .util.generate_data import (
     build_file_lines,
@@ -15,6 +26,9 @@ from .util.generate_data import (
 )
 
 
+MERGE_ENGINES = ["index", "vectorized"]
+
+
 def __tmp_paths(tmp_path):
     return [tmp_path / p for p in ["rpki_final.txt", "irr_final.txt", "out.txt"]]
 
@@ -34,7 +48,8 @@ def __read_test_vectors(filepath):
                 all_in_result.append(network)
     return all_networks, all_in_result
 
-def test_merge_from_fixtures(tmp_path):
+@pytest.mark.parametrize("engine", MERGE_ENGINES)
+def test_merge_from_fixtures(tmp_path, engine):
     '''
     Assert that general_merge merges subnets correctly,
     and validates against expected networks,
@@ -50,7 +65,7 @@ def test_merge_from_fixtures(tmp_path):
     generate_ip_file(extra_path, build_file_lines(extra_nets, generate_asns(len(extra_nets))))
 
     outpath = tmp_path / "final_result.txt"
-    general_merge(base_path, extra_path, None, outpath)
+    general_merge(base_path, extra_path, None, outpath, engine=engine)
     with open(outpath, "r") as f:
         l = f.readlines()
         merged_networks = sorted([line.split()[0] for line in l])
@@ -59,7 +74,8 @@ def test_merge_from_fixtures(tmp_path):
     # with the expected results
     assert merged_networks == expected_networks
 
-def test_merge(tmp_path):
+@pytest.mark.parametrize("engine", MERGE_ENGINES)
+def test_merge(tmp_path, engine):
     '''
     Assert that merging two identical files is a no-op.
     '''
@@ -67,7 +83,7 @@ def test_merge(tmp_path):
     rpki_path, _, out_path = __tmp_paths(tmp_path)
     generate_ip_file(rpki_path, rpki_data)
 
-    general_merge(rpki_path, rpki_path, None, out_path)
+    general_merge(rpki_path, rpki_path, None, out_path, engine=engine)
 
     with open(out_path, "r") as f:
         lines = f.readlines()
@@ -76,7 +92,8 @@ def test_merge(tmp_path):
         assert len(final_ips) == len(rpki_data)
 
 
-def test_merge_disjoint(tmp_path):
+@pytest.mark.parametrize("engine", MERGE_ENGINES)
+def test_merge_disjoint(tmp_path, engine):
     '''
     Test merging non-overlapping sets of IP networks.
     '''
@@ -91,7 +108,7 @@ def test_merge_disjoint(tmp_path):
     rpki_path, irr_path, out_path = __tmp_paths(tmp_path)
     generate_ip_file(rpki_path, rpki_data)
     generate_ip_file(irr_path, irr_data)
-    general_merge(rpki_path, irr_path, None, out_path)
+    general_merge(rpki_path, irr_path, None, out_path, engine=engine)
 
     with open(out_path, "r") as f:
         lines = f.readlines()
@@ -100,7 +117,8 @@ def test_merge_disjoint(tmp_path):
     assert set(final_ips) == (set(irr_ips) | set(rpki_ips))
 
 
-def test_merge_joint(tmp_path):
+@pytest.mark.parametrize("engine", MERGE_ENGINES)
+def test_merge_joint(tmp_path, engine):
     '''
     Test merging overlapping sets of IP networks.
     '''
@@ -114,7 +132,7 @@ def test_merge_joint(tmp_path):
     rpki_path, irr_path, out_path = __tmp_paths(tmp_path)
     generate_ip_file(rpki_path, rpki_data)
     generate_ip_file(irr_path, irr_data)
-    general_merge(rpki_path, irr_path, None, out_path)
+    general_merge(rpki_path, irr_path, None, out_path, engine=engine)
 
     with open(out_path, "r") as f:
         lines = f.readlines()
@@ -123,6 +141,29 @@ def test_merge_joint(tmp_path):
     # no subnets from irr_ips are included in the final merged network list
     assert set(final_ips).isdisjoint(set(irr_ips))
 
+@pytest.mark.parametrize("engine", MERGE_ENGINES)
+@pytest.mark.parametrize("extra_lines", [
+    [],
+    ["not-a-prefix AS3001\n", "45.1.2.300/24 AS3002\n"],
+    # ASNs out of the 32 bit range
+    ["45.1.2.0/24 AS4294967296\n", "45.1.3.0/24 ASXYZ\n"],
+])
+def test_merge_empty_extra(tmp_path, engine, extra_lines):
+    '''
+    Merging an extra file without valid networks only keeps the base.
+    '''
+    rpki_data = generate_file_items(10)
+    rpki_path, irr_path, out_path = __tmp_paths(tmp_path)
+    filtered_path = tmp_path / "irr_filtered.txt"
+    generate_ip_file(rpki_path, rpki_data)
+    generate_ip_file(irr_path, extra_lines)
+
+    general_merge(rpki_path, irr_path, filtered_path, out_path, engine=engine)
+
+    assert out_path.read_text() == "".join(rpki_data)
+    assert filtered_path.read_text() == ""
+
+
 def test_pick_chunk_size():
     '''
     Test picking a chunk size for the merge function.
@@ -133,3 +174,66 @@ def test_pick_chunk_size():
     assert pick_chunk_size(10, workers=4) == 5
     # min_chunk wins
     assert pick_chunk_size(0) == 5
+
+
+def random_entries(rng, count):
+    entries = []
+    for _ in range(count):
+        version = rng.choice((4, 6))
+        bits = 32 if version == 4 else 128
+        prefixlen = rng.randrange(4, bits + 1)
+        root = rng.choice((45, 46)) if version == 4 else rng.choice((0x2001, 0x2a04, 0xffff))
+        netw = (root << (bits - (8 if version == 4 else 16))) | rng.getrandbits(bits - (8 if version == 4 else 16))
+        netw &= ~((1 << (bits - prefixlen)) - 1)
+        entries.append((version, netw, prefixlen, rng.randrange(1, 1 << 32)))
+    return entries
+
+
+def test_vectorized_engine_matches_index():
+    """
+    The vectorized check gives the same result as the index for each
+    network, including addresses right at the ends of the base ranges and
+    IPv6 addresses that differ only in their lower 64 bits.
+    """
+    rng = random.Random(0)
+    base = random_entries(rng, 500)
+    index = BaseNetworkIndex()
+    for version, netw, prefixlen, _ in base:
+        index.add_network(version, netw, prefixlen)
+
+    queries = [(version, netw) for version, netw, _, _ in random_entries(rng, 3000)]
+    for version in (4, 6):
+        starts, ends = index.ranges(version)
+        for start, end in zip(starts, ends):
+            queries += [(version, start), (version, end), (version, end + 1), (version, start - 1)]
+    queries = [(version, netw) for version, netw in queries
+               if 0 <= netw < 1 << (32 if version == 4 else 128)]
+
+    expected = [bool(index.contains_network(version, netw)) for version, netw in queries]
+    covered = contains_networks(index, [v for v, _ in queries],
+                                network_halves([n for _, n in queries]))
+    assert covered.tolist() == expected
+    assert any(expected) and not all(expected)
+
+
+def test_merge_engines_give_same_result(tmp_path):
+    rng = random.Random(1)
+    base = PrefixMap(random_entries(rng, 300))
+    extra = PrefixMap(random_entries(rng, 1000))
+    base_path = tmp_path / "base.txt"
+    extra_path = tmp_path / "extra.txt"
+    base.write(base_path)
+    extra.write(extra_path)
+
+    results = {}
+    for engine in MERGE_ENGINES:
+        out_path = tmp_path / f"out_{engine}.txt"
+        filtered_path = tmp_path / f"filtered_{engine}.txt"
+        general_merge(base_path, extra_path, filtered_path, out_path, engine=engine)
+        merged, filtered = merge_prefix_maps(base, extra, engine=engine)
+        results[engine] = (out_path.read_text(), filtered_path.read_text(),
+                           merged.entries, filtered.entries)
+
+    assert results["vectorized"] == results["index"]
+    assert "".join(merged.lines()) == results["index"][0]
+    assert 0 < len(filtered) < len(extra)
@@ -1,58 +1,99 @@
-import ipaddress
-import pandas as pd
-from kartograf.merge import BaseNetworkIndex
-from kartograf.util import get_root_network
+import pickle
+import random
 
+from kartograf.merge import BaseNetworkIndex, contains_networks, network_halves
+from kartograf.util import normalize_pfx
 
-def _df_from_networks(networks, asn=123):
+
+def _contains(base, networks):
     '''
-    Create a one-row dataframe that holds the extra file rows in the expected format for contains_row().
+    Look up the networks one at a time and all at once, both have to agree.
     '''
-    df = pd.DataFrame(
-        columns=["INETS", "ASNS", "PFXS", "PFXS_LEADING"],
-    )
-    for network in networks:
-        ipn = ipaddress.ip_network(network)
-        root_net = get_root_network(network)
-        network_int = int(ipn.network_address)
-        df.loc[len(df)] = [network_int, asn, str(ipn), root_net]
-    return df
+    normalized = [normalize_pfx(network) for network in networks]
+    single = [base.contains_network(version, netw) for version, netw, _ in normalized]
+    vectorized = contains_networks(base, [version for version, _, _ in normalized],
+                                   network_halves([netw for _, netw, _ in normalized]))
+    assert single == [int(covered) for covered in vectorized]
+    return single
 
 
 def test_base_dict_create():
     '''
-    contains_row returns false when adding a row to an empty base file dict.
+    An empty base contains no networks.
     '''
     base = BaseNetworkIndex()
-    ipv4_network = "10.10.0.0/16"
-    ipv6_network = "2c0f:ff90::/32"
-    df_extra = _df_from_networks([ipv4_network, ipv6_network])
-    for row in df_extra.itertuples(index=False):
-        assert not base.contains_row(row)
+    assert _contains(base, ["10.10.0.0/16", "2c0f:ff90::/32"]) == [0, 0]
 
 
 def test_base_dict_update():
     '''
-    contains_row returns true when adding a row already present in the base dict.
+    A base contains the networks that were added to it.
     '''
     base = BaseNetworkIndex()
     ipv4_network = "10.10.0.0/16"
     ipv6_network = "2c0f:ff90::/32"
     base.update(ipv4_network)
     base.update(ipv6_network)
-    df_extra = _df_from_networks([ipv4_network, ipv6_network])
-    for row in df_extra.itertuples(index=False):
-        assert base.contains_row(row)
+    assert _contains(base, [ipv4_network, ipv6_network]) == [1, 1]
 
 
 def test_check_included_subnet():
     '''
-    contains_row returns true when adding a subnet of a row already present in the base dict.
+    A base contains the subnets of the networks that were added to it.
     '''
     base = BaseNetworkIndex()
-    network = "10.10.0.0/16"
-    base.update(network)
-    subnet = "10.10.0.0/21"
-    df_extra = _df_from_networks([subnet])
-    for row in df_extra.itertuples(index=False):
-        assert base.contains_row(row)
+    base.update("10.10.0.0/16")
+    assert _contains(base, ["10.10.0.0/21", "10.11.0.0/21"]) == [1, 0]
+
+
+def bucket_index_contains(base, version, netw):
+    '''
+    Reference for the index: the base prefixes grouped by their first octet
+    or hextet, each lookup scans the group of the address.
+    '''
+    bits = 32 if version == 4 else 128
+    root_shift = bits - (8 if version == 4 else 16)
+    for base_version, base_netw, prefixlen in base:
+        if base_version != version:
+            continue
+        mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+        if base_netw >> root_shift == netw >> root_shift and netw & mask == base_netw:
+            return 1
+    return 0
+
+
+def random_network(rng, version, min_len=0):
+    bits = 32 if version == 4 else 128
+    prefixlen = rng.randrange(min_len, bits + 1)
+    # Keep the addresses in a few root networks so base and extra overlap
+    top = rng.choice((0x2d, 0x2e, 0xff)) if version == 4 else rng.choice((0x2001, 0x2a04))
+    netw = (top << (bits - (8 if version == 4 else 16))) | rng.getrandbits(bits - (8 if version == 4 else 16))
+    return version, netw & ~((1 << (bits - prefixlen)) - 1), prefixlen
+
+
+def test_index_matches_bucket_index():
+    '''
+    The index gives the same results as the index grouped by root network,
+    also for base prefixes shorter than the root network and for prefixes
+    added after lookups.
+    '''
+    rng = random.Random(0)
+    base = [random_network(rng, rng.choice((4, 6))) for _ in range(400)]
+    base += [(4, 0x2c << 24, 7), (6, 0x2000 << 112, 15)]
+    extra = [random_network(rng, rng.choice((4, 6))) for _ in range(2000)]
+    extra += [(4, 0x2d << 24, 8), (4, 0x2c << 24, 8), (6, 0x2001 << 112, 16)]
+
+    index = BaseNetworkIndex()
+    for network in base[:200]:
+        index.add_network(*network)
+    for version, netw, _ in extra[:100]:
+        assert index.contains_network(version, netw) == bucket_index_contains(base[:200], version, netw)
+    for network in base[200:]:
+        index.add_network(*network)
+    for version, netw, _ in extra:
+        assert index.contains_network(version, netw) == bucket_index_contains(base, version, netw)
+
+    restored = pickle.loads(pickle.dumps(index))
+    assert len(restored) == len(index)
+    assert [restored.contains_network(v, n) for v, n, _ in extra] == \
+        [index.contains_network(v, n) for v, n, _ in extra]
@@ -0,0 +1,279 @@
+from pathlib import Path
+from threading import Barrier
+from types import SimpleNamespace
+
+import pytest
+
+from kartograf.irr.parse import parse_irr
+from kartograf.kartograf import map_stages
+from kartograf.merge import merge_irr
+from kartograf.pipeline import Pipeline, Stage, StageManifest
+from kartograf.profiling import StageProfiler
+from kartograf.rpki.parse import parse_rpki
+from kartograf.sort import sort_result_by_pfx
+from kartograf.util import calculate_sha256_directory, hash_directory
+from .context import TEST_ARGS, create_test_context, setup_test_data
+
+
+def test_independent_stages_run_concurrently():
+    '''
+    Both stages wait for each other, this only finishes if they are running at
+    the same time.
+    '''
+    barrier = Barrier(2, timeout=5)
+    stages = [
+        Stage("a", lambda _: barrier.wait(), outputs=["a.txt"]),
+        Stage("b", lambda _: barrier.wait(), outputs=["b.txt"]),
+    ]
+    Pipeline(stages).run(None)
+
+
+def test_dependent_stages_run_in_order():
+    calls = []
+    stages = [
+        Stage("merge", lambda _: calls.append("merge"), inputs=["a.txt", "b.txt"], outputs=["m.txt"]),
+        Stage("a", lambda _: calls.append("a"), outputs=["a.txt"]),
+        Stage("b", lambda _: calls.append("b"), inputs=["data"], outputs=["b.txt"]),
+        Stage("sort", lambda _: calls.append("sort"), inputs=["m.txt"]),
+    ]
+    pipeline = Pipeline(stages)
+    assert pipeline.dependencies["merge"] == {"a", "b"}
+    assert pipeline.dependencies["b"] == set()
+
+    pipeline.run(None)
+    assert sorted(calls[:2]) == ["a", "b"]
+    assert calls[2:] == ["merge", "sort"]
+
+
+def test_invalid_graphs():
+    with pytest.raises(ValueError, match="produced by both"):
+        Pipeline([Stage("a", print, outputs=["x"]), Stage("b", print, outputs=["x"])])
+
+    with pytest.raises(ValueError, match="cycle"):
+        Pipeline([Stage("a", print, inputs=["y"], outputs=["x"]),
+                  Stage("b", print, inputs=["x"], outputs=["y"])])
+
+
+def test_failing_stage_stops_dependents():
+    calls = []
+
+    def fail(_):
+        raise RuntimeError("stage failed")
+
+    stages = [
+        Stage("a", fail, outputs=["a.txt"]),
+        Stage("b", lambda _: calls.append("b"), inputs=["a.txt"]),
+    ]
+    with pytest.raises(RuntimeError, match="stage failed"):
+        Pipeline(stages).run(None)
+    assert not calls
+
+
+def __run_irr_map(tmp_path, scheduled):
+    context = create_test_context(tmp_path, "111111113")
+    context.args = SimpleNamespace(**{**vars(TEST_ARGS), "irr": True})
+    setup_test_data(context)
+
+    if scheduled:
+        stages = [s for s in map_stages(context)
+                  if s.name in ("parse_rpki", "parse_irr", "merge_irr", "sort")]
+        # The fixtures are already extracted
+        for stage in stages:
+            if stage.name == "parse_irr":
+                stage.funcs = (parse_irr,)
+        Pipeline(stages).run(context)
+    else:
+        for func in (parse_rpki, parse_irr, merge_irr, sort_result_by_pfx):
+            func(context)
+
+    with open(context.final_result_file, "rb") as f:
+        return f.read()
+
+
+def test_scheduled_map_matches_sequential(tmp_path):
+    (tmp_path / "seq").mkdir()
+    (tmp_path / "sched").mkdir()
+    sequential = __run_irr_map(tmp_path / "seq", False)
+    scheduled = __run_irr_map(tmp_path / "sched", True)
+    assert sequential
+    assert scheduled == sequential
+
+
+def test_map_stages_graph(tmp_path):
+    context = create_test_context(tmp_path, "111111114")
+    context.args = SimpleNamespace(**{**vars(TEST_ARGS), "irr": True, "routeviews": True})
+    pipeline = Pipeline(map_stages(context))
+
+    assert pipeline.dependencies["fetch_rpki"] == set()
+    assert pipeline.dependencies["parse_irr"] == {"fetch_irr"}
+    assert pipeline.dependencies["parse_routeviews"] == {"fetch_routeviews"}
+    assert pipeline.dependencies["merge_irr"] == {"parse_rpki", "parse_irr"}
+    assert pipeline.dependencies["merge_routeviews"] == {"merge_irr", "parse_routeviews"}
+    assert pipeline.dependencies["sort"] == {"merge_routeviews"}
+    assert Path(context.final_result_file).name == "final_result.txt"
+
+
+def __copy_stages(tmp_path, calls):
+    source = tmp_path / "source.txt"
+    middle = tmp_path / "middle.txt"
+    result = tmp_path / "result.txt"
+
+    def copy(src, dst, name):
+        def func(context):
+            calls.append(name)
+            context.cleanup_out_files.append(dst)
+            dst.write_text(src.read_text())
+        return func
+
+    return [
+        Stage("first", copy(source, middle, "first"), inputs=[source], outputs=[middle]),
+        Stage("second", copy(middle, result, "second"), inputs=[middle], outputs=[result]),
+    ]
+
+
+def test_resume_skips_completed_stages(tmp_path):
+    calls = []
+    manifest_path = tmp_path / "stage_manifest.json"
+    (tmp_path / "source.txt").write_text("1.0.0.0/24 AS13335\n")
+    stages = __copy_stages(tmp_path, calls)
+
+    Pipeline(stages, StageManifest(manifest_path)).run(SimpleNamespace(cleanup_out_files=[]))
+    assert calls == ["first", "second"]
+    assert set(StageManifest(manifest_path).stages) == {"first", "second"}
+
+    # Nothing changed, so nothing needs to run again, but the intermediate
+    # files are still known for the cleanup
+    calls.clear()
+    context = SimpleNamespace(cleanup_out_files=[])
+    Pipeline(stages, StageManifest(manifest_path)).run(context, resume=True)
+    assert not calls
+    assert tmp_path / "middle.txt" in context.cleanup_out_files
+
+    # A missing output means the stage did not complete
+    (tmp_path / "result.txt").unlink()
+    Pipeline(stages, StageManifest(manifest_path)).run(context, resume=True)
+    assert calls == ["second"]
+
+    # A changed input invalidates the stage and everything depending on it
+    calls.clear()
+    (tmp_path / "source.txt").write_text("1.0.64.0/24 AS38803\n")
+    Pipeline(stages, StageManifest(manifest_path)).run(context, resume=True)
+    assert calls == ["first", "second"]
+    assert (tmp_path / "result.txt").read_text() == "1.0.64.0/24 AS38803\n"
+
+
+def test_manifest_records_the_files_of_each_stage(tmp_path):
+    '''
+    Only the intermediate files a stage created are recorded for it, also
+    when other stages create files at the same time.
+    '''
+    barrier = Barrier(2, timeout=5)
+
+    def create(name):
+        def func(context):
+            context.cleanup_out_files.append(tmp_path / f"{name}.tmp")
+            barrier.wait()
+            context.cleanup_out_files += [tmp_path / f"{name}.txt"]
+            (tmp_path / f"{name}.txt").write_text(name)
+        return func
+
+    stages = [
+        Stage("a", create("a"), outputs=[tmp_path / "a.txt"]),
+        Stage("b", create("b"), outputs=[tmp_path / "b.txt"]),
+    ]
+    context = SimpleNamespace(cleanup_out_files=[tmp_path / "earlier.tmp"])
+    manifest = StageManifest(tmp_path / "stage_manifest.json")
+    Pipeline(stages, manifest).run(context)
+
+    assert manifest.cleanup_files(stages[0]) == [tmp_path / "a.tmp", tmp_path / "a.txt"]
+    assert manifest.cleanup_files(stages[1]) == [tmp_path / "b.tmp", tmp_path / "b.txt"]
+    assert len(context.cleanup_out_files) == 5
+
+
+def test_manifest_reuses_directory_manifest_of_stage(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    cache_manifest = tmp_path / "cache_manifest.json"
+
+    def fetch(_):
+        data_dir.mkdir()
+        (data_dir / "file.txt").write_text("data")
+        hash_directory(data_dir, cache_manifest)
+
+    stage = Stage("fetch", fetch, outputs=[data_dir], manifests={data_dir: cache_manifest})
+
+    def fail(*args):
+        raise AssertionError("directory hashed again")
+
+    with monkeypatch.context() as m:
+        m.setattr("kartograf.pipeline.calculate_sha256_directory", fail)
+        manifest = StageManifest(tmp_path / "stage_manifest.json")
+        Pipeline([stage], manifest).run(SimpleNamespace(cleanup_out_files=[]))
+
+    assert manifest.stages["fetch"]["outputs"][str(data_dir)] == calculate_sha256_directory(data_dir)
+    assert StageManifest(tmp_path / "stage_manifest.json").is_complete(stage)
+
+
+def test_failed_stage_is_not_recorded(tmp_path):
+    manifest_path = tmp_path / "stage_manifest.json"
+
+    def fail(_):
+        raise RuntimeError("stage failed")
+
+    stages = [
+        Stage("a", lambda _: (tmp_path / "a.txt").write_text("a"), outputs=[tmp_path / "a.txt"]),
+        Stage("b", fail, inputs=[tmp_path / "a.txt"], outputs=[tmp_path / "b.txt"]),
+    ]
+    with pytest.raises(RuntimeError):
+        Pipeline(stages, StageManifest(manifest_path)).run(SimpleNamespace(cleanup_out_files=[]))
+
+    manifest = StageManifest(manifest_path)
+    assert set(manifest.stages) == {"a"}
+    assert manifest.is_complete(stages[0])
+    assert not manifest.is_complete(stages[1])
+
+
+def test_profiled_stages(tmp_path):
+    def busy(_):
+        sorted(str(i) for i in range(10000))
+
+    profiler = StageProfiler(tmp_path / "profile", top=5)
+    stages = [
+        Stage("first", busy, outputs=["a.txt"]),
+        Stage("second", busy, inputs=["a.txt"]),
+    ]
+    Pipeline(stages, profiler=profiler).run(None)
+
+    assert (tmp_path / "profile" / "first.prof").exists()
+    assert (tmp_path / "profile" / "second.prof").exists()
+    summary = profiler.write_summary().read_text()
+    assert "first: " in summary
+    assert "second: " in summary
+    assert "busy" in summary
+
+
+def test_profiled_independent_stages_run_serially(tmp_path):
+    '''
+    Enabling a second profiler while another one is active fails on newer
+    Python versions, so independent stages must not overlap when profiled.
+    '''
+    active = []
+    overlaps = []
+
+    def busy(_):
+        active.append(1)
+        overlaps.append(len(active))
+        sorted(str(i) for i in range(10000))
+        active.pop()
+
+    profiler = StageProfiler(tmp_path / "profile", top=5)
+    stages = [
+        Stage("a", busy, outputs=["a.txt"]),
+        Stage("b", busy, outputs=["b.txt"]),
+    ]
+    pipeline = Pipeline(stages, profiler=profiler, max_workers=2)
+    assert pipeline.max_workers == 1
+    pipeline.run(None)
+
+    assert overlaps == [1, 1]
+    assert (tmp_path / "profile" / "a.prof").exists()
+    assert (tmp_path / "profile" / "b.prof").exists()
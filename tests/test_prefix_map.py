@@ -0,0 +1,73 @@
+from pathlib import Path
+import shutil
+from types import SimpleNamespace
+
+from kartograf.collectors.parse import parse_routeviews_pfx2as
+from kartograf.irr.parse import parse_irr
+from kartograf.merge import merge_irr, merge_pfx2as, merge_prefix_maps
+from kartograf.prefix_map import PrefixMap
+from kartograf.rpki.parse import parse_rpki
+from kartograf.sort import sort_result_by_pfx
+from .context import TEST_ARGS, create_test_context, setup_test_data
+
+
+def test_prefix_map_roundtrip(tmp_path):
+    prefix_map = PrefixMap()
+    prefix_map.add_pfx("2001:db8::/32", "AS64496")
+    prefix_map.add_pfx("1.0.0.0/24", 13335)
+    prefix_map.add_pfx("1.0.0.0/16", "AS2519")
+    assert list(prefix_map)[1] == (4, 16777216, 24, 13335)
+
+    prefix_map.sort()
+    path = tmp_path / "map.txt"
+    prefix_map.write(path)
+    assert path.read_text() == "1.0.0.0/24 AS13335\n1.0.0.0/16 AS2519\n2001:db8::/32 AS64496\n"
+    assert PrefixMap.read(path).entries == prefix_map.entries
+
+
+def test_merge_prefix_maps():
+    base = PrefixMap()
+    base.add_pfx("10.10.0.0/16", 1)
+    base.add_pfx("2c0f:ff90::/32", 2)
+    extra = PrefixMap()
+    extra.add_pfx("10.10.4.0/24", 3)
+    extra.add_pfx("11.0.0.0/8", 4)
+    extra.add_pfx("2c0f:ff90:1::/48", 5)
+    extra.add_pfx("2c0f:ff91::/32", 6)
+
+    merged, filtered = merge_prefix_maps(base, extra)
+    assert [e[3] for e in filtered] == [4, 6]
+    assert [e[3] for e in merged] == [1, 2, 4, 6]
+
+
+def __run_map(tmp_path, in_memory, debug=False):
+    context = create_test_context(tmp_path, "111111115")
+    context.args = SimpleNamespace(**{**vars(TEST_ARGS), "irr": True,
+                                      "routeviews": True, "debug": debug})
+    context.in_memory = in_memory
+    setup_test_data(context)
+    shutil.copy2(Path(__file__).parent / "data" / "pfx2asn.txt", context.out_dir_collectors)
+
+    for func in (parse_rpki, parse_irr, merge_irr, parse_routeviews_pfx2as,
+                 merge_pfx2as, sort_result_by_pfx):
+        func(context)
+
+    with open(context.final_result_file, "rb") as f:
+        return context, f.read()
+
+
+def test_in_memory_map_matches_files(tmp_path):
+    for name in ("files", "memory", "debug"):
+        (tmp_path / name).mkdir()
+    _, from_files = __run_map(tmp_path / "files", False)
+    context, in_memory = __run_map(tmp_path / "memory", True)
+    assert from_files
+    assert in_memory == from_files
+
+    # Intermediate files are only written as debug artifacts
+    assert not (Path(context.out_dir_rpki) / "rpki_final.txt").exists()
+    assert not (Path(context.out_dir) / "merged_file_rpki_irr_rv.txt").exists()
+    context, in_memory = __run_map(tmp_path / "debug", True, debug=True)
+    assert in_memory == from_files
+    assert (Path(context.out_dir_rpki) / "rpki_final.txt").exists()
+    assert (Path(context.out_dir) / "merged_file_rpki_irr_rv.txt").exists()
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+from kartograf.rpki.batching import (
+    MAX_BATCH_SIZE,
+    MIN_BATCH_SIZE,
+    adaptive_batch_size,
+    estimate_costs,
+    group_by_repository,
+    make_batches,
+)
+from kartograf.rpki.fetch import validate_rpki_db
+from kartograf.rpki.stream import read_ndjson
+from .context import create_test_context
+from .util.rpki_client import create_fake_rpki_cache, fake_roa, install_fake_rpki_client
+
+
+def test_group_by_repository(tmp_path):
+    files = [tmp_path / "b.net" / "repo" / "2.roa",
+             tmp_path / "a.net" / "repo" / "1.roa",
+             tmp_path / "b.net" / "repo" / "1.roa",
+             tmp_path / "b.net" / "other" / "1.roa"]
+    groups = group_by_repository(files, tmp_path)
+    assert [[str(Path(f).relative_to(tmp_path)) for f in group] for group in groups] == [
+        ["a.net/repo/1.roa"],
+        ["b.net/other/1.roa"],
+        ["b.net/repo/1.roa", "b.net/repo/2.roa"],
+    ]
+
+
+def test_estimate_costs():
+    startup, per_roa = estimate_costs(0.51, 1.14, 64)
+    assert abs(per_roa - 0.01) < 1e-9
+    assert abs(startup - 0.5) < 1e-9
+
+
+def test_adaptive_batch_size():
+    # A startup of 0.5s and 10ms per ROA needs 450 ROAs per batch to keep
+    # the startup below 10% of the run time
+    assert adaptive_batch_size(0.5, 0.01, 100000, 8) == 450
+    # Enough batches for all workers
+    assert adaptive_batch_size(0.5, 0.01, 1000, 8) == 125
+    assert adaptive_batch_size(0.5, 0.01, 100, 8) == MIN_BATCH_SIZE
+    assert adaptive_batch_size(5, 0.0001, 10 ** 7, 8) == MAX_BATCH_SIZE
+    assert adaptive_batch_size(0.5, 0.0, 10 ** 7, 8) == MAX_BATCH_SIZE
+
+
+def test_make_batches():
+    assert make_batches(list(range(5)), 2) == [[0, 1], [2, 3], [4]]
+    assert not make_batches([], 2)
+
+
+def test_validate_rpki_db_records_throughput(tmp_path, monkeypatch):
+    install_fake_rpki_client(tmp_path / "bin", monkeypatch)
+    context = create_test_context(tmp_path, "111111114")
+    context.rpki_workers = 2
+    roas = [fake_roa(f"{i:04x}", f"10.{i // 256}.{i % 256}.0/24", 64496 + i) for i in range(300)]
+    create_fake_rpki_cache(context, roas, repos=7)
+
+    validate_rpki_db(context)
+
+    result = list(read_ndjson(Path(context.out_dir_rpki) / "rpki_raw.ndjson"))
+    assert [roa["hash_id"] for roa in result] == [roa["hash_id"] for roa in roas]
+
+    [entry] = [e for e in context.metrics.stages if e["name"] == "validate_rpki_db"]
+    assert entry["rpki_workers"] == 2
+    assert entry["roas_validated"] == 300
+    assert entry["roas_per_second"] > 0
+    assert entry["rpki_client_processes"] >= 3
@@ -1,7 +1,7 @@
-import json
 import os
 
 from kartograf.rpki.parse import parse_rpki
+from kartograf.rpki.stream import write_ndjson
 from .context import create_test_context, setup_test_data
 
 
@@ -69,9 +69,8 @@ def test_roa_incompletes(tmp_path, capsys):
         }
     ]
 
-    # Write test data to rpki_raw.json
-    with open(os.path.join(context.out_dir_rpki, "rpki_raw.json"), "w") as f:
-        json.dump(test_data, f)
+    # Write test data to rpki_raw.ndjson
+    write_ndjson(test_data, os.path.join(context.out_dir_rpki, "rpki_raw.ndjson"))
 
     parse_rpki(context)
 
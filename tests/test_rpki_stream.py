@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from kartograf.rpki.fetch import validate_rpki_db
+from kartograf.rpki.stream import (
+    iter_json_objects,
+    merge_ndjson,
+    read_ndjson,
+    write_ndjson,
+)
+from .context import create_test_context
+from .util.rpki_client import create_fake_rpki_cache, fake_roa, install_fake_rpki_client
+
+ROAS = [
+    {"hash_id": "b", "type": "roa", "vrps": [{"prefix": "192.0.2.0/24", "asid": 64496}]},
+    {"hash_id": "a", "type": "roa", "aia": "rsync://example.net/ü.cer"},
+    {"hash_id": "c", "type": "roa", "nested": {"text": "}\n{\n\t"}},
+]
+
+
+def rpki_client_output(roas):
+    '''Concatenated pretty printed objects like rpki-client -j -f writes them'''
+    return "\n".join(json.dumps(roa, indent="\t", ensure_ascii=False) for roa in roas).encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1 << 16])
+def test_iter_json_objects_any_chunk_size(chunk_size):
+    output = rpki_client_output(ROAS)
+    chunks = [output[i:i + chunk_size] for i in range(0, len(output), chunk_size)]
+    assert list(iter_json_objects(chunks)) == ROAS
+
+
+def test_iter_json_objects_empty():
+    assert not list(iter_json_objects([b"", b"\n"]))
+
+
+def test_iter_json_objects_truncated():
+    output = rpki_client_output(ROAS)[:-5]
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_objects([output]))
+
+
+def test_ndjson_roundtrip(tmp_path):
+    path = tmp_path / "roas.ndjson"
+    assert write_ndjson(ROAS, path) == 3
+    assert len(path.read_text().splitlines()) == 3
+    assert list(read_ndjson(path)) == ROAS
+
+
+def test_merge_ndjson(tmp_path):
+    first = tmp_path / "1.ndjson"
+    second = tmp_path / "2.ndjson"
+    write_ndjson([{"hash_id": "a", "n": 1}, {"hash_id": "c", "n": 1}], first)
+    write_ndjson([{"hash_id": "a", "n": 2}, {"hash_id": "b", "n": 2}], second)
+    out = tmp_path / "merged.ndjson"
+
+    assert merge_ndjson([first, second], out, key=lambda roa: roa["hash_id"]) == 4
+    merged = [(roa["hash_id"], roa["n"]) for roa in read_ndjson(out)]
+    assert merged == [("a", 1), ("a", 2), ("b", 2), ("c", 1)]
+
+
+def test_validate_rpki_db_streams_sorted_ndjson(tmp_path, monkeypatch):
+    install_fake_rpki_client(tmp_path / "bin", monkeypatch)
+    context = create_test_context(tmp_path, "111111113")
+    roas = [fake_roa(f"{i:04x}", f"10.{i // 256}.{i % 256}.0/24", 64496 + i) for i in reversed(range(600))]
+    create_fake_rpki_cache(context, roas)
+
+    validate_rpki_db(context)
+
+    result = list(read_ndjson(Path(context.out_dir_rpki) / "rpki_raw.ndjson"))
+    assert [roa["hash_id"] for roa in result] == sorted(roa["hash_id"] for roa in roas)
+    assert all(roa["file"].endswith(f"{roa['hash_id']}.roa") for roa in result)
+    # Only the result is left, the per batch files are removed
+    assert [p.name for p in Path(context.out_dir_rpki).iterdir()] == ["rpki_raw.ndjson"]
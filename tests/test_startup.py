@@ -0,0 +1,55 @@
+'''
+Guard the startup cost of the CLI: short invocations must not import the
+heavy dependencies of the map pipeline.
+'''
+from pathlib import Path
+import subprocess
+import sys
+
+HEAVY_MODULES = ("pandas", "numpy", "requests", "bs4", "tqdm")
+
+
+def __loaded_modules(cli_args):
+    '''
+    Run the CLI in a fresh interpreter and return the heavy modules it
+    imported. The root check is bypassed so this works in any environment.
+    '''
+    code = (
+        "import sys\n"
+        "import kartograf.cli as cli\n"
+        "cli.is_root = lambda: False\n"
+        "try:\n"
+        f"    cli.main({cli_args!r})\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                            text=True, check=True,
+                            cwd=Path(__file__).parent.parent)
+    loaded = result.stdout.splitlines()[-1].removeprefix("loaded:")
+    return set(filter(None, loaded.split(",")))
+
+
+def test_version_imports_nothing_heavy():
+    assert not __loaded_modules(["--version"])
+
+
+def test_cov_imports_nothing_heavy(tmp_path):
+    fixtures_path = Path(__file__).parent / "data"
+    args = ["cov", str(fixtures_path / "map_file.txt"), str(fixtures_path / "ip_list.txt"),
+            "-oc", str(tmp_path / "covered.txt")]
+    assert not __loaded_modules(args)
+    assert "192.253.209.69 AS12389\n" in (tmp_path / "covered.txt").read_text()
+
+
+def test_merge_imports_only_pandas(tmp_path):
+    base = tmp_path / "base.txt"
+    extra = tmp_path / "extra.txt"
+    base.write_text("1.0.0.0/16 AS13335\n")
+    extra.write_text("1.0.4.0/24 AS38803\n2.0.0.0/24 AS2519\n")
+    out = tmp_path / "out.txt"
+
+    loaded = __loaded_modules(["merge", "-b", str(base), "-e", str(extra), "-o", str(out)])
+    assert loaded <= {"pandas", "numpy"}
+    assert out.read_text() == "1.0.0.0/16 AS13335\n2.0.0.0/24 AS2519\n"
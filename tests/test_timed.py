@@ -0,0 +1,65 @@
+import json
+from types import SimpleNamespace
+
+from kartograf.rpki.parse import parse_rpki
+from kartograf.timed import RunMetrics, record_counts, timed
+from .context import create_test_context, setup_test_data
+
+
+@timed
+def copy_lines(context, path):
+    with open(path, "r") as f:
+        lines = f.readlines()
+    with open(context.out, "w") as f:
+        f.writelines(lines[1:])
+    record_counts(records_in=len(lines), records_out=len(lines) - 1)
+
+
+def test_timed_records_metrics(tmp_path, capsys):
+    source = tmp_path / "source.txt"
+    source.write_text("header\n1.0.0.0/24 AS13335\n1.0.4.0/24 AS38803\n")
+    context = SimpleNamespace(metrics=RunMetrics(), out=tmp_path / "out.txt")
+
+    copy_lines(context, source)
+    assert "...copy_lines finished in" in capsys.readouterr().out
+
+    assert len(context.metrics.stages) == 1
+    entry = context.metrics.stages[0]
+    assert entry["name"] == "copy_lines"
+    assert entry["records_in"] == 3
+    assert entry["records_out"] == 2
+    assert entry["wall_time"] >= 0
+    assert entry["cpu_time"] >= 0
+    assert entry["peak_rss_kib"] > 0
+    assert entry["bytes_read"] is None or entry["bytes_read"] >= source.stat().st_size
+    assert entry["bytes_written"] is None or entry["bytes_written"] >= context.out.stat().st_size
+
+    report_path = tmp_path / "run_metrics.json"
+    context.metrics.write(report_path, epoch="111111111")
+    with open(report_path, "r") as f:
+        report = json.load(f)
+    assert report["epoch"] == "111111111"
+    assert report["stages"] == [entry]
+
+
+def test_timed_without_metrics():
+    @timed
+    def add(a, b):
+        record_counts(records_in=2, records_out=1)
+        return a + b
+
+    assert add(1, 2) == 3
+    # Outside of a timed function this is a no-op
+    record_counts(records_in=1)
+
+
+def test_parse_rpki_metrics(tmp_path):
+    context = create_test_context(tmp_path, "111111111")
+    setup_test_data(context)
+    parse_rpki(context)
+
+    assert len(context.metrics.stages) == 1
+    entry = context.metrics.stages[0]
+    assert entry["name"] == "parse_rpki"
+    assert entry["records_in"] == 17
+    assert entry["records_out"] == 10
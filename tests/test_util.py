@@ -1,5 +1,22 @@
+from datetime import datetime, timezone
+import ipaddress
+import json
+import os
+from pathlib import Path
+import random
+
 import pytest
-from kartograf.util import parse_pfx, is_valid_pfx, get_root_network, rir_from_str
+from kartograf.util import (
+    calculate_sha256,
+    calculate_sha256_directory,
+    format_pfx,
+    hash_directory,
+    normalize_pfx,
+    parse_iso8601_timestamp,
+    parse_pfx,
+    rir_from_str,
+    snapshot_directory,
+)
 
 
 def test_valid_ipv4_network():
@@ -39,7 +56,7 @@ def test_invalid_prefixes():
         "2001:xyz::/32"      # Invalid IPv6
     ]
     for prefix in invalid_prefixes:
-        assert is_valid_pfx(prefix) is False
+        assert normalize_pfx(prefix) is None
 
 
 def test_private_network():
@@ -50,22 +67,13 @@ def test_private_network():
 def test_ipv4_prefix_with_leading_zeros():
     pfx = "010.10.00.00/16"
     assert parse_pfx(pfx) is None
-    assert not is_valid_pfx(pfx)
+    assert normalize_pfx(pfx) is None
 
 
 def test_ipv6_prefix_with_leading_zeros():
     pfx = "001:db8::0/24"
     assert parse_pfx(pfx) is None
-    assert not is_valid_pfx(pfx)
-
-
-def test_get_root_network():
-    ipv4 = "192.144.11.0/24"
-    assert get_root_network(ipv4) == 192
-    ipv6 = "2001:db8::/64"
-    assert get_root_network(ipv6) == int("2001", 16)
-    invalid = "not.a.network"
-    assert get_root_network(invalid) is None
+    assert normalize_pfx(pfx) is None
 
 
 def test_rir_from_string():
@@ -76,3 +84,149 @@ def test_rir_from_string():
     assert rir_from_str("apnic.db") == "APNIC"
     with pytest.raises(Exception):
         rir_from_str("invalid")
+
+
+def test_snapshot_directory(tmp_path):
+    src = tmp_path / "shared"
+    (src / "repo" / "a").mkdir(parents=True)
+    (src / "repo" / "a" / "1.roa").write_bytes(b"first")
+    (src / "repo" / "2.roa").write_bytes(b"second")
+    dst = tmp_path / "snapshot"
+
+    methods = snapshot_directory(src, dst)
+    assert sum(methods.values()) == 2
+    assert (dst / "repo" / "a" / "1.roa").read_bytes() == b"first"
+    assert calculate_sha256_directory(dst) == calculate_sha256_directory(src)
+
+    # The shared cache replacing a file must not change the snapshot
+    replacement = src / "repo" / "2.roa.tmp"
+    replacement.write_bytes(b"updated")
+    os.replace(replacement, src / "repo" / "2.roa")
+    assert (dst / "repo" / "2.roa").read_bytes() == b"second"
+
+    # Taking another snapshot into the same directory updates it
+    snapshot_directory(src, dst)
+    assert (dst / "repo" / "2.roa").read_bytes() == b"updated"
+
+
+def test_hash_directory_manifest(tmp_path, monkeypatch):
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    files = {"a.roa": b"a", "repo/b.roa": b"b", "repo/sub/c.crl": b"c"}
+    for root, order in ((first, files), (second, dict(reversed(files.items())))):
+        for name, content in order.items():
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_bytes(content)
+
+    manifest_path = tmp_path / "manifest.json"
+    digest, manifest = hash_directory(first, manifest_path)
+    # The digest only depends on the paths and contents of the files
+    assert calculate_sha256_directory(second) == digest
+    assert sorted(manifest["files"]) == sorted(files)
+    assert manifest["files"]["repo/b.roa"]["sha256"] == calculate_sha256(first / "repo" / "b.roa")
+    assert json.loads(manifest_path.read_text()) == manifest
+
+    hashed = []
+    monkeypatch.setattr("kartograf.util.calculate_sha256",
+                        lambda path: hashed.append(Path(path).name) or calculate_sha256(path))
+    (first / "repo" / "b.roa").write_bytes(b"changed")
+    changed_digest, _ = hash_directory(first, manifest_path)
+    assert hashed == ["b.roa"]
+    assert changed_digest != digest
+
+
+def strptime_timestamp(value):
+    try:
+        parsed = datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+    except ValueError:
+        return ValueError
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+def fast_timestamp(value):
+    try:
+        return parse_iso8601_timestamp(value)
+    except ValueError:
+        return ValueError
+
+
+def test_parse_iso8601_timestamp():
+    assert parse_iso8601_timestamp("2009-01-03T18:15:05Z") == 1231006505.0
+    assert parse_iso8601_timestamp("2024-02-29T23:59:59Z") == 1709251199.0
+    with pytest.raises(ValueError):
+        parse_iso8601_timestamp("2023-02-29T00:00:00Z")
+
+
+@pytest.mark.parametrize("value", [
+    "2024-07-30T07:55:18Z",
+    "1970-01-01T00:00:00Z",
+    "2000-02-29T12:00:00Z",
+    "2100-02-29T12:00:00Z",
+    "2024-13-01T00:00:00Z",
+    "2024-00-10T00:00:00Z",
+    "2024-04-31T00:00:00Z",
+    "2024-01-01T24:00:00Z",
+    "2024-01-01T00:60:00Z",
+    "2024-01-01T00:00:60Z",
+    "0000-01-01T00:00:00Z",
+    "2024-1-01T00:00:00Z",
+    "2024-01-01T00:00:00",
+    "2024-01-01 00:00:00Z",
+    "2024-01-01T00:00:00z",
+    "2024-+1-01T00:00:00Z",
+    "2024- 1-01T00:00:00Z",
+    "2024-01-01T00:00:00Z ",
+    "२०२४-01-01T00:00:00Z",
+    "",
+])
+def test_parse_iso8601_timestamp_matches_strptime(value):
+    assert fast_timestamp(value) == strptime_timestamp(value)
+
+
+def test_parse_iso8601_timestamp_random_matches_strptime():
+    """
+    Random timestamps, including out of range fields, give the same result
+    as strptime.
+    """
+    rng = random.Random(0)
+    for _ in range(5000):
+        value = (f"{rng.randrange(1, 10000):04d}-{rng.randrange(0, 14):02d}-"
+                 f"{rng.randrange(0, 33):02d}T{rng.randrange(0, 26):02d}:"
+                 f"{rng.randrange(0, 62):02d}:{rng.randrange(0, 62):02d}Z")
+        assert fast_timestamp(value) == strptime_timestamp(value), value
+
+
+def reference_normalize_pfx(pfx):
+    try:
+        network = ipaddress.ip_network(pfx)
+    except ValueError:
+        return None
+    return (network.version, int(network.network_address), network.prefixlen)
+
+
+@pytest.mark.parametrize("pfx", [
+    "192.144.11.0/24", "0.0.0.0/0", "255.255.255.255/32", "1.2.3.4", "1.2.3.4/31",
+    "1.0.0.0/024", "1.0.0.0/33", "1.0.0.0/ 8", "1.0.0.0/+8", "1.0.0.0/255.0.0.0",
+    "1.0.0.0/8 ", "01.0.0.0/8", "1.0.0.256/32", "1.0.0/24", "1.0.0.0.0/24", "1..0.0/24",
+    "१.0.0.0/8", "1.0.0.0/", "/8", "", "2001:db8::/32", "2001:DB8:0::/48",
+    "2001:db8::1/32", "::ffff:1.2.3.4/128", "::/0", "2001:db8::",
+])
+def test_normalize_pfx_matches_ipaddress(pfx):
+    assert normalize_pfx(pfx) == reference_normalize_pfx(pfx)
+    if normalize_pfx(pfx) and "/" in pfx:
+        assert format_pfx(*normalize_pfx(pfx)) == str(ipaddress.ip_network(pfx))
+
+
+def test_normalize_pfx_random_matches_ipaddress():
+    rng = random.Random(0)
+    for _ in range(5000):
+        prefixlen = rng.randrange(0, 34)
+        if rng.random() < 0.5:
+            network = ".".join(str(rng.choice((0, 1, 10, 192, 255, rng.randrange(256))))
+                               for _ in range(4))
+        else:
+            network = str(ipaddress.IPv6Address(rng.getrandbits(128) >> rng.randrange(129)))
+        pfx = f"{network}/{prefixlen}"
+        assert normalize_pfx(pfx) == reference_normalize_pfx(pfx), pfx
+        if normalize_pfx(pfx):
+            assert format_pfx(*normalize_pfx(pfx)) == str(ipaddress.ip_network(pfx)), pfx
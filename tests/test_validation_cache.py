@@ -0,0 +1,124 @@
+from pathlib import Path
+import shutil
+
+from kartograf.rpki.fetch import validate_rpki_db
+from kartograf.rpki.validation_cache import NEAR_EXPIRY, certificate_issuer
+from .context import create_test_context
+from .util.rpki_client import (
+    create_fake_rpki_cache,
+    fake_cert,
+    fake_roa,
+    install_fake_rpki_client,
+    validated_files,
+)
+
+EPOCH = 1730000000
+ROAS = [fake_roa(f"{i:04x}", f"10.0.{i}.0/24", 64496 + i) for i in range(30)]
+
+
+def run_validation(tmp_path, epoch, cache_file, previous=None):
+    '''
+    Validate the RPKI cache of a new run, which is a copy of the cache of the
+    previous run if there is one. Returns the context and the result.
+    '''
+    context = create_test_context(tmp_path, str(epoch))
+    context.validation_cache_file = cache_file
+    if previous is None:
+        create_fake_rpki_cache(context, ROAS)
+    else:
+        shutil.rmtree(context.data_dir_rpki_cache)
+        shutil.copytree(previous.data_dir_rpki_cache, context.data_dir_rpki_cache)
+        shutil.copytree(previous.data_dir_rpki_tals, context.data_dir_rpki_tals,
+                        dirs_exist_ok=True)
+
+    validate_rpki_db(context)
+    return context, (Path(context.out_dir_rpki) / "rpki_raw.ndjson").read_text()
+
+
+def full_validation(context):
+    '''The result of validating every ROA of the context's cache again'''
+    cache_file = context.validation_cache_file
+    context.validation_cache_file = None
+    validate_rpki_db(context)
+    context.validation_cache_file = cache_file
+    return (Path(context.out_dir_rpki) / "rpki_raw.ndjson").read_text()
+
+
+def test_unchanged_roas_are_not_validated_again(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    install_fake_rpki_client(bin_dir, monkeypatch)
+    cache_file = tmp_path / "validation_cache.json"
+
+    first, _ = run_validation(tmp_path, EPOCH, cache_file)
+    assert len(validated_files(bin_dir)) == len(ROAS)
+    assert cache_file.exists()
+
+    second, result = run_validation(tmp_path, EPOCH + 3600, cache_file, previous=first)
+    assert not validated_files(bin_dir)
+    assert result == full_validation(second)
+
+
+def test_changed_roas_and_chains_are_validated_again(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    install_fake_rpki_client(bin_dir, monkeypatch)
+    cache_file = tmp_path / "validation_cache.json"
+    first, _ = run_validation(tmp_path, EPOCH, cache_file)
+    validated_files(bin_dir)
+
+    cache = Path(first.data_dir_rpki_cache)
+    changed_roa = cache / "rpki.repo1.net" / "repository" / "0001.roa"
+    changed_roa.write_text(changed_roa.read_text().replace("64497", "64511"))
+    # A new CRL of the issuer's parent may revoke the issuer of all ROAs of
+    # the repository
+    (cache / "rpki.repo2.net" / "parent" / "ca.crl").write_text("new crl")
+
+    second, result = run_validation(tmp_path, EPOCH + 3600, cache_file, previous=first)
+    validated = {Path(f).name for f in validated_files(bin_dir)}
+    repo2_roas = {f"{roa['hash_id']}.roa" for roa in ROAS[2::3]}
+    assert validated == {"0001.roa"} | repo2_roas
+    assert "64511" in result
+    assert result == full_validation(second)
+
+
+def test_changes_up_to_the_trust_anchor_are_validated_again(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    install_fake_rpki_client(bin_dir, monkeypatch)
+    cache_file = tmp_path / "validation_cache.json"
+    first, _ = run_validation(tmp_path, EPOCH, cache_file)
+    validated_files(bin_dir)
+
+    # The trust anchor may have revoked the certificate above the issuer
+    cache = Path(first.data_dir_rpki_cache)
+    (cache / "rpki.repo0.net" / "ta" / "ca.crl").write_text("new crl")
+
+    second, result = run_validation(tmp_path, EPOCH + 3600, cache_file, previous=first)
+    validated = {Path(f).name for f in validated_files(bin_dir)}
+    assert validated == {f"{roa['hash_id']}.roa" for roa in ROAS[0::3]}
+    assert result == full_validation(second)
+
+
+def test_certificate_issuer(tmp_path):
+    cert = tmp_path / "ca.cer"
+    cert.write_bytes(fake_cert("ca", "rsync://rpki.example.net/ta/ta.cer"))
+    assert certificate_issuer(cert) == "rsync://rpki.example.net/ta/ta.cer"
+
+    # Long form of the length
+    uri = "rsync://rpki.example.net/" + "a" * 200 + ".cer"
+    cert.write_bytes(b"der" + bytes.fromhex("06082b06010505073002") + bytes([0x86, 0x81, len(uri)])
+                     + uri.encode() + b"more")
+    assert certificate_issuer(cert) == uri
+
+    cert.write_bytes(fake_cert("ta"))
+    assert certificate_issuer(cert) is None
+
+
+def test_roas_near_expiry_are_validated_again(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    install_fake_rpki_client(bin_dir, monkeypatch)
+    cache_file = tmp_path / "validation_cache.json"
+    expiring = ROAS[0]["valid_until"] - NEAR_EXPIRY // 2
+
+    first, _ = run_validation(tmp_path, EPOCH, cache_file)
+    validated_files(bin_dir)
+    run_validation(tmp_path, expiring, cache_file, previous=first)
+    assert len(validated_files(bin_dir)) == len(ROAS)
@@ -0,0 +1,155 @@
+'''
+A local HTTP stand-in for the download servers of the data sources, to test
+and benchmark downloads without network access.
+
+The server serves files from memory with keep-alive connections, Range
+requests, If-Range and conditional requests with ETag or Last-Modified. It
+can simulate a flaky connection that breaks off the first responses for
+each file after a number of bytes.
+'''
+from collections import defaultdict
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import re
+from threading import Lock, Thread
+import time
+
+
+class StandInServer:
+    '''
+    files maps URL paths to their content. The first `failures` responses
+    for each file break off after `fail_after` bytes. With a bandwidth in
+    bytes per second, the responses are sent at that speed. A range_shift
+    moves the start of the ranges that are sent away from the requested
+    one, like a broken proxy.
+    '''
+    def __init__(self, files, failures=0, fail_after=0, supports_range=True, bandwidth=None,
+                 range_shift=0):
+        self.files = files
+        self.failures = failures
+        self.fail_after = fail_after
+        self.supports_range = supports_range
+        self.range_shift = range_shift
+        self.bandwidth = bandwidth
+        # Last-Modified header per path, files that are changed by a test
+        # should get a new one
+        self.last_modified = {}
+        self.requests = []
+        self.max_active = 0
+        self._active = 0
+        self._responses = defaultdict(int)
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def start_request(self, handler):
+        '''Record a request, returns how many responses were sent for the path before'''
+        with self._lock:
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+            self.requests.append({"path": handler.path, "client": handler.client_address,
+                                  "headers": dict(handler.headers)})
+            attempt = self._responses[handler.path]
+            self._responses[handler.path] += 1
+        return attempt
+
+    def finish_request(self):
+        with self._lock:
+            self._active -= 1
+
+    def connections(self):
+        '''Number of distinct client connections that sent requests'''
+        with self._lock:
+            return len({request["client"] for request in self.requests})
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            '''Serves the files of the server'''
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                attempt = server.start_request(self)
+                try:
+                    self._get(attempt)
+                finally:
+                    server.finish_request()
+
+            def _get(self, attempt):
+                content = server.files.get(self.path)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+                last_modified = server.last_modified.get(self.path, "Sat, 03 Jan 2009 18:15:05 GMT")
+                if_none_match = self.headers.get("If-None-Match")
+                if ((if_none_match and if_none_match == etag)
+                        or (not if_none_match and self.headers.get("If-Modified-Since") == last_modified)):
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                start = 0
+                match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+                # The range is only sent if the file is still the version
+                # the client has a part of
+                if_range = self.headers.get("If-Range")
+                if match and if_range and if_range not in (etag, last_modified):
+                    match = None
+                if match and server.supports_range:
+                    start = max(int(match.group(1)) + server.range_shift, 0)
+                    if start >= len(content):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(content)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+                else:
+                    self.send_response(200)
+                body = content[start:]
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                if attempt < server.failures:
+                    # Break off the response, the client sees a truncated body
+                    self._send(body[:server.fail_after])
+                    self.close_connection = True  # pylint: disable=attribute-defined-outside-init
+                    return
+                self._send(body)
+
+            def _send(self, body):
+                if not server.bandwidth:
+                    self.wfile.write(body)
+                    return
+                step = max(server.bandwidth // 100, 1)
+                for i in range(0, len(body), step):
+                    self.wfile.write(body[i:i + step])
+                    time.sleep(step / server.bandwidth)
+
+        return Handler
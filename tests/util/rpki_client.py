@@ -0,0 +1,158 @@
+'''
+A stand-in for rpki-client to test the RPKI validation without network
+access or a real RPKI cache.
+
+The ROA files of the fake cache contain the JSON object rpki-client would
+print for them. The stand-in prints these objects for the files passed with
+-f, the way rpki-client -j -f does, and logs the files it validated to
+validated.log next to it. Without -f it writes the VRPs of all valid ROAs
+of the cache to the json file in the output directory, like a full
+rpki-client run. There the expiry of each VRP is the earliest expiry of
+its certificate chain, which is the chain_expires of the fake ROA if it
+expires before the ROA itself.
+'''
+import json
+import os
+from pathlib import Path
+import stat
+import sys
+
+FAKE_RPKI_CLIENT = '''#!{python}
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+# Simulated cost of loading the TALs and of validating a single ROA
+time.sleep(float(os.environ.get("FAKE_RPKI_CLIENT_STARTUP", 0)))
+PER_ROA = float(os.environ.get("FAKE_RPKI_CLIENT_PER_ROA", 0))
+
+args = sys.argv[1:]
+epoch = int(args[args.index("-P") + 1])
+
+
+def validate(path):
+    time.sleep(PER_ROA)
+    with open(path) as f:
+        roa = json.load(f)
+    if not int(roa["valid_since"]) <= epoch <= int(roa["valid_until"]):
+        roa["validation"] = "expired"
+    return roa
+
+
+if "-f" in args:
+    files = args[args.index("-f") + 1:]
+    with open({log!r}, "a") as log:
+        log.writelines(path + "\\n" for path in files)
+    for path in files:
+        roa = validate(path)
+        roa["file"] = path
+        print(json.dumps(roa, indent="\\t"))
+else:
+    # Validate the whole cache and write the VRPs to the output directory
+    cache = Path(args[args.index("-d") + 1])
+    vrps = []
+    for path in sorted(cache.rglob("*.roa")):
+        roa = validate(path)
+        if roa["validation"] != "OK":
+            continue
+        vrps += [{{"asn": int(vrp["asid"]), "prefix": vrp["prefix"],
+                  "maxLength": int(vrp["maxlen"]), "ta": "fake",
+                  "expires": min(int(roa["valid_until"]),
+                                 int(roa.get("chain_expires", roa["valid_until"])))}}
+                 for vrp in roa["vrps"]]
+    with open(Path(args[-1]) / "json", "w") as f:
+        json.dump({{"metadata": {{}}, "roas": vrps}}, f)
+'''
+
+RIRS = ["afrinic", "apnic", "arin", "lacnic", "ripe"]
+
+
+def install_fake_rpki_client(bin_dir, monkeypatch=None):
+    '''
+    Put the stand-in rpki-client first on the PATH, for the current test if
+    a pytest monkeypatch is given and for the rest of the process otherwise.
+    '''
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    script = bin_dir / "rpki-client"
+    log = bin_dir / "validated.log"
+    script.write_text(FAKE_RPKI_CLIENT.format(python=sys.executable, log=str(log)))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    path = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+    if monkeypatch is None:
+        os.environ["PATH"] = path
+    else:
+        monkeypatch.setenv("PATH", path)
+    return script
+
+
+def fake_roa(hash_id, prefix, asn, valid_until=1752518962, valid_since=1721069062,
+             chain_expires=None):
+    roa = {
+        "type": "roa",
+        "hash_id": hash_id,
+        "aki": "A1:B1",
+        "ski": f"SKI:{hash_id}",
+        "validation": "OK",
+        "valid_since": valid_since,
+        "valid_until": valid_until,
+        "vrps": [{"prefix": prefix, "asid": asn, "maxlen": int(prefix.split("/")[1])}],
+    }
+    if chain_expires is not None:
+        roa["chain_expires"] = chain_expires
+    return roa
+
+
+def validated_files(bin_dir):
+    '''The files the stand-in validated since the last call'''
+    log = Path(bin_dir) / "validated.log"
+    if not log.exists():
+        return []
+    files = log.read_text().splitlines()
+    log.unlink()
+    return files
+
+
+def fake_cert(name, issuer_uri=None):
+    '''
+    The bytes of a stand-in CA certificate, with the authority information
+    access extension of a DER encoded certificate if it has an issuer.
+    '''
+    cert = f"cer of {name}".encode()
+    if issuer_uri is not None:
+        uri = issuer_uri.encode()
+        cert += bytes.fromhex("06082b06010505073002") + bytes([0x86, len(uri)]) + uri
+    return cert
+
+
+def create_fake_rpki_cache(context, roas, repos=3):
+    '''
+    Write the ROAs into the RPKI cache of the context, spread over a few
+    repository directories, and create the TALs. The ROAs of each repository
+    are issued by a CA certificate in a parent publication point, which is
+    issued by a trust anchor certificate in a third one. Each publication
+    point has a CRL and a manifest.
+    '''
+    cache = Path(context.data_dir_rpki_cache)
+    for i, roa in enumerate(roas):
+        host = f"rpki.repo{i % repos}.net"
+        repo = cache / host / "repository"
+        parent = cache / host / "parent"
+        anchor = cache / host / "ta"
+        if not repo.exists():
+            for pub_point in (repo, parent, anchor):
+                pub_point.mkdir(parents=True)
+                (pub_point / "ca.crl").write_text(f"crl of {pub_point.name}")
+                (pub_point / "ca.mft").write_text(f"mft of {pub_point.name}")
+            (parent / "ca.cer").write_bytes(fake_cert(host, f"rsync://{host}/ta/ta.cer"))
+            (anchor / "ta.cer").write_bytes(fake_cert(f"ta of {host}"))
+        roa = dict(roa, aia=f"rsync://{host}/parent/ca.cer")
+        with open(repo / f"{roa['hash_id']}.roa", "w") as f:
+            json.dump(roa, f)
+
+    tals = Path(context.data_dir_rpki_tals)
+    tals.mkdir(parents=True, exist_ok=True)
+    for rir in RIRS:
+        (tals / f"{rir}.tal").write_text(f"rsync://rpki.{rir}.net/ta.cer\n")